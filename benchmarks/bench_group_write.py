@@ -0,0 +1,65 @@
+import os
+import sys
+import logging
+from statistics import quantiles
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gpio_backend import SimulatedGpioBackend
+from gpio_manager import OutGpio, OutGpioGroup, EventBus
+
+
+# skew (first to last level change of one bank update) and throughput of group writes against per-pin writes
+# usage: python benchmarks/bench_group_write.py [outputs] [updates]
+
+class RecordingBackend(SimulatedGpioBackend):
+
+    def __init__(self):
+        super().__init__()
+        self.writes = []
+
+    def write(self, gpio_number: int, level: bool):
+        self.writes.append(perf_counter())
+        super().write(gpio_number, level)
+
+    def write_many(self, levels):
+        now = perf_counter()
+        self.writes.extend([now] * len(levels))
+        super().write_many(levels)
+
+
+def report(title: str, skews, elapsed_sec: float, updates: int):
+    percentiles = quantiles(skews, n=100)
+    print(f"{title:9s} skew p50={percentiles[49] * 1e6:.1f}us p99={percentiles[98] * 1e6:.1f}us max={max(skews) * 1e6:.1f}us  throughput={updates / elapsed_sec:.0f} updates/s")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    outputs = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    updates = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+
+    backend = RecordingBackend()
+    bus = EventBus()
+    gpios = [OutGpio(gpio_number, "out" + str(gpio_number), "", False, backend=backend, bus=bus) for gpio_number in range(outputs)]
+    group = OutGpioGroup("bank", "", gpios)
+    all_on = group.max_mask
+    print(f"outputs={outputs} updates={updates} (alternating all on / all off)")
+
+    skews = []
+    start = perf_counter()
+    for i in range(updates):
+        backend.writes.clear()
+        on = i % 2 == 0
+        for gpio in gpios:
+            gpio.switch(on)
+        skews.append(backend.writes[-1] - backend.writes[0])
+    report("per-pin", skews, perf_counter() - start, updates)
+
+    skews = []
+    start = perf_counter()
+    for i in range(updates):
+        backend.writes.clear()
+        group.set(all_on if i % 2 == 0 else 0)
+        skews.append(backend.writes[-1] - backend.writes[0])
+    report("group", skews, perf_counter() - start, updates)
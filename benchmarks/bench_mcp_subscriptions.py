@@ -0,0 +1,89 @@
+import os
+import sys
+import asyncio
+import logging
+from time import perf_counter, sleep
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pydantic import AnyUrl
+from mcp import ClientSession, types
+from mcp.client.sse import sse_client
+from gpio_backend import SimulatedGpioBackend
+from gpio_manager import InGpio, OutGpio
+from gpio_manager_mcp import GpioManagerMCPServer
+
+
+# resource subscriptions and batch tools of the MCP server, checked with a local MCP client against the simulated
+# backend: notifications of a subscribed input during an edge burst (throttled per client), round trips of
+# get_states/set_states against one get_state/set_state call per pin
+# usage: python benchmarks/bench_mcp_subscriptions.py [pins] [burst_edges] [port]
+
+
+def burst(backend: SimulatedGpioBackend, gpio_number: int, edges: int, duration_sec: float):
+    level = backend.read(gpio_number)
+    for _ in range(edges):
+        level = not level
+        backend.set_level(gpio_number, level)
+        sleep(duration_sec / edges)
+
+
+async def run_client(port: int, backend: SimulatedGpioBackend, pins: int, burst_edges: int):
+    updates = []
+
+    async def on_message(message):
+        if isinstance(message, types.ServerNotification) and isinstance(message.root, types.ResourceUpdatedNotification):
+            updates.append((perf_counter(), str(message.root.params.uri)))
+
+    async with sse_client(f"http://localhost:{port}/sse") as (read, write):
+        async with ClientSession(read, write, message_handler=on_message) as session:
+            result = await session.initialize()
+            print(f"server announces resource subscriptions: {result.capabilities.resources.subscribe}")
+            await session.subscribe_resource(AnyUrl("inputpin://in0"))
+
+            duration_sec = 2
+            await asyncio.to_thread(burst, backend, 2, burst_edges, duration_sec)
+            await asyncio.sleep(1)
+            received = [uri for _, uri in updates]
+            print(f"burst of {burst_edges} edges within {duration_sec}s on in0: {received.count('inputpin://in0')} notifications "
+                  f"({len([uri for uri in received if uri != 'inputpin://in0'])} of other resources)")
+            content = await session.read_resource(AnyUrl("inputpin://in0"))
+            print(f"inputpin://in0: {content.contents[0].text}")
+
+            names = [f"in{i}" for i in range(pins)] + [f"out{i}" for i in range(pins)]
+            start = perf_counter()
+            for name in names:
+                await session.call_tool("get_state", {"name": name})
+            single_sec = perf_counter() - start
+            start = perf_counter()
+            result = await session.call_tool("get_states", {"names": names})
+            batch_sec = perf_counter() - start
+            print(f"states of {len(names)} pins: {len(names)} get_state calls {single_sec * 1000:.1f}ms, one get_states call {batch_sec * 1000:.1f}ms ({len(result.content[0].text.splitlines())} lines)")
+
+            states = {f"out{i}": True for i in range(pins)}
+            start = perf_counter()
+            for name, on in states.items():
+                await session.call_tool("set_state", {"name": name, "on": on})
+            single_sec = perf_counter() - start
+            states = {name: False for name in states.keys()}
+            start = perf_counter()
+            result = await session.call_tool("set_states", {"states": states})
+            batch_sec = perf_counter() - start
+            print(f"switching {pins} outputs: {pins} set_state calls {single_sec * 1000:.1f}ms, one set_states call {batch_sec * 1000:.1f}ms")
+            result = await session.call_tool("set_states", {"states": {"out0": True, "unknown": True}})
+            print(f"set_states with an unknown name: {result.content[0].text}")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    pins = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    burst_edges = int(sys.argv[2]) if len(sys.argv) > 2 else 400
+    port = int(sys.argv[3]) if len(sys.argv) > 3 else 9660
+
+    backend = SimulatedGpioBackend()
+    ins = {f"in{i}": InGpio(2 + i, f"in{i}", f"input {i}", False, bouncetime_ms=0, backend=backend, poll_thread=False) for i in range(pins)}
+    outs = {f"out{i}": OutGpio(100 + i, f"out{i}", f"output {i}", False, backend=backend) for i in range(pins)}
+    server = GpioManagerMCPServer("bench", port, ins, outs, notify_interval_sec=0.5)
+    server.start()
+    sleep(1)
+    asyncio.run(run_client(port, backend, pins, burst_edges))
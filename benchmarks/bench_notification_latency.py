@@ -0,0 +1,43 @@
+import os
+import sys
+import logging
+from statistics import quantiles
+from time import monotonic, sleep
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gpio_backend import SimulatedGpioBackend
+from gpio_manager import InGpio, EventBus
+
+
+# measures edge injection -> listener notification latency and throughput against the simulated backend
+# usage: python benchmarks/bench_notification_latency.py [pins] [edges_per_sec] [duration_sec]
+
+def run(pins: int, rate_hz: float, duration_sec: float):
+    backend = SimulatedGpioBackend()
+    bus = EventBus()
+    injected = {}
+    latencies = []
+
+    gpios = [InGpio(gpio_number, "pin" + str(gpio_number), "", False, bouncetime_ms=0, poll_interval_sec=3600, backend=backend, bus=bus) for gpio_number in range(pins)]
+    for gpio in gpios:
+        gpio.register_listener(lambda gpio=gpio: latencies.append(monotonic() - injected[gpio.gpio_number]))
+
+    start = monotonic()
+    count = backend.random_edges([gpio.gpio_number for gpio in gpios], rate_hz, duration_sec, seed=42, on_edge=lambda gpio_number, time: injected.__setitem__(gpio_number, time))
+    elapsed = monotonic() - start
+    sleep(0.5)  # let the dispatch threads drain their queues
+
+    percentiles = quantiles(latencies, n=100)
+    print(f"pins={pins} target={rate_hz:.0f}/s injected={count} achieved={count / elapsed:.0f}/s notified={len(latencies)}")
+    dropped = sum(subscription['dropped'] for subscription in bus.metrics()['subscriptions'])
+    max_depth = max(subscription['queue_max_depth'] for subscription in bus.metrics()['subscriptions'])
+    print(f"published={bus.published} dropped={dropped} queue_max_depth={max_depth}")
+    print(f"latency p50={percentiles[49] * 1e6:.1f}us p99={percentiles[98] * 1e6:.1f}us max={max(latencies) * 1e6:.1f}us")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    run(int(sys.argv[1]) if len(sys.argv) > 1 else 32,
+        float(sys.argv[2]) if len(sys.argv) > 2 else 5000,
+        float(sys.argv[3]) if len(sys.argv) > 3 else 5)
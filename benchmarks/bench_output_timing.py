@@ -0,0 +1,50 @@
+import os
+import sys
+import logging
+from statistics import quantiles
+from time import monotonic, sleep
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gpio_backend import SimulatedGpioBackend
+from gpio_manager import OutGpio, EventBus
+
+
+# timing accuracy of on-device blinking (all outputs driven by the single scheduler thread) against the simulated backend
+# usage: python benchmarks/bench_output_timing.py [outputs] [on_ms] [off_ms] [count]
+
+class RecordingBackend(SimulatedGpioBackend):
+
+    def __init__(self):
+        super().__init__()
+        self.writes = {}
+
+    def write(self, gpio_number: int, level: bool):
+        self.writes.setdefault(gpio_number, []).append(monotonic())
+        super().write(gpio_number, level)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    outputs = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    on_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 20
+    off_ms = float(sys.argv[3]) if len(sys.argv) > 3 else 20
+    count = int(sys.argv[4]) if len(sys.argv) > 4 else 50
+
+    backend = RecordingBackend()
+    bus = EventBus()
+    gpios = [OutGpio(gpio_number, "out" + str(gpio_number), "", False, backend=backend, bus=bus) for gpio_number in range(outputs)]
+    backend.writes.clear()
+    for gpio in gpios:
+        gpio.blink(on_ms / 1000, off_ms / 1000, count)
+    sleep(count * (on_ms + off_ms) / 1000 + 0.5)
+
+    errors = []
+    for gpio in gpios:
+        writes = backend.writes[gpio.gpio_number]
+        for i, time in enumerate(writes):
+            expected = writes[0] + (i // 2) * (on_ms + off_ms) / 1000 + (on_ms / 1000 if i % 2 == 1 else 0)
+            errors.append(abs(time - expected))
+    percentiles = quantiles(errors, n=100)
+    print(f"outputs={outputs} blink={on_ms}/{off_ms}ms x{count} edges={len(errors)}")
+    print(f"timing error p50={percentiles[49] * 1000:.3f}ms p99={percentiles[98] * 1000:.3f}ms max={max(errors) * 1000:.3f}ms")
@@ -0,0 +1,71 @@
+import os
+import sys
+import logging
+import tracemalloc
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gpio_backend import SimulatedGpioBackend
+from gpio_manager import InGpio, EventBus
+from pulse_counter import PulseCounter
+
+
+# per-edge cost of a pulse counter against an input which publishes each change, and paced pulse trains at a
+# fixed frequency to check the count, rates and frequency readings
+# usage: python benchmarks/bench_pulse_counter.py [edges] [frequency_hz]
+
+
+def edge_cost_us(backend: SimulatedGpioBackend, gpio_number: int, edges: int) -> float:
+    level = backend.read(gpio_number)
+    start = perf_counter()
+    for _ in range(edges):
+        level = not level
+        backend.set_level(gpio_number, level)
+    return (perf_counter() - start) / edges * 1_000_000
+
+
+def allocated_blocks_per_edge(backend: SimulatedGpioBackend, gpio_number: int, edges: int) -> float:
+    tracemalloc.start()
+    level = backend.read(gpio_number)
+    before = tracemalloc.take_snapshot()
+    for _ in range(edges):
+        level = not level
+        backend.set_level(gpio_number, level)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    return sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0) / edges
+
+
+def paced(backend: SimulatedGpioBackend, counter: PulseCounter, gpio_number: int, frequency_hz: float, duration_sec: float):
+    # busy waiting, as sleep() is too coarse for kHz rates
+    interval = 1 / frequency_hz
+    start = perf_counter()
+    due = start
+    count = counter.count
+    while due - start < duration_sec:
+        while perf_counter() < due:
+            pass
+        backend.set_level(gpio_number, True)
+        backend.set_level(gpio_number, False)
+        due += interval
+    return counter.count - count
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    edges = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    frequency_hz = float(sys.argv[2]) if len(sys.argv) > 2 else 5000
+
+    backend = SimulatedGpioBackend()
+    counter = PulseCounter(2, "meter", "meter", edge="both", backend=backend)
+    in_gpio = InGpio(3, "door", "door", False, bouncetime_ms=0, backend=backend, bus=EventBus(), poll_thread=False)
+    print(f"per edge (simulated interrupt incl. backend dispatch), {edges} edges")
+    print(f"  counter  {edge_cost_us(backend, 2, edges):6.2f}us  {allocated_blocks_per_edge(backend, 2, edges // 10):5.2f} retained blocks/edge")
+    print(f"  input    {edge_cost_us(backend, 3, edges // 10):6.2f}us  {allocated_blocks_per_edge(backend, 3, edges // 100):5.2f} retained blocks/edge")
+    counter.close()
+
+    counter = PulseCounter(4, "anemometer", "anemometer", backend=backend)
+    pulses = paced(backend, counter, 4, frequency_hz, 2)
+    state = counter.state()
+    print(f"paced {frequency_hz:.0f}Hz for 2s: counted {pulses}, {state['pulses_per_sec']}/s, {state['pulses_per_min']}/min (2s of pulses), frequency {state['frequency_hz']}Hz")
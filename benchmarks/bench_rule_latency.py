@@ -0,0 +1,98 @@
+import os
+import sys
+import json
+import logging
+import http.client
+from statistics import quantiles
+from threading import Thread, Event
+from time import perf_counter, sleep
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gpio_backend import SimulatedGpioBackend
+from gpio_manager import InGpio, OutGpio, EventBus
+from gpio_manager_web import GpioManagerWebServer
+from rule_engine import RuleEngine, FollowRule
+
+
+# edge-to-output latency of a follow rule of the rule engine against an external client which subscribes to the
+# changes (SSE of the plain web API) and switches the output by a request, both against the simulated backend
+# usage: python benchmarks/bench_rule_latency.py [edges] [port]
+
+
+class RecordingBackend(SimulatedGpioBackend):
+
+    def __init__(self):
+        super().__init__()
+        self.written = {}
+        self.write_event = Event()
+
+    def write(self, gpio_number: int, level: bool):
+        super().write(gpio_number, level)
+        self.written[gpio_number] = perf_counter()
+        self.write_event.set()
+
+
+def measure(backend: RecordingBackend, edges: int, in_gpio_number: int, out_gpio_number: int, timeout_sec: float = 2) -> list:
+    latencies = []
+    level = backend.read(in_gpio_number)
+    for _ in range(edges):
+        level = not level
+        backend.write_event.clear()
+        start = perf_counter()
+        backend.set_level(in_gpio_number, level)
+        while backend.read(out_gpio_number) != level:
+            if not backend.write_event.wait(timeout_sec):
+                raise RuntimeError("output did not follow the input")
+            backend.write_event.clear()
+        latencies.append(backend.written[out_gpio_number] - start)
+        sleep(0.001)
+    return latencies
+
+
+def external_client(port: int, ready: Event):
+    # subscribes to the input and switches the output like an external automation system
+    events = http.client.HTTPConnection("localhost", port)
+    events.request("GET", "/events?names=button")
+    response = events.getresponse()
+    control = http.client.HTTPConnection("localhost", port)
+    ready.set()
+    while True:
+        line = response.fp.readline()
+        if not line:
+            return
+        if line.startswith(b"data: "):
+            event = json.loads(line[len(b"data: "):])
+            control.request("GET", "/light?set=" + ("true" if event["value"] else "false"))
+            control.getresponse().read()
+
+
+def report(name: str, latencies: list):
+    percentiles = quantiles(latencies, n=100)
+    print(f"{name:22s} p50 {percentiles[49] * 1e6:8.1f}us  p99 {percentiles[98] * 1e6:8.1f}us  max {max(latencies) * 1e6:8.1f}us")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    edges = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 9650
+
+    backend = RecordingBackend()
+    bus = EventBus()
+    ins = {"button": InGpio(2, "button", "button", False, bouncetime_ms=0, backend=backend, bus=bus, poll_thread=False)}
+    outs = {"light": OutGpio(3, "light", "light", False, backend=backend, bus=bus)}
+    engine = RuleEngine(bus, lambda: {**ins, **outs}, outs)
+    engine.apply([FollowRule("button light", "light", "button")])
+    print(f"{edges} edges, time from the input edge to the write of the output")
+    report("rule engine", measure(backend, edges, 2, 3))
+    engine.apply([])
+
+    web_server = GpioManagerWebServer(ins, outs, port=port, bus=bus)
+    web_server.start()
+    sleep(0.2)
+    ready = Event()
+    Thread(target=external_client, args=(port, ready), daemon=True).start()
+    ready.wait()
+    sleep(0.2)
+    report("external (SSE + HTTP)", measure(backend, edges, 2, 3))
+    web_server.stop()
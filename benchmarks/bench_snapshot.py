@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+import logging
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gpio_backend import SimulatedGpioBackend
+from gpio_manager import InGpio, OutGpio, EventBus, StateSnapshot
+
+
+# per-request rendering cost of index page, bulk state and get_state: rendered from the pins vs. read from the snapshot
+# usage: python benchmarks/bench_snapshot.py [pins] [requests]
+
+def legacy_index(in_gpios, out_gpios) -> str:
+    html = "<html><body><h1>GPIO Control Panel</h1><ul>"
+    html += "<h3>Inputs</h3>"
+    for name, gpio in in_gpios.items():
+        status = "ON" if gpio.on else "OFF"
+        html += f"<li><a href='/{name}'>{name}</a> (IN {gpio.gpio_number}) - Current: {status} (last change {gpio.last_change.strftime('%Y-%m-%dT%H:%M:%S')})</li>"
+    html += "<h3>Outputs</h3>"
+    for name, gpio in out_gpios.items():
+        status = "ON" if gpio.on else "OFF"
+        html += f"<li><a href='/{name}'>{name}</a> (OUT {gpio.gpio_number}) - Current: {status} "
+        html += f"[<a href='/{name}?set=true'>ON</a> | <a href='/{name}?set=false'>OFF</a>]</li>"
+    html += "</ul></body></html>"
+    return html
+
+
+def legacy_state(in_gpios, out_gpios) -> bytes:
+    return json.dumps({
+        'inputs': {name: {'name': name, 'value': gpio.on, 'reverted': gpio.reverted, 'last_change': gpio.last_change.isoformat()} for name, gpio in in_gpios.items()},
+        'outputs': {name: {'name': name, 'value': gpio.on, 'reverted': gpio.reverted} for name, gpio in out_gpios.items()}
+    }).encode("utf-8")
+
+
+def legacy_get_state(device) -> str:
+    state = "ON" if device.on else "OFF"
+    last_on = device.last_on.strftime("%Y-%m-%dT%H:%M:%S") if device.last_on else "Never"
+    last_off = device.last_off.strftime("%Y-%m-%dT%H:%M:%S") if device.last_off else "Never"
+    last_change = device.last_change.strftime("%Y-%m-%dT%H:%M:%S") if device.last_change else "Never"
+    return f"Pin Output '{device.name}': {state}\nLast ON: {last_on} UTC\nLast OFF: {last_off} UTC\nLast Change: {last_change} UTC"
+
+
+def measure(name: str, requests: int, fn):
+    start = perf_counter()
+    for _ in range(requests):
+        fn()
+    elapsed = perf_counter() - start
+    print(f"{name:30} {elapsed * 1e6 / requests:8.2f}us per request")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    pins = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 5000
+    backend = SimulatedGpioBackend()
+    bus = EventBus()
+    snapshot = StateSnapshot(bus)
+    in_gpios = {"in" + str(i): InGpio(i, "in" + str(i), "", False, backend=backend, bus=bus) for i in range(pins // 2)}
+    out_gpios = {"out" + str(i): OutGpio(100 + i, "out" + str(i), "", False, backend=backend, bus=bus) for i in range(pins // 2)}
+    index = lambda entries: legacy_index(in_gpios, out_gpios)
+
+    measure("index (legacy)", requests, lambda: legacy_index(in_gpios, out_gpios).encode("utf-8"))
+    measure("index (snapshot)", requests, lambda: snapshot.cached("html", index))
+    measure("state (legacy)", requests, lambda: legacy_state(in_gpios, out_gpios))
+    measure("state (snapshot)", requests, lambda: snapshot.json())
+    measure("get_state (legacy)", requests, lambda: legacy_get_state(out_gpios["out0"]))
+    measure("get_state (snapshot)", requests, lambda: snapshot.get("out0").text)
@@ -0,0 +1,51 @@
+import os
+import sys
+import subprocess
+from statistics import median
+from time import perf_counter, sleep
+from urllib.request import urlopen
+
+
+# startup time (interpreter start, imports, pin setup) until the first request is served, against the simulated backend
+# usage: python benchmarks/bench_startup.py [runs] [port]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCENARIOS = [
+    # (front ends, port offset of the front end whose first response is awaited, path)
+    ("webthing,web,mcp", 0, "/"),
+    ("web", 1, "/state"),
+    ("webthing", 0, "/"),
+    ("mcp", 2, "/sse"),
+]
+
+
+def startup_sec(frontends: str, pins: int, port: int, offset: int, path: str) -> float:
+    confs = "&".join(("out:out" if i % 2 == 0 else "in:in") + str(i) + ":Pin " + str(i) + ":" + str(i + 2) for i in range(pins))
+    env = dict(os.environ, GPIO_BACKEND="sim", GPIO_HISTORY="", GPIO_FRONTENDS=frontends)
+    start = perf_counter()
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "gpio_manager_webthing.py"), "bench", str(port), confs], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while True:
+            try:
+                response = urlopen("http://localhost:" + str(port + offset) + path, timeout=5)
+                response.read(1)
+                response.close()
+                return perf_counter() - start
+            except OSError:
+                if process.poll() is not None:
+                    raise RuntimeError("server exited with " + str(process.returncode))
+                sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    port = int(sys.argv[2]) if len(sys.argv) > 2 else 9700
+    print(f"median of {runs} runs, time until the first request is served")
+    for frontends, offset, path in SCENARIOS:
+        for pins in [1, 16, 40]:
+            duration = median(startup_sec(frontends, pins, port, offset, path) for _ in range(runs))
+            print(f"{frontends:18s} pins={pins:2d} {duration * 1000:7.0f}ms")
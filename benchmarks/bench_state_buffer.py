@@ -0,0 +1,68 @@
+import os
+import sys
+from datetime import datetime
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from state_buffer import StateBuffer
+
+
+# compares the former list based StateBuffer with the current deque based one
+# usage: python benchmarks/bench_state_buffer.py [transitions]
+
+
+class LegacyStateBuffer:
+
+    def __init__(self, size_sec: int):
+        self.changes = list()
+        self.size_sec = size_sec
+        self.update(True)
+
+    def update(self, new_state:bool):
+        self.changes.append((datetime.now(), new_state))
+        self.__compact()
+
+    def __current_state(self) -> bool:
+        return  self.changes[0][1]
+
+    def __compact(self):
+        new_changes = []
+        if len(self.changes) > 1:
+            for i in range(0, len(self.changes)-1):
+                age = (datetime.now() - self.changes[i][0]).total_seconds()
+                if age < self.size_sec:
+                    new_changes.append(self.changes[i])
+            new_changes.append(self.changes[-1])
+            self.changes = new_changes
+
+    def average(self) -> bool:
+        if len(self.changes) == 1:
+            return self.__current_state()
+        else:
+            on_sec = 0
+            off_sec = 0
+            for i in reversed(range(0, len(self.changes))):
+                if i > 0:
+                    elapsed = (self.changes[i][0] - self.changes[i-1][0]).total_seconds()
+                    previous_state = self.changes[i-1][1]
+                    if previous_state:
+                        on_sec += elapsed
+                    else:
+                        off_sec += elapsed
+            return True if on_sec > off_sec else False
+
+
+def measure(buffer, transitions: int) -> float:
+    start = perf_counter()
+    for i in range(transitions):
+        buffer.update(i % 2 == 0)
+        buffer.average()
+    return perf_counter() - start
+
+
+if __name__ == '__main__':
+    transitions = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    for name, buffer in [("legacy", LegacyStateBuffer(3600)), ("current", StateBuffer(3600))]:
+        elapsed = measure(buffer, transitions)
+        print(f"{name:8} {transitions} transitions in window: {elapsed:.3f}s total, {elapsed * 1e6 / transitions:.2f}us per update+average")
@@ -0,0 +1,70 @@
+import os
+import sys
+import socket
+import subprocess
+from statistics import quantiles
+from time import perf_counter, sleep
+from urllib.request import urlopen
+
+
+# thread count, RSS and notification latency of the threaded layout against the unified event loop (GPIO_LOOP=asyncio).
+# Starts the server with the simulated backend, toggles an output by the plain web API and measures the time until
+# the change arrives on a Server-Sent Events connection
+# usage: python benchmarks/bench_unified_loop.py [inputs] [toggles] [port]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def process_status(pid: int) -> dict:
+    with open("/proc/" + str(pid) + "/status") as file:
+        status = dict(line.split(":", 1) for line in file.read().splitlines() if ":" in line)
+    return {'threads': int(status["Threads"]), 'rss_kb': int(status["VmRSS"].split()[0])}
+
+
+def wait_until_up(port: int, timeout_sec: float = 60):
+    deadline = perf_counter() + timeout_sec
+    while perf_counter() < deadline:
+        try:
+            urlopen("http://localhost:" + str(port) + "/state", timeout=1).read()
+            return
+        except OSError:
+            sleep(0.2)
+    raise TimeoutError("server on port " + str(port) + " did not start")
+
+
+def measure(layout: str, inputs: int, toggles: int, port: int) -> dict:
+    pins = "&".join(["out:led:Led:2"] + ["in:in" + str(i) + ":In " + str(i) + ":" + str(i + 3) for i in range(inputs)])
+    env = dict(os.environ, GPIO_BACKEND="sim", GPIO_HISTORY="", GPIO_LOOP=layout)
+    process = subprocess.Popen([sys.executable, os.path.join(ROOT, "gpio_manager_webthing.py"), "bench", str(port), pins], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_until_up(port + 1)
+        sse = socket.create_connection(("localhost", port + 1))
+        sse.sendall(b"GET /events?names=led HTTP/1.1\r\nHost: localhost\r\n\r\n")
+        sse.recv(4096)   # response header
+        latencies = []
+        for i in range(toggles):
+            start = perf_counter()
+            urlopen("http://localhost:" + str(port + 1) + "/led?set=" + ("true" if i % 2 == 0 else "false")).read()
+            data = b""
+            while b"\n\n" not in data:
+                data += sse.recv(4096)
+            latencies.append(perf_counter() - start)
+        sse.close()
+        sleep(1)
+        result = process_status(process.pid)
+        percentiles = quantiles(latencies, n=100)
+        result.update({'p50_ms': percentiles[49] * 1000, 'p99_ms': percentiles[98] * 1000})
+        return result
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == '__main__':
+    inputs = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    toggles = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    port = int(sys.argv[3]) if len(sys.argv) > 3 else 9500
+    print(f"1 output, {inputs} inputs, {toggles} toggles (web request -> SSE notification)")
+    for layout in ["threads", "asyncio"]:
+        result = measure(layout, inputs, toggles, port)
+        print(f"{layout:8s} threads={result['threads']:3d} rss={result['rss_kb'] / 1024:.1f}MB latency p50={result['p50_ms']:.2f}ms p99={result['p99_ms']:.2f}ms")
@@ -0,0 +1,42 @@
+import os
+import sys
+import logging
+from time import sleep
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gpio_backend import SimulatedGpioBackend
+from gpio_manager import InGpio, EventBus
+
+
+# pulses shorter than the bounce time of the edge detection against the simulated backend. The trailing edge is
+# dropped by the edge detection, so the input has to end up in the final level by the re-sample after the bounce
+# time (and not by the fallback polling, which is disabled here)
+# usage: python benchmarks/check_short_pulse.py [bouncetime_ms=50] [pulse_ms=10]   (exits 1 on a mismatch)
+
+
+def check(backend: SimulatedGpioBackend, in_gpio: InGpio, gpio_number: int, pulse_ms: float, bouncetime_ms: int, level: bool) -> bool:
+    backend.set_level(gpio_number, not level)
+    sleep(bouncetime_ms / 1000 + 0.05)
+    suppressed = backend.suppressed_edges
+    backend.set_level(gpio_number, level)
+    sleep(pulse_ms / 1000)
+    backend.set_level(gpio_number, not level)
+    dropped = backend.suppressed_edges - suppressed
+    sleep(bouncetime_ms / 1000 + 0.05)
+    ok = in_gpio.on == (not level)
+    print(f"{'ok  ' if ok else 'FAIL'} {pulse_ms}ms {'high' if level else 'low'} pulse, {dropped} edge(s) dropped by the edge detection, state after {bouncetime_ms + 50}ms: {in_gpio.on}")
+    return ok
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    bouncetime_ms = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    pulse_ms = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+
+    backend = SimulatedGpioBackend()
+    in_gpio = InGpio(2, "button", "button", False, bouncetime_ms=bouncetime_ms, backend=backend, bus=EventBus(), poll_thread=False)
+    results = [check(backend, in_gpio, 2, pulse_ms, bouncetime_ms, True),
+               check(backend, in_gpio, 2, pulse_ms, bouncetime_ms, False)]
+    in_gpio.close()
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,59 @@
+import os
+import sys
+import logging
+from http.client import HTTPConnection
+from statistics import quantiles
+from threading import Thread
+from time import perf_counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gpio_backend import SimulatedGpioBackend
+from gpio_manager import InGpio, OutGpio
+from gpio_manager_web import GpioManagerWebServer
+
+
+# keep-alive load test of the plain web server. Without host/port a local server with simulated pins is started
+# usage: python benchmarks/load_test_web.py [clients] [duration_sec] [path] [host] [port]
+
+def client(host: str, port: int, path: str, duration_sec: float, latencies: list):
+    connection = HTTPConnection(host, port)
+    end = perf_counter() + duration_sec
+    while True:
+        start = perf_counter()
+        if start >= end:
+            break
+        connection.request("GET", path)
+        response = connection.getresponse()
+        response.read()
+        latencies.append(perf_counter() - start)
+    connection.close()
+
+
+def run(clients: int, duration_sec: float, path: str, host: str, port: int):
+    latencies = []
+    threads = [Thread(target=client, args=(host, port, path, duration_sec, latencies)) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    percentiles = quantiles(latencies, n=100)
+    print(f"GET {path} clients={clients} requests={len(latencies)} rps={len(latencies) / duration_sec:.0f}")
+    print(f"latency p50={percentiles[49] * 1000:.2f}ms p99={percentiles[98] * 1000:.2f}ms max={max(latencies) * 1000:.2f}ms")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.WARNING)
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    duration_sec = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    path = sys.argv[3] if len(sys.argv) > 3 else "/state"
+    if len(sys.argv) > 5:
+        run(clients, duration_sec, path, sys.argv[4], int(sys.argv[5]))
+    else:
+        backend = SimulatedGpioBackend()
+        in_gpios = {"in" + str(i): InGpio(i, "in" + str(i), "", False, backend=backend) for i in range(16)}
+        out_gpios = {"out" + str(i): OutGpio(100 + i, "out" + str(i), "", False, backend=backend) for i in range(16)}
+        web_server = GpioManagerWebServer(in_gpios, out_gpios, host="127.0.0.1", port=0)
+        web_server.start()
+        run(clients, duration_sec, path, "127.0.0.1", web_server.server.server_address[1])
+        web_server.stop()
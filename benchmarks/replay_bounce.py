@@ -0,0 +1,115 @@
+import os
+import sys
+import heapq
+from bisect import bisect_right
+from typing import Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from input_filter import InputFilter
+
+
+# replays bounce traces through the input filter and checks the published transitions. Time is simulated, so the
+# result does not depend on the scheduling of the machine. Like InGpio, the pin is sampled on each raw edge and
+# again when the filter has a pending candidate (filter.due)
+# usage: python benchmarks/replay_bounce.py                                   (built-in traces, exits 1 on a mismatch)
+#        python benchmarks/replay_bounce.py <trace file> [debounce_ms=10] [majority_samples=3] [min_stable_ms=5]
+# a trace file contains one raw level change per line: <offset ms> <0|1>. The first line is the initial level
+
+READ_SPACING_MS = 0.05   # time between the reads of a majority sample
+
+Trace = List[Tuple[float, bool]]
+
+
+def bounces(start_ms: float, level: bool, gaps_ms: List[float]) -> Trace:
+    # a contact switching to level which bounces back and forth after the given gaps before it settles
+    trace, t, current = [], start_ms, level
+    trace.append((t, current))
+    for gap_ms in gaps_ms:
+        t = round(t + gap_ms, 3)
+        current = not current
+        trace.append((t, current))
+    return trace
+
+
+TRACES: Dict[str, Trace] = {
+    # mechanical push button: press and release, each bouncing for ~3-5ms
+    "button": [(0, False)] + bounces(100, True, [0.3, 0.6, 0.6, 0.9, 1.6, 0.8]) + bounces(300, False, [0.5, 0.7, 0.8, 0.6]),
+    # two short EMI spikes before a real 200ms pulse
+    "glitch": [(0, False), (50, True), (50.2, False), (200, True), (200.1, False), (400, True), (600, False)],
+    # spikes shorter than a majority sample on a long low level, then a clean high level
+    "spikes": [(0, False), (10, True), (10.02, False), (30, True), (30.03, False), (70, True), (70.01, False), (100, True)],
+}
+
+SCENARIOS = [
+    # (trace, filter options, expected transitions (ms, state))
+    ("button", {}, None),   # unfiltered: every raw change is published
+    ("button", {"debounce_ms": 10}, [(100, True), (300, False)]),
+    ("button", {"min_stable_ms": 5}, [(109.8, True), (307.6, False)]),
+    ("glitch", {"debounce_ms": 10}, [(50, True), (60, False), (200, True), (210, False), (400, True), (600, False)]),
+    ("glitch", {"min_stable_ms": 5}, [(405, True), (605, False)]),
+    ("spikes", {"majority_samples": 3}, [(100, True)]),
+    ("spikes", {}, [(10, True), (10.02, False), (30, True), (30.03, False), (70, True), (70.01, False), (100, True)]),
+]
+
+
+def level_at(trace: Trace, offsets: List[float], t_ms: float) -> bool:
+    return trace[max(bisect_right(offsets, t_ms) - 1, 0)][1]
+
+
+def replay(trace: Trace, input_filter: InputFilter) -> List[Tuple[float, bool]]:
+    offsets = [offset for offset, _ in trace]
+    checks = [offset for offset, _ in trace]   # edge interrupts
+    heapq.heapify(checks)
+    scheduled: Optional[float] = None
+    transitions = []
+    while checks:
+        t_ms = heapq.heappop(checks)
+        if scheduled is not None and t_ms >= scheduled:
+            scheduled = None
+        levels = [level_at(trace, offsets, t_ms + i * READ_SPACING_MS) for i in range(input_filter.majority_samples)]
+        initial = input_filter.state is None
+        new_state = input_filter.update(levels, t_ms / 1000)
+        if new_state is not None and not initial:
+            transitions.append((round(t_ms, 3), new_state))
+        if input_filter.due is not None and scheduled is None:
+            scheduled = input_filter.due * 1000
+            heapq.heappush(checks, scheduled)
+    return transitions
+
+
+def read_trace(filename: str) -> Trace:
+    trace = []
+    with open(filename) as file:
+        for line in file:
+            line = line.split("#")[0].strip()
+            if line:
+                offset, level = line.split()
+                trace.append((float(offset), level.strip() in ["1", "true", "on"]))
+    return trace
+
+
+def run(name: str, trace: Trace, options: Dict[str, int], expected: Optional[List[Tuple[float, bool]]]) -> bool:
+    input_filter = InputFilter(**options)
+    transitions = replay(trace, input_filter)
+    if expected is None:
+        expected = [(offset, level) for offset, level in trace[1:]]
+    ok = transitions == expected
+    description = ", ".join(key + "=" + str(value) for key, value in options.items()) or "unfiltered"
+    print(f"{'ok  ' if ok else 'FAIL'} {name:7s} {description:18s} raw={input_filter.raw_edges:3d} filtered={input_filter.filtered_edges:2d}  {transitions}")
+    if not ok:
+        print(f"     expected {expected}")
+    return ok
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        options = {key: int(value) for key, value in (arg.split("=") for arg in sys.argv[2:])}
+        input_filter = InputFilter(**options)
+        transitions = replay(read_trace(sys.argv[1]), input_filter)
+        print(f"raw={input_filter.raw_edges} filtered={input_filter.filtered_edges}")
+        for t_ms, state in transitions:
+            print(f"{t_ms:10.3f}ms {'on' if state else 'off'}")
+    else:
+        results = [run(name, TRACES[name], options, expected) for name, options, expected in SCENARIOS]
+        sys.exit(0 if all(results) else 1)
@@ -0,0 +1,170 @@
+import os
+import mmap
+import struct
+import logging
+from datetime import datetime, UTC
+from threading import Thread, Lock
+from time import sleep
+from typing import List, Dict, Any, Tuple
+from zlib import crc32
+from gpio_manager import GpioEvent
+
+
+
+HEADER = struct.Struct("<8sIIQQQ")     # magic, version, record size, capacity, head (next write index), count
+HEADER_SIZE = 64
+RECORD = struct.Struct("<IBBxxqq")     # pin id, on, kind (1 = in, 0 = out), monotonic ns, wall clock ns (UTC epoch)
+MAGIC = b"GPIOHIST"
+VERSION = 1
+
+
+def pin_id(name: str) -> int:
+    return crc32(name.encode("utf-8")) & 0xFFFFFFFF
+
+
+def parse_time(value: str) -> datetime:
+    """
+    Parses epoch seconds or an ISO 8601 datetime (UTC if no offset is given)
+    """
+    try:
+        return datetime.fromtimestamp(float(value), UTC)
+    except ValueError:
+        time = datetime.fromisoformat(value)
+        return time.replace(tzinfo=UTC) if time.tzinfo is None else time
+
+
+def start_of_today() -> datetime:
+    return datetime.now(UTC).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+
+class EventHistory:
+    """
+    Persistent log of all pin transitions. Fixed-size records are appended to a memory-mapped ring file of
+    bounded size; the oldest records are overwritten. Dirty pages are flushed in batches (every flush_interval_sec)
+    to avoid wearing out SD cards with many small writes. Records are ordered by time, so range queries
+    binary search the boundaries instead of loading the whole file. To keep the order if the wall clock steps
+    back (e.g. an NTP sync after booting without RTC), the stored wall time is clamped to the one of the previous record
+    """
+
+    def __init__(self, filename: str, capacity: int = 100000, flush_interval_sec: float = 30):
+        self.filename = filename
+        self.capacity = capacity
+        self.flush_interval_sec = flush_interval_sec
+        self.__lock = Lock()
+        self.__dirty = False
+        size = HEADER_SIZE + capacity * RECORD.size
+        exists = os.path.exists(filename) and os.path.getsize(filename) == size
+        self.__file = open(filename, "r+b" if exists else "w+b")
+        if not exists:
+            self.__file.truncate(size)
+        self.__mmap = mmap.mmap(self.__file.fileno(), size)
+        magic, version, record_size, stored_capacity, self.__head, self.__count = HEADER.unpack_from(self.__mmap, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size or stored_capacity != capacity:
+            if exists:
+                logging.warning("history file " + filename + " has an incompatible format. Resetting it")
+            self.__head, self.__count = 0, 0
+            self.__write_header()
+            self.__mmap.flush()
+        self.__last_wall_ns = self.__record(self.__count - 1)[4] if self.__count > 0 else 0
+        logging.info("history " + filename + " opened (" + str(self.__count) + " of " + str(capacity) + " records used)")
+        Thread(target=self.__flush_loop, daemon=True).start()
+
+    def __write_header(self):
+        HEADER.pack_into(self.__mmap, 0, MAGIC, VERSION, RECORD.size, self.capacity, self.__head, self.__count)
+
+    @property
+    def count(self) -> int:
+        return self.__count
+
+    def on_event(self, event: GpioEvent):
+        if event.initial:
+            # the state of a newly registered pin is no transition
+            return
+        self.append(event.name, event.kind, event.on, event.time, event.monotonic)
+
+    def append(self, name: str, kind: str, on: bool, time: datetime, monotonic_sec: float):
+        with self.__lock:
+            offset = HEADER_SIZE + (self.__head % self.capacity) * RECORD.size
+            self.__last_wall_ns = max(int(time.timestamp() * 1e9), self.__last_wall_ns)
+            RECORD.pack_into(self.__mmap, offset, pin_id(name), 1 if on else 0, 1 if kind == "in" else 0, int(monotonic_sec * 1e9), self.__last_wall_ns)
+            self.__head = (self.__head + 1) % self.capacity
+            self.__count = min(self.__count + 1, self.capacity)
+            self.__write_header()
+            self.__dirty = True
+
+    def __record(self, index: int) -> Tuple[int, int, int, int, int]:
+        # index 0 is the oldest record
+        position = (self.__head - self.__count + index) % self.capacity
+        return RECORD.unpack_from(self.__mmap, HEADER_SIZE + position * RECORD.size)
+
+    def __bisect(self, wall_ns: int) -> int:
+        # first index with wall time >= wall_ns
+        low, high = 0, self.__count
+        while low < high:
+            middle = (low + high) // 2
+            if self.__record(middle)[4] < wall_ns:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def query(self, name: str, start: datetime, end: datetime, limit: int = 1000) -> List[Dict[str, Any]]:
+        """
+        Returns the transitions of the pin within [start, end), oldest first (at most limit ones)
+        """
+        wanted_id = pin_id(name)
+        events = []
+        with self.__lock:
+            for index in range(self.__bisect(int(start.timestamp() * 1e9)), self.__bisect(int(end.timestamp() * 1e9))):
+                record_id, on, kind, monotonic_ns, wall_ns = self.__record(index)
+                if record_id == wanted_id:
+                    events.append({'time': datetime.fromtimestamp(wall_ns / 1e9, UTC).isoformat(), 'value': on == 1, 'type': "in" if kind == 1 else "out"})
+                    if len(events) >= limit:
+                        break
+        return events
+
+    def summary(self, name: str, start: datetime, end: datetime) -> Dict[str, Any]:
+        """
+        Counts the on and off transitions of the pin within [start, end)
+        """
+        wanted_id = pin_id(name)
+        on_count, off_count, first, last = 0, 0, None, None
+        with self.__lock:
+            for index in range(self.__bisect(int(start.timestamp() * 1e9)), self.__bisect(int(end.timestamp() * 1e9))):
+                record_id, on, kind, monotonic_ns, wall_ns = self.__record(index)
+                if record_id == wanted_id:
+                    if on == 1:
+                        on_count += 1
+                    else:
+                        off_count += 1
+                    first = wall_ns if first is None else first
+                    last = wall_ns
+        return {
+            'name': name,
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'on_count': on_count,
+            'off_count': off_count,
+            'first': None if first is None else datetime.fromtimestamp(first / 1e9, UTC).isoformat(),
+            'last': None if last is None else datetime.fromtimestamp(last / 1e9, UTC).isoformat()
+        }
+
+    def flush(self):
+        with self.__lock:
+            if self.__dirty:
+                self.__mmap.flush()
+                self.__dirty = False
+
+    def __flush_loop(self):
+        while True:
+            sleep(self.flush_interval_sec)
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error("Error flushing history " + self.filename + ": " + str(e))
+
+    def close(self):
+        self.flush()
+        self.__mmap.close()
+        self.__file.close()
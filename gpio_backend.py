@@ -0,0 +1,360 @@
+import os
+import logging
+import random
+from abc import ABC, abstractmethod
+from threading import Thread, Lock
+from time import monotonic, sleep
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+EDGES = ["rising", "falling", "both"]
+PULLS = ["off", "up", "down"]
+
+EdgeCallback = Callable[[int], None]
+
+
+class GpioBackend(ABC):
+    """
+    Minimal hardware abstraction used by OutGpio and InGpio. Pins are always addressed by BCM number,
+    levels are raw electrical levels (True = high)
+    """
+
+    @abstractmethod
+    def setup_output(self, gpio_number: int, level: bool = False):
+        pass
+
+    @abstractmethod
+    def setup_input(self, gpio_number: int, pull: str = "off"):
+        pass
+
+    def setup_outputs(self, levels: Dict[int, bool]):
+        """
+        Sets up several outputs with their initial level at once
+        """
+        for gpio_number, level in levels.items():
+            self.setup_output(gpio_number, level)
+
+    def setup_inputs(self, pulls: Dict[int, str]):
+        """
+        Sets up several inputs with their pull resistor ('off', 'up' or 'down') at once
+        """
+        for gpio_number, pull in pulls.items():
+            self.setup_input(gpio_number, pull)
+
+    def release(self, gpio_number: int):
+        """
+        Removes the edge detection of the pin and frees it
+        """
+        pass
+
+    @abstractmethod
+    def read(self, gpio_number: int) -> bool:
+        pass
+
+    @abstractmethod
+    def write(self, gpio_number: int, level: bool):
+        pass
+
+    @abstractmethod
+    def add_edge_detect(self, gpio_number: int, edge: str, callback: EdgeCallback, bouncetime_ms: int = 0):
+        pass
+
+    def setup_group(self, gpio_numbers: List[int]):
+        """
+        Declares already set up outputs as a group which is written by write_many()
+        """
+        pass
+
+    def release_group(self, gpio_numbers: List[int]):
+        """
+        Dissolves a group. The members remain set up as single outputs
+        """
+        pass
+
+    def write_many(self, levels: Dict[int, bool]):
+        """
+        Writes several outputs with as little skew as the driver allows. Falls back to sequential writes
+        """
+        for gpio_number, level in levels.items():
+            self.write(gpio_number, level)
+
+    def close(self):
+        pass
+
+
+
+class RPiGpioBackend(GpioBackend):
+
+    def __init__(self):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        self.__edges = {"rising": GPIO.RISING, "falling": GPIO.FALLING, "both": GPIO.BOTH}
+        self.__pulls = {"off": GPIO.PUD_OFF, "up": GPIO.PUD_UP, "down": GPIO.PUD_DOWN}
+        GPIO.setmode(GPIO.BCM)
+
+    def setup_output(self, gpio_number: int, level: bool = False):
+        self.GPIO.setup(gpio_number, self.GPIO.OUT, initial=self.GPIO.HIGH if level else self.GPIO.LOW)
+
+    def setup_input(self, gpio_number: int, pull: str = "off"):
+        self.GPIO.setup(gpio_number, self.GPIO.IN, pull_up_down=self.__pulls[pull])
+
+    def setup_outputs(self, levels: Dict[int, bool]):
+        # one setup call per initial level (RPi.GPIO accepts a list of channels)
+        for level in [True, False]:
+            gpio_numbers = [gpio_number for gpio_number, gpio_level in levels.items() if gpio_level == level]
+            if len(gpio_numbers) > 0:
+                self.GPIO.setup(gpio_numbers, self.GPIO.OUT, initial=self.GPIO.HIGH if level else self.GPIO.LOW)
+
+    def setup_inputs(self, pulls: Dict[int, str]):
+        # one setup call per pull resistor setting
+        for pull in PULLS:
+            gpio_numbers = [gpio_number for gpio_number, gpio_pull in pulls.items() if gpio_pull == pull]
+            if len(gpio_numbers) > 0:
+                self.GPIO.setup(gpio_numbers, self.GPIO.IN, pull_up_down=self.__pulls[pull])
+
+    def release(self, gpio_number: int):
+        self.GPIO.remove_event_detect(gpio_number)
+        self.GPIO.cleanup(gpio_number)
+
+    def read(self, gpio_number: int) -> bool:
+        return self.GPIO.input(gpio_number) == 1
+
+    def write(self, gpio_number: int, level: bool):
+        self.GPIO.output(gpio_number, self.GPIO.HIGH if level else self.GPIO.LOW)
+
+    def write_many(self, levels: Dict[int, bool]):
+        self.GPIO.output(list(levels.keys()), [self.GPIO.HIGH if level else self.GPIO.LOW for level in levels.values()])
+
+    def add_edge_detect(self, gpio_number: int, edge: str, callback: EdgeCallback, bouncetime_ms: int = 0):
+        if bouncetime_ms > 0:
+            self.GPIO.add_event_detect(gpio_number, self.__edges[edge], callback=callback, bouncetime=bouncetime_ms)
+        else:
+            self.GPIO.add_event_detect(gpio_number, self.__edges[edge], callback=callback)
+
+    def close(self):
+        self.GPIO.cleanup()
+
+
+
+class LgpioBackend(GpioBackend):
+
+    def __init__(self, chip: int = 0):
+        import lgpio
+        self.lgpio = lgpio
+        self.__edges = {"rising": lgpio.RISING_EDGE, "falling": lgpio.FALLING_EDGE, "both": lgpio.BOTH_EDGES}
+        self.__pulls = {"off": lgpio.SET_PULL_NONE, "up": lgpio.SET_PULL_UP, "down": lgpio.SET_PULL_DOWN}
+        self.__handle = lgpio.gpiochip_open(chip)
+        self.__callbacks: Dict[int, List] = {}
+        self.__input_flags: Dict[int, int] = {}
+        self.__groups: Dict[int, Tuple[int, int]] = {}   # member gpio -> (group leader gpio, bit index)
+
+    def setup_output(self, gpio_number: int, level: bool = False):
+        self.lgpio.gpio_claim_output(self.__handle, gpio_number, 1 if level else 0)
+
+    def setup_input(self, gpio_number: int, pull: str = "off"):
+        self.__input_flags[gpio_number] = self.__pulls[pull]
+        self.lgpio.gpio_claim_input(self.__handle, gpio_number, self.__pulls[pull])
+
+    def release(self, gpio_number: int):
+        for cb in self.__callbacks.pop(gpio_number, []):
+            cb.cancel()
+        self.__input_flags.pop(gpio_number, None)
+        self.lgpio.gpio_free(self.__handle, gpio_number)
+
+    def read(self, gpio_number: int) -> bool:
+        return self.lgpio.gpio_read(self.__handle, gpio_number) == 1
+
+    def write(self, gpio_number: int, level: bool):
+        if gpio_number in self.__groups:
+            leader, index = self.__groups[gpio_number]
+            self.lgpio.group_write(self.__handle, leader, (1 if level else 0) << index, 1 << index)
+        else:
+            self.lgpio.gpio_write(self.__handle, gpio_number, 1 if level else 0)
+
+    def setup_group(self, gpio_numbers: List[int]):
+        levels = [1 if self.read(gpio_number) else 0 for gpio_number in gpio_numbers]
+        for gpio_number in gpio_numbers:
+            self.lgpio.gpio_free(self.__handle, gpio_number)
+        self.lgpio.group_claim_output(self.__handle, gpio_numbers, levels)
+        for index, gpio_number in enumerate(gpio_numbers):
+            self.__groups[gpio_number] = (gpio_numbers[0], index)
+
+    def release_group(self, gpio_numbers: List[int]):
+        levels = [1 if self.read(gpio_number) else 0 for gpio_number in gpio_numbers]
+        self.lgpio.group_free(self.__handle, gpio_numbers[0])
+        for gpio_number, level in zip(gpio_numbers, levels):
+            self.__groups.pop(gpio_number, None)
+            self.lgpio.gpio_claim_output(self.__handle, gpio_number, level)
+
+    def write_many(self, levels: Dict[int, bool]):
+        # one group write per group (a single kernel call which sets all lines of the group at once)
+        writes: Dict[int, List[int]] = {}
+        for gpio_number, level in levels.items():
+            if gpio_number in self.__groups:
+                leader, index = self.__groups[gpio_number]
+                bits_mask = writes.setdefault(leader, [0, 0])
+                bits_mask[0] |= (1 if level else 0) << index
+                bits_mask[1] |= 1 << index
+            else:
+                self.lgpio.gpio_write(self.__handle, gpio_number, 1 if level else 0)
+        for leader, (bits, mask) in writes.items():
+            self.lgpio.group_write(self.__handle, leader, bits, mask)
+
+    def add_edge_detect(self, gpio_number: int, edge: str, callback: EdgeCallback, bouncetime_ms: int = 0):
+        self.lgpio.gpio_claim_alert(self.__handle, gpio_number, self.__edges[edge], self.__input_flags.get(gpio_number, 0))
+        if bouncetime_ms > 0:
+            self.lgpio.gpio_set_debounce_micros(self.__handle, gpio_number, bouncetime_ms * 1000)
+        cb = self.lgpio.callback(self.__handle, gpio_number, self.__edges[edge], lambda chip, gpio, level, tick: callback(gpio))
+        self.__callbacks.setdefault(gpio_number, []).append(cb)
+
+    def close(self):
+        for callbacks in self.__callbacks.values():
+            for cb in callbacks:
+                cb.cancel()
+        self.lgpio.gpiochip_close(self.__handle)
+
+
+
+class SimulatedGpioBackend(GpioBackend):
+    """
+    Pure-Python backend for off-device testing and load testing. Edges are injected by calling set_level()
+    (directly, via play() or via random_edges()). Edge callbacks run on the injecting thread, which takes the
+    role of the interrupt thread of the real drivers.
+    """
+
+    def __init__(self):
+        self.__lock = Lock()
+        self.__levels: Dict[int, bool] = {}
+        self.__outputs = set()
+        self.__detectors: Dict[int, List[Tuple[str, EdgeCallback, float]]] = {}
+        self.__last_edge: Dict[int, float] = {}
+        self.injected_edges = 0
+        self.suppressed_edges = 0
+
+    def setup_output(self, gpio_number: int, level: bool = False):
+        with self.__lock:
+            self.__outputs.add(gpio_number)
+            self.__levels[gpio_number] = level
+
+    def setup_input(self, gpio_number: int, pull: str = "off"):
+        with self.__lock:
+            self.__levels.setdefault(gpio_number, pull == "up")
+
+    def release(self, gpio_number: int):
+        with self.__lock:
+            self.__outputs.discard(gpio_number)
+            self.__detectors.pop(gpio_number, None)
+            self.__last_edge.pop(gpio_number, None)
+
+    def read(self, gpio_number: int) -> bool:
+        return self.__levels.get(gpio_number, False)
+
+    def write(self, gpio_number: int, level: bool):
+        self.__levels[gpio_number] = level
+
+    def write_many(self, levels: Dict[int, bool]):
+        with self.__lock:
+            self.__levels.update(levels)
+
+    def add_edge_detect(self, gpio_number: int, edge: str, callback: EdgeCallback, bouncetime_ms: int = 0):
+        with self.__lock:
+            self.__detectors.setdefault(gpio_number, []).append((edge, callback, bouncetime_ms / 1000))
+
+    def set_level(self, gpio_number: int, level: bool):
+        """
+        Changes the electrical level of a (input) pin and fires the registered edge callbacks
+        """
+        previous = self.__levels.get(gpio_number, False)
+        self.__levels[gpio_number] = level
+        if previous == level:
+            return
+        self.injected_edges += 1
+        now = monotonic()
+        edge = "rising" if level else "falling"
+        for detect_edge, callback, bouncetime_sec in self.__detectors.get(gpio_number, []):
+            if detect_edge != "both" and detect_edge != edge:
+                continue
+            if bouncetime_sec > 0 and now - self.__last_edge.get(gpio_number, -bouncetime_sec) < bouncetime_sec:
+                self.suppressed_edges += 1
+                continue
+            self.__last_edge[gpio_number] = now
+            callback(gpio_number)
+
+    def toggle(self, gpio_number: int):
+        self.set_level(gpio_number, not self.read(gpio_number))
+
+    def play(self, script: List[Tuple[float, int, bool]], background: bool = False) -> Optional[Thread]:
+        """
+        Replays a scripted edge stream. Each entry is (offset_sec, gpio_number, level) with offsets relative
+        to the start of the replay
+        """
+        def run():
+            start = monotonic()
+            for offset_sec, gpio_number, level in sorted(script, key=lambda entry: entry[0]):
+                delay = start + offset_sec - monotonic()
+                if delay > 0:
+                    sleep(delay)
+                self.set_level(gpio_number, level)
+
+        if background:
+            t = Thread(target=run, daemon=True)
+            t.start()
+            return t
+        run()
+        return None
+
+    def random_edges(self, gpio_numbers: List[int], rate_hz: float, duration_sec: float, seed: Optional[int] = None, on_edge: Optional[Callable[[int, float], None]] = None) -> int:
+        """
+        Toggles randomly chosen pins with an overall rate of rate_hz edges per second. on_edge (if given) is
+        called with the pin and the monotonic injection time right before the edge is fired. Returns the
+        number of injected edges
+        """
+        rnd = random.Random(seed)
+        interval = 1 / rate_hz
+        start = monotonic()
+        count = 0
+        while True:
+            due = start + count * interval
+            now = monotonic()
+            if now - start >= duration_sec:
+                return count
+            if due > now:
+                sleep(due - now)
+            gpio_number = rnd.choice(gpio_numbers)
+            if on_edge is not None:
+                on_edge(gpio_number, monotonic())
+            self.toggle(gpio_number)
+            count += 1
+
+
+
+BACKENDS = {
+    "rpi": RPiGpioBackend,
+    "lgpio": lambda: LgpioBackend(int(os.environ.get("GPIO_CHIP", "0"))),
+    "sim": SimulatedGpioBackend
+}
+
+_default_backend: Optional[GpioBackend] = None
+
+
+def create_backend(name: str) -> GpioBackend:
+    if name.lower() not in BACKENDS:
+        raise ValueError("unsupported gpio backend '" + name + "'. Supported: " + ", ".join(BACKENDS.keys()))
+    logging.info("using gpio backend " + name.lower())
+    return BACKENDS[name.lower()]()
+
+
+def default_backend() -> GpioBackend:
+    """
+    Returns the process wide backend. It is selected by the GPIO_BACKEND environment variable (rpi, lgpio or sim)
+    and created on first use
+    """
+    global _default_backend
+    if _default_backend is None:
+        _default_backend = create_backend(os.environ.get("GPIO_BACKEND", "rpi"))
+    return _default_backend
+
+
+def set_default_backend(backend: GpioBackend):
+    global _default_backend
+    _default_backend = backend
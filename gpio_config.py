@@ -0,0 +1,390 @@
+import os
+import json
+import logging
+from dataclasses import dataclass, field, fields
+from threading import Thread, Lock
+from time import sleep
+from typing import Any, Callable, Dict, List, Optional
+from gpio_backend import GpioBackend, default_backend, EDGES, PULLS
+from gpio_manager import OutGpio, InGpio, OutGpioGroup, StateSnapshot, state_snapshot
+from output_state import OutputStateStore
+from pulse_counter import PulseCounter, PulseCountStore
+from rule_engine import Rule, parse_rule
+
+
+TYPES = ["in", "out", "group", "counter"]
+INITIAL_STATES = ["off", "on", "restore"]
+CONFIG_EXTENSIONS = [".yaml", ".yml", ".json", ".toml"]
+# options whose change requires to release and set up the pin again. The other options are updated in place
+SETUP_OPTIONS = {"out": ["port", "reverted"],
+                 "in": ["port", "reverted", "pull", "edge", "bouncetime_ms"],
+                 "counter": ["port", "pull", "edge", "bouncetime_ms"],
+                 "group": ["members"]}
+
+
+def parse_bool(value: Any) -> bool:
+    if isinstance(value, str):
+        if value.strip().lower() in ['true', '1', 'on', 'yes']:
+            return True
+        if value.strip().lower() in ['false', '0', 'off', 'no', '']:
+            return False
+        raise ValueError("invalid boolean '" + value + "'")
+    return bool(value)
+
+
+
+@dataclass
+class Config:
+    type: str
+    name: str
+    description: str
+    port: int          # BCM number of the pin
+    reverted: bool
+    members: List[str] = field(default_factory=list)   # output names of a group
+    edge: str = ""                         # default: 'rising' for counters, otherwise 'both'
+    bouncetime_ms: Optional[int] = None    # default: 0 for counters, otherwise 50
+    pull: str = "off"
+    poll_interval_sec: float = 60
+    min_switch_interval_sec: float = 0
+    initial: str = "restore"     # 'on', 'off' or 'restore' (the last known state if a state file is configured, otherwise off)
+    debounce_ms: int = 0         # input filter (see InputFilter)
+    majority_samples: int = 1
+    min_stable_ms: int = 0
+
+    def __post_init__(self):
+        if not self.edge:
+            self.edge = "rising" if self.type == "counter" else "both"
+        if self.bouncetime_ms is None:
+            self.bouncetime_ms = 0 if self.type == "counter" else 50
+
+    def validate(self):
+        if self.type not in TYPES:
+            raise ValueError("unsupported type '" + self.type + "' of " + self.name + ". Supported: " + ", ".join(TYPES))
+        if self.edge not in EDGES:
+            raise ValueError("unsupported edge '" + self.edge + "' of " + self.name + ". Supported: " + ", ".join(EDGES))
+        if self.pull not in PULLS:
+            raise ValueError("unsupported pull '" + self.pull + "' of " + self.name + ". Supported: " + ", ".join(PULLS))
+        if self.initial not in INITIAL_STATES:
+            raise ValueError("unsupported initial state '" + self.initial + "' of " + self.name + ". Supported: " + ", ".join(INITIAL_STATES))
+        if self.majority_samples < 1 or self.debounce_ms < 0 or self.min_stable_ms < 0:
+            raise ValueError("invalid input filter of " + self.name)
+        if self.type == "group" and len(self.members) == 0:
+            raise ValueError("group " + self.name + " has no members")
+        return self
+
+    @staticmethod
+    def parse(conf: str):
+        logging.info("parsing " + conf)
+        parts = conf.split(":")
+        try:
+            if parts[0].lower() == 'group':
+                # group:<name>[:<description>]:<out name>,<out name>,...
+                return Config('group', parts[1], parts[2] if len(parts) > 3 else parts[1], 0, False, parts[-1].split(","))
+            elif len(parts) > 4:
+                return Config(parts[0].lower(), parts[1], parts[2], int(parts[3]), parse_bool(parts[4]))
+            elif len(parts) > 3:
+                return Config(parts[0].lower(), parts[1], parts[2], int(parts[3]), False)
+            else:
+                return Config(parts[0].lower(), parts[1], parts[1], int(parts[2]), False)
+        except Exception as e:
+            logging.error("error parsing '" + conf + "':   " + str(e))
+            raise e
+
+    @staticmethod
+    def from_dict(data: Dict[str, Any]):
+        """
+        Creates the config of a pin entry of a config file. The pin number is given as 'gpio'
+        """
+        data = dict(data)
+        known = [config_field.name for config_field in fields(Config)]
+        if 'gpio' in data:
+            data['port'] = data.pop('gpio')
+        unknown = [key for key in data.keys() if key not in known]
+        if len(unknown) > 0:
+            raise ValueError("unknown option(s) " + ", ".join(unknown) + " of pin " + str(data.get('name')))
+        if isinstance(data.get('initial'), bool):
+            data['initial'] = "on" if data['initial'] else "off"
+        return Config(type=str(data['type']).lower(),
+                      name=str(data['name']),
+                      description=str(data.get('description', data['name'])),
+                      port=int(data.get('port', 0)),
+                      reverted=parse_bool(data.get('reverted', False)),
+                      members=[str(member) for member in data.get('members', [])],
+                      edge=str(data.get('edge', "")).lower(),
+                      bouncetime_ms=int(data['bouncetime_ms']) if 'bouncetime_ms' in data else None,
+                      pull=str(data.get('pull', "off")).lower(),
+                      poll_interval_sec=float(data.get('poll_interval_sec', 60)),
+                      min_switch_interval_sec=float(data.get('min_switch_interval_sec', 0)),
+                      initial=str(data.get('initial', "restore")).lower(),
+                      debounce_ms=int(data.get('debounce_ms', 0)),
+                      majority_samples=int(data.get('majority_samples', 1)),
+                      min_stable_ms=int(data.get('min_stable_ms', 0))).validate()
+
+
+def is_config_file(value: str) -> bool:
+    return os.path.splitext(value)[1].lower() in CONFIG_EXTENSIONS
+
+
+def read_config_file(filename: str) -> Any:
+    extension = os.path.splitext(filename)[1].lower()
+    with open(filename, "rb") as file:
+        if extension in [".yaml", ".yml"]:
+            import yaml   # PyYAML (see requirements.txt), imported only for YAML files
+            data = yaml.safe_load(file)
+        elif extension == ".toml":
+            import tomllib
+            data = tomllib.load(file)
+        elif extension == ".json":
+            data = json.load(file)
+        else:
+            raise ValueError("unsupported config file " + filename + ". Supported: " + ", ".join(CONFIG_EXTENSIONS))
+    return data
+
+
+def load_configs(filename: str) -> List[Config]:
+    """
+    Reads the pins of a YAML, JSON or TOML file. The file contains a list 'pins' of pin entries, e.g.
+    {"pins": [{"type": "out", "name": "pump", "gpio": 17, "min_switch_interval_sec": 1}]}
+    """
+    data = read_config_file(filename)
+    pins = data.get('pins', []) if isinstance(data, dict) else data
+    if not isinstance(pins, list):
+        raise ValueError("config file " + filename + " does not contain a list of pins")
+    return [Config.from_dict(pin) for pin in pins]
+
+
+def load_rules(filename: str) -> List[Rule]:
+    """
+    Reads the optional list 'rules' of a config file, e.g. {"rules": [{"type": "follow", "input": "door", "output": "light"}]}
+    """
+    data = read_config_file(filename)
+    rules = data.get('rules', []) if isinstance(data, dict) else []
+    if not isinstance(rules, list):
+        raise ValueError("config file " + filename + " does not contain a list of rules")
+    return [parse_rule(rule) for rule in rules]
+
+
+
+class PinRegistry:
+    """
+    Owns the configured pins. apply() diffs a pin configuration against the current one and only releases,
+    creates or re-creates the pins whose setup changed (type or SETUP_OPTIONS). Other changes such as the description
+    or the min switch interval are applied to the existing pin, so an output is neither released nor switched.
+    The pin dicts are shared with the front ends and updated in place; listeners are informed about the removed
+    and added pin objects (not about pins updated in place, which keep their object)
+    """
+
+    def __init__(self, backend: Optional[GpioBackend] = None, snapshot: Optional[StateSnapshot] = None, store: Optional[OutputStateStore] = None, poll_thread: bool = True,
+                 count_store: Optional[PulseCountStore] = None):
+        self.backend = backend if backend is not None else default_backend()
+        self.snapshot = snapshot if snapshot is not None else state_snapshot
+        self.store = store
+        self.count_store = count_store
+        self.poll_thread = poll_thread
+        self.outs: Dict[str, OutGpio] = {}
+        self.ins: Dict[str, InGpio] = {}
+        self.groups: Dict[str, OutGpioGroup] = {}
+        self.counters: Dict[str, PulseCounter] = {}
+        self.confs: Dict[str, Config] = {}
+        self.__lock = Lock()
+        self.__listeners: List[Callable[[List[Any], List[Any]], None]] = []
+
+    def add_listener(self, listener: Callable[[List[Any], List[Any]], None]):
+        self.__listeners.append(listener)
+
+    def apply(self, confs: List[Config]):
+        """
+        Applies the pin configuration. If setting up a pin fails (e.g. the gpio is busy), the previous configuration
+        is restored and the error is raised
+        """
+        new_confs: Dict[str, Config] = {}
+        ports: Dict[int, str] = {}
+        for conf in confs:
+            conf.validate()
+            if conf.name in new_confs:
+                raise ValueError("duplicate pin name " + conf.name)
+            new_confs[conf.name] = conf
+            if conf.type != "group":
+                if conf.port in ports:
+                    raise ValueError("pins " + ports[conf.port] + " and " + conf.name + " use the same gpio " + str(conf.port))
+                ports[conf.port] = conf.name
+        for conf in new_confs.values():
+            for member in conf.members:
+                if member not in new_confs or new_confs[member].type != "out":
+                    raise ValueError("member " + member + " of group " + conf.name + " is not an output")
+
+        with self.__lock:
+            changed = {name for name, conf in self.confs.items() if self.__requires_setup(conf, new_confs.get(name))}
+            # groups are re-created if one of their members is re-created
+            changed |= {name for name, conf in self.confs.items() if conf.type == "group" and any(member in changed for member in conf.members)}
+            updated = [name for name, conf in self.confs.items() if name not in changed and new_confs[name] != conf]
+            added = [name for name in new_confs.keys() if name not in self.confs or name in changed]
+            if len(changed) == 0 and len(added) == 0 and len(updated) == 0:
+                return
+
+            # outputs which are re-created keep their state
+            previous_states = {name: self.outs[name].on is True for name in changed if name in self.outs}
+            initial_states = {}
+            for name in added:
+                conf = new_confs[name]
+                if conf.type != "out":
+                    continue
+                if name in previous_states:
+                    initial_states[name] = previous_states[name]
+                elif conf.initial == "restore":
+                    initial_states[name] = self.store is not None and self.store.get(name)
+                else:
+                    initial_states[name] = conf.initial == "on"
+
+            # applied confs, kept in sync with the pin dicts while pins are released and created
+            applied = dict(self.confs)
+            removed, created = [], []
+            try:
+                for name in sorted(changed, key=lambda name: self.confs[name].type != "group"):
+                    removed.append(self.__release(name, applied.pop(name)))
+                self.__create([new_confs[name] for name in added], initial_states, applied, created)
+            except Exception as e:
+                logging.error("Error applying the pin configuration: " + str(e) + ". Restoring the previous one")
+                for name in sorted([name for name in added if applied.get(name) is new_confs[name]], key=lambda name: applied[name].type != "group"):
+                    removed.append(self.__release(name, applied.pop(name)))
+                try:
+                    self.__create([conf for name, conf in self.confs.items() if name not in applied], previous_states, applied, created)
+                except Exception as restore_error:
+                    logging.error("Error restoring the previous pin configuration: " + str(restore_error))
+                self.confs = applied
+                self.snapshot.invalidate()
+                self.__notify(removed, created)
+                raise e
+
+            for name in updated:
+                self.snapshot.refresh(self.__update(new_confs[name]))
+            self.snapshot.invalidate()
+            if len(self.confs) > 0:
+                logging.info("pin configuration reloaded: " + str(len([name for name in changed if name in new_confs]) + len(updated)) + " changed, " +
+                             str(len([name for name in changed if name not in new_confs])) + " removed, " + str(len([name for name in added if name not in changed])) + " added")
+            self.confs = new_confs
+        self.__notify(removed, created)
+
+    def __notify(self, removed: List[Any], created: List[Any]):
+        # pins which were created and released again (by a rollback) are unknown to the listeners
+        removed, created = [pin for pin in removed if not any(pin is c for c in created)], [pin for pin in created if not any(pin is r for r in removed)]
+        if len(removed) == 0 and len(created) == 0:
+            return
+        for listener in self.__listeners:
+            try:
+                listener(removed, created)
+            except Exception as e:
+                logging.error("Error in pin configuration listener: " + str(e))
+
+    def __create(self, confs: List[Config], initial_states: Dict[str, bool], applied: Dict[str, Config], created: List[Any]):
+        """
+        Sets up the pins of confs in one batch and adds each created pin to created and its conf to applied. If this
+        fails, the gpios which were set up but not taken over by a pin are released
+        """
+        out_confs = [conf for conf in confs if conf.type == "out"]
+        in_confs = [conf for conf in confs if conf.type in ["in", "counter"]]
+        try:
+            self.backend.setup_outputs({conf.port: initial_states.get(conf.name, False) != conf.reverted for conf in out_confs})
+            self.backend.setup_inputs({conf.port: conf.pull for conf in in_confs})
+            for conf in out_confs:
+                self.outs[conf.name] = OutGpio(conf.port, conf.name, conf.description, conf.reverted, conf.min_switch_interval_sec, backend=self.backend, initial_on=initial_states.get(conf.name, False), setup=False)
+                applied[conf.name] = conf
+                created.append(self.outs[conf.name])
+            for conf in in_confs:
+                if conf.type == "counter":
+                    self.counters[conf.name] = PulseCounter(conf.port, conf.name, conf.description, edge=conf.edge, bouncetime_ms=conf.bouncetime_ms,
+                                                            backend=self.backend, store=self.count_store, setup=False, pull=conf.pull)
+                    created.append(self.counters[conf.name])
+                else:
+                    self.ins[conf.name] = InGpio(conf.port, conf.name, conf.description, conf.reverted, edge=conf.edge, bouncetime_ms=conf.bouncetime_ms, poll_interval_sec=conf.poll_interval_sec,
+                                                 backend=self.backend, setup=False, pull=conf.pull, poll_thread=self.poll_thread,
+                                                 debounce_ms=conf.debounce_ms, majority_samples=conf.majority_samples, min_stable_ms=conf.min_stable_ms)
+                    created.append(self.ins[conf.name])
+                applied[conf.name] = conf
+        except Exception:
+            for conf in out_confs + in_confs:
+                if conf.name not in applied:
+                    try:
+                        self.backend.release(conf.port)
+                    except Exception as e:
+                        logging.warning("Error releasing gpio " + str(conf.port) + ": " + str(e))
+            raise
+        for conf in confs:
+            if conf.type == "group":
+                self.groups[conf.name] = OutGpioGroup(conf.name, conf.description, [self.outs[member] for member in conf.members], backend=self.backend)
+                applied[conf.name] = conf
+                created.append(self.groups[conf.name])
+
+    @staticmethod
+    def __requires_setup(conf: Config, new_conf: Optional[Config]) -> bool:
+        if new_conf is None or new_conf.type != conf.type:
+            return True
+        return any(getattr(new_conf, option) != getattr(conf, option) for option in SETUP_OPTIONS[conf.type])
+
+    def __update(self, conf: Config):
+        if conf.type == "group":
+            pin = self.groups[conf.name]
+        elif conf.type == "out":
+            pin = self.outs[conf.name]
+            pin.min_switch_interval_sec = conf.min_switch_interval_sec
+        elif conf.type == "counter":
+            pin = self.counters[conf.name]
+        else:
+            pin = self.ins[conf.name]
+            pin.poll_interval_sec = conf.poll_interval_sec
+            pin.set_filter(conf.debounce_ms, conf.majority_samples, conf.min_stable_ms)
+        pin.description = conf.description
+        logging.info("GPIO " + conf.name + " updated")
+        return pin
+
+    def __release(self, name: str, conf: Config):
+        if conf.type == "group":
+            group = self.groups.pop(name)
+            group.close()
+            return group
+        elif conf.type == "out":
+            out = self.outs.pop(name)
+            out.close()
+            self.snapshot.remove(name)
+            return out
+        elif conf.type == "counter":
+            counter = self.counters.pop(name)
+            counter.close()
+            return counter
+        else:
+            in_gpio = self.ins.pop(name)
+            in_gpio.close()
+            self.snapshot.remove(name)
+            return in_gpio
+
+
+
+class ConfigWatcher:
+    """
+    Reloads a config file if it is modified. The modification time is checked by check(), which is called
+    periodically by start() or by the owner (e.g. the event loop in unified mode)
+    """
+
+    def __init__(self, filename: str, on_change: Callable[[List[Config]], None]):
+        self.filename = filename
+        self.on_change = on_change
+        self.__modified = os.path.getmtime(filename)
+
+    def check(self):
+        try:
+            modified = os.path.getmtime(self.filename)
+            if modified == self.__modified:
+                return
+            self.__modified = modified
+            logging.info("config file " + self.filename + " modified. Reloading it")
+            self.on_change(load_configs(self.filename))
+        except Exception as e:
+            logging.error("Error reloading config file " + self.filename + ": " + str(e))
+
+    def start(self, interval_sec: float = 2):
+        Thread(target=self.__loop, args=(interval_sec,), daemon=True).start()
+
+    def __loop(self, interval_sec: float):
+        while True:
+            sleep(interval_sec)
+            self.check()
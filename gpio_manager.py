@@ -1,25 +1,382 @@
+import json
 import logging
-import RPi.GPIO as GPIO
-from threading import Thread
+from collections import deque
+from dataclasses import dataclass
+from threading import Thread, Lock, RLock, Condition
 from datetime import datetime, UTC
-from time import sleep
+from time import sleep, monotonic, perf_counter
+from typing import Optional, Callable, List, Dict, Any
+from uuid import uuid4
+from gpio_backend import GpioBackend, default_backend, EDGES, PULLS
+from gpio_metrics import registry as metrics
+from gpio_scheduler import Scheduler, Job, scheduler as default_scheduler
+from input_filter import InputFilter
+from state_buffer import MultiWindowStatistics
+
+
+
+@dataclass(frozen=True)
+class GpioEvent:
+    seq: int
+    name: str
+    kind: str       # 'in' or 'out'
+    on: bool
+    time: datetime
+    monotonic: float
+    source: Any
+    initial: bool = False    # the state of a newly registered pin, not a transition
+
+
+
+class Subscription:
+    """
+    A subscriber of the EventBus. Events are queued (bounded) per subscriber and delivered by the dispatch thread
+    of the bus, so a slow subscriber never stalls the sampling path. If the queue is full, the 'drop' policy
+    discards the oldest event, the 'coalesce' policy replaces a queued event of the same pin (falling back to
+    dropping the oldest one)
+    """
+
+    POLICIES = ["drop", "coalesce"]
+
+    def __init__(self, bus, callback: Callable[[GpioEvent], None], names: Optional[List[str]], max_queue: int, policy: str):
+        if policy not in self.POLICIES:
+            raise ValueError("unsupported policy '" + policy + "'. Supported: " + ", ".join(self.POLICIES))
+        self.bus = bus
+        self.callback = callback
+        self.names = None if names is None else set(names)
+        self.max_queue = max_queue
+        self.policy = policy
+        self.__queue = deque()
+        self.__lock = Lock()
+        self.__scheduled = False    # queued at the bus for dispatching
+        self.__closed = False
+        self.delivered = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.max_depth = 0
+        self.latency_sum_sec = 0.0
+        self.latency_max_sec = 0.0
+        self.__delay_histogram = metrics.histogram("gpio_dispatch_delay_seconds", "delay between publishing a pin change and delivering it to a subscriber")
+
+    @property
+    def depth(self) -> int:
+        return len(self.__queue)
+
+    def offer(self, event: GpioEvent):
+        if self.names is not None and event.name not in self.names:
+            return
+        with self.__lock:
+            if self.__closed:
+                return
+            if len(self.__queue) >= self.max_queue:
+                if self.policy == "coalesce" and self.__coalesce(event):
+                    self.coalesced += 1
+                else:
+                    self.__queue.popleft()
+                    self.dropped += 1
+            self.__queue.append(event)
+            self.max_depth = max(self.max_depth, len(self.__queue))
+            schedule = not self.__scheduled
+            self.__scheduled = True
+        if schedule:
+            self.bus.schedule(self)
+
+    def __coalesce(self, event: GpioEvent) -> bool:
+        for queued in self.__queue:
+            if queued.name == event.name:
+                self.__queue.remove(queued)
+                return True
+        return False
+
+    def close(self):
+        with self.__lock:
+            self.__closed = True
+            self.__queue.clear()
+
+    def dispatch(self) -> bool:
+        """
+        Called by the dispatch thread of the bus. Delivers the oldest queued event and returns True if more are queued
+        """
+        with self.__lock:
+            if self.__closed or not self.__queue:
+                self.__scheduled = False
+                return False
+            event = self.__queue.popleft()
+            more = len(self.__queue) > 0
+            self.__scheduled = more
+        latency = monotonic() - event.monotonic
+        self.delivered += 1
+        self.latency_sum_sec += latency
+        self.latency_max_sec = max(self.latency_max_sec, latency)
+        self.__delay_histogram.observe(latency)
+        try:
+            self.callback(event)
+        except Exception as e:
+            logging.error("Error in subscriber of " + event.name + ": " + str(e))
+        return more
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            'names': None if self.names is None else sorted(self.names),
+            'policy': self.policy,
+            'queue_depth': self.depth,
+            'queue_max_depth': self.max_depth,
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'coalesced': self.coalesced,
+            'latency_avg_ms': round(self.latency_sum_sec * 1000 / self.delivered, 3) if self.delivered > 0 else 0,
+            'latency_max_ms': round(self.latency_max_sec * 1000, 3)
+        }
+
+
+
+class EventBus:
+    """
+    Fans out pin changes to many subscribers in the order of their seq. Observers are called synchronously on
+    a publishing thread and have to be cheap; subscribers are decoupled by their own queue and served round
+    robin (one event per turn) by a single dispatch thread
+    """
+
+    def __init__(self):
+        self.__lock = RLock()
+        self.__seq = 0
+        self.__subscriptions: List[Subscription] = []
+        self.__observers: List[Callable[[GpioEvent], None]] = []
+        self.__pending = deque()   # events published while fanning out
+        self.__fanning_out = False
+        self.__ready = deque()     # subscriptions with queued events
+        self.__ready_condition = Condition()
+        self.published = 0
+        Thread(target=self.__dispatch_loop, daemon=True).start()
+
+    @property
+    def subscriptions(self) -> List[Subscription]:
+        return self.__subscriptions
+
+    def subscribe(self, callback: Callable[[GpioEvent], None], names: Optional[List[str]] = None, max_queue: int = 1000, policy: str = "coalesce") -> Subscription:
+        subscription = Subscription(self, callback, names, max_queue, policy)
+        with self.__lock:
+            self.__subscriptions = self.__subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        with self.__lock:
+            self.__subscriptions = [s for s in self.__subscriptions if s is not subscription]
+        subscription.close()
+
+    def add_observer(self, observer: Callable[[GpioEvent], None]):
+        with self.__lock:
+            self.__observers = self.__observers + [observer]
+
+    def publish(self, source, kind: str, on: bool, time: Optional[datetime] = None, initial: bool = False) -> GpioEvent:
+        # events are queued in the order of their seq and fanned out by one publishing thread at a time (outside
+        # the lock, as observers such as the rule engine switch outputs). Events published meanwhile, by other
+        # threads or by an observer, are fanned out by that thread once the current event is done
+        with self.__lock:
+            self.__seq += 1
+            event = GpioEvent(self.__seq, source.name, kind, on, datetime.now(UTC) if time is None else time, monotonic(), source, initial)
+            self.published += 1
+            self.__pending.append(event)
+            if self.__fanning_out:
+                return event
+            self.__fanning_out = True
+        while True:
+            with self.__lock:
+                if not self.__pending:
+                    self.__fanning_out = False
+                    return event
+                pending = self.__pending.popleft()
+            self.__fan_out(pending)
+
+    def __fan_out(self, event: GpioEvent):
+        for observer in self.__observers:
+            try:
+                observer(event)
+            except Exception as e:
+                logging.error("Error in observer of " + event.name + ": " + str(e))
+        for subscription in self.__subscriptions:
+            try:
+                subscription.offer(event)
+            except Exception as e:
+                logging.error("Error in subscription of " + event.name + ": " + str(e))
+
+    def schedule(self, subscription: Subscription):
+        with self.__ready_condition:
+            self.__ready.append(subscription)
+            self.__ready_condition.notify()
+
+    def __dispatch_loop(self):
+        while True:
+            with self.__ready_condition:
+                while not self.__ready:
+                    self.__ready_condition.wait()
+                subscription = self.__ready.popleft()
+            if subscription.dispatch():
+                self.schedule(subscription)
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            'published': self.published,
+            'subscriptions': [subscription.metrics() for subscription in self.__subscriptions]
+        }
+
+
+event_bus = EventBus()
+metrics.register_callback("gpio_events_published", "counter", "pin changes published on the event bus", lambda: [({}, event_bus.published)])
+metrics.register_callback("gpio_subscriber_queue_depth", "gauge", "current queue depth per event bus subscriber",
+                          lambda: [({'subscriber': str(index), 'names': ",".join(sorted(subscription.names or []))}, subscription.depth) for index, subscription in enumerate(event_bus.subscriptions)])
+metrics.register_callback("gpio_subscriber_dropped", "counter", "events dropped for slow event bus subscribers",
+                          lambda: [({'subscriber': str(index), 'names': ",".join(sorted(subscription.names or []))}, subscription.dropped) for index, subscription in enumerate(event_bus.subscriptions)])
+
+
+
+def format_time(time: Optional[datetime]) -> str:
+    return time.strftime("%Y-%m-%dT%H:%M:%S") if time else "Never"
+
+
+@dataclass(frozen=True)
+class PinSnapshot:
+    name: str
+    kind: str
+    on: bool
+    seq: int
+    last_on: str        # %Y-%m-%dT%H:%M:%S (UTC)
+    last_off: str
+    last_change: str
+    data: Dict[str, Any]
+    json: bytes
+    text: str
+    etag: str
+
+
+class StateSnapshot:
+    """
+    Versioned, pre-rendered state of all pins. Per-pin entries are re-rendered (once) when the pin changes, so
+    readers of the front ends neither format datetimes nor touch the hardware. Aggregated renderings are
+    cached per version
+    """
+
+    def __init__(self, bus: EventBus):
+        self.__lock = RLock()
+        self.__entries: Dict[str, PinSnapshot] = {}
+        self.__cache: Dict[str, Any] = {}
+        self.version = 0
+        self.instance = uuid4().hex[:8]   # distinguishes etags of different process runs
+        bus.add_observer(self.__on_event)
+
+    def __on_event(self, event: GpioEvent):
+        self.update(event.source, event.kind, event.on, event.seq)
+
+    def update(self, gpio, kind: str, on: bool, seq: int = 0):
+        dev_type = "Input" if kind == "in" else "Output"
+        state = "ON" if on else "OFF"
+        data = {'name': gpio.name, 'value': on, 'reverted': gpio.reverted, 'last_change': gpio.last_change.isoformat()}
+        description_line = f"\nDescription: {gpio.description}" if gpio.description else ""
+        text = (f"Pin {dev_type} '{gpio.name}': {state}\n"
+                f"Last ON: {format_time(gpio.last_on)} UTC\n"
+                f"Last OFF: {format_time(gpio.last_off)} UTC\n"
+                f"Last Change: {format_time(gpio.last_change)} UTC"
+                f"{description_line}")
+        body = json.dumps(data).encode("utf-8")
+        with self.__lock:
+            self.version += 1
+            # the etag is based on the version, as an entry may be re-rendered without a change of the state (see refresh())
+            self.__entries[gpio.name] = PinSnapshot(gpio.name, kind, on, seq, format_time(gpio.last_on), format_time(gpio.last_off), format_time(gpio.last_change), data, body, text,
+                                                    '"' + self.instance + "-" + gpio.name + "-" + str(self.version) + '"')
+            self.__cache = {}
+
+    def refresh(self, gpio):
+        """
+        Re-renders the entry of a pin whose static data (e.g. the description) changed
+        """
+        entry = self.__entries.get(gpio.name)
+        if entry is not None:
+            self.update(gpio, entry.kind, entry.on, entry.seq)
+
+    def invalidate(self):
+        """
+        Drops the cached renderings, e.g. after pins without entry (groups, counters) were added or removed
+        """
+        with self.__lock:
+            self.version += 1
+            self.__cache = {}
+
+    def get(self, name: str) -> Optional[PinSnapshot]:
+        return self.__entries.get(name)
+
+    def remove(self, name: str):
+        with self.__lock:
+            if self.__entries.pop(name, None) is not None:
+                self.version += 1
+                self.__cache = {}
+
+    @property
+    def etag(self) -> str:
+        return '"' + self.instance + "-" + str(self.version) + '"'
+
+    def cached(self, key: str, render: Callable[[Dict[str, PinSnapshot]], Any]) -> Any:
+        """
+        Returns the rendering of all entries identified by key. It is computed once per version
+        """
+        with self.__lock:
+            if key not in self.__cache:
+                self.__cache[key] = render(self.__entries)
+            return self.__cache[key]
+
+    def json(self) -> bytes:
+        return self.cached("json", lambda entries: json.dumps({
+            'inputs': {name: entry.data for name, entry in entries.items() if entry.kind == "in"},
+            'outputs': {name: entry.data for name, entry in entries.items() if entry.kind == "out"}
+        }).encode("utf-8"))
+
+
+state_snapshot = StateSnapshot(event_bus)
 
 
 
 class OutGpio:
 
-    def __init__(self, gpio_number: int, name: str, description: str, reverted: bool):
+    MAX_PWM_FREQUENCY_HZ = 1000
+
+    def __init__(self, gpio_number: int, name: str, description: str, reverted: bool, min_switch_interval_sec: float = 0, backend: Optional[GpioBackend] = None, bus: Optional[EventBus] = None, scheduler: Optional[Scheduler] = None, initial_on: bool = False, setup: bool = True):
+        """
+        Args:
+            min_switch_interval_sec: minimal time between two applied writes. Writes within the interval are deferred
+                                     until the interval expires; the last one wins. 0 disables rate limiting
+            initial_on: state the output is set up with
+            setup: False if the pin is already set up with the level of initial_on (e.g. by backend.setup_outputs())
+        """
         self.name = name
         self.description = description
         self.gpio_number = gpio_number
         self.reverted = reverted
-        self.__datetime_last_on = datetime.now()
-        self.__datetime_last_off = datetime.now()
+        self.min_switch_interval_sec = min_switch_interval_sec
+        self.backend = backend if backend is not None else default_backend()
+        self.bus = bus if bus is not None else event_bus
+        self.scheduler = scheduler if scheduler is not None else default_scheduler
+        self.__lock = RLock()
+        self.__on: Optional[bool] = None
+        self.__pending: Optional[bool] = None
+        self.__pending_job: Optional[Job] = None
+        self.__program_job: Optional[Job] = None
+        self.__program_generation = 0           # incremented on cancel. Steps of a cancelled program are ignored
+        self.program: Optional[str] = None      # active timed program: 'pulse', 'blink' or 'pwm'
+        self.__last_write = -min_switch_interval_sec
+        self.writes_applied = 0
+        self.writes_suppressed = 0     # requested state equals the current one
+        self.writes_coalesced = 0      # overwritten by a later write within the min switch interval
+        self.__applied_counter = metrics.counter("gpio_output_writes", "switch requests of outputs by result", pin=name, result="applied")
+        self.__suppressed_counter = metrics.counter("gpio_output_writes", "switch requests of outputs by result", pin=name, result="suppressed")
+        self.__coalesced_counter = metrics.counter("gpio_output_writes", "switch requests of outputs by result", pin=name, result="coalesced")
+        self.__datetime_last_on = datetime.now(UTC)
+        self.__datetime_last_off = datetime.now(UTC)
         self.__datetime_last_change = datetime.now(UTC)
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.gpio_number, GPIO.OUT)
-        logging.info("GPIO OUT " + name + " registered on " + str(self.gpio_number) + (" (reverted=true)" if self.reverted else ""))
-        self.switch(False)
+        level = not initial_on if reverted else initial_on
+        if setup:
+            self.backend.setup_output(self.gpio_number, level)
+        logging.info("GPIO OUT " + name + " registered on " + str(self.gpio_number) + " " + ("on" if initial_on else "off") + (" (reverted=true)" if self.reverted else ""))
+        with self.__lock:
+            self.__commit(initial_on, level, initial=True)
 
 
     @property
@@ -30,46 +387,400 @@ class OutGpio:
     def last_off(self) -> datetime:
         return self.__datetime_last_off
 
+    @property
+    def last_change(self) -> datetime:
+        return self.__datetime_last_change
+
     def switch(self, on:bool):
+        with self.__lock:
+            self.__cancel_program()
+            self.__switch(on)
+
+    def pulse(self, duration_sec: float, on: bool = True):
+        """
+        Switches to the given state for duration_sec and back afterwards. Within the min switch interval, the pulse
+        is delayed until the interval is over and lasts at least the interval
+        """
+        if not duration_sec > 0:
+            raise ValueError("duration has to be greater than 0")
+        with self.__lock:
+            self.__cancel_program()
+            logging.info("pulsing OUT " + str(self.gpio_number) + " " + ("on" if on else "off") + " for " + str(duration_sec) + " sec")
+            self.program = "pulse"
+            self.__switch(on)
+            delay_sec = duration_sec
+            if self.__pending_job is not None:
+                # the switch is deferred by the min switch interval. The pulse starts once it is applied and the
+                # switch back can not happen before the interval is over
+                delay_sec = max(self.__pending_job.due - monotonic(), 0) + max(duration_sec, self.min_switch_interval_sec)
+            generation = self.__program_generation
+            self.__program_job = self.scheduler.call_later(delay_sec, lambda: self.__end_pulse(not on, generation))
+
+    def __end_pulse(self, on: bool, generation: int):
+        with self.__lock:
+            if generation != self.__program_generation:
+                return   # cancelled after the scheduler has taken the job
+            self.__program_job = None
+            self.program = None
+            self.__switch(on)
+
+    def blink(self, on_sec: float, off_sec: float, count: int = 0):
+        """
+        Blinks count times (0 = until the next switch/pulse/blink/pwm call). Like PWM, the logical state is on while
+        blinking; only the start and the end are published and counted, not the single blink phases. Phases shorter
+        than the min switch interval are stretched to it
+        """
+        if not (on_sec > 0 and off_sec > 0):
+            raise ValueError("on and off duration have to be greater than 0")
+        if count < 0:
+            raise ValueError("count has to be 0 or greater")
+        with self.__lock:
+            self.__cancel_program()
+            on_sec, off_sec = max(on_sec, self.min_switch_interval_sec), max(off_sec, self.min_switch_interval_sec)
+            logging.info("blinking OUT " + str(self.gpio_number) + " " + str(on_sec) + "/" + str(off_sec) + " sec " + (str(count) + " times" if count > 0 else "endlessly"))
+            self.program = "blink"
+            self.__switch(True)
+            # a switch deferred by the min switch interval starts the first phase once it is applied
+            next_due = (self.__pending_job.due if self.__pending_job is not None else monotonic()) + on_sec
+            remaining, generation = count if count > 0 else None, self.__program_generation
+            self.__program_job = self.scheduler.call_at(next_due, lambda: self.__blink(False, next_due, on_sec, off_sec, remaining, generation))
+
+    def __blink(self, on: bool, due: float, on_sec: float, off_sec: float, remaining: Optional[int], generation: int):
+        with self.__lock:
+            if generation != self.__program_generation:
+                return
+            if not on and remaining is not None:
+                remaining -= 1
+                if remaining <= 0:
+                    self.__program_job = None
+                    self.program = None
+                    self.__switch(False)
+                    return
+            self.backend.write(self.gpio_number, not on if self.reverted else on)
+            self.__last_write = monotonic()   # the phases count for the min switch interval of a following switch
+            next_due = due + (on_sec if on else off_sec)
+            self.__program_job = self.scheduler.call_at(next_due, lambda: self.__blink(not on, next_due, on_sec, off_sec, remaining, generation))
+
+    def pwm(self, duty: float, frequency_hz: float):
+        """
+        Software PWM. The logical state is on while the PWM is active (duty > 0). The single PWM level changes are
+        neither published nor counted. Not supported for outputs with a min switch interval (e.g. relays)
+        """
+        if not 0 <= duty <= 1:
+            raise ValueError("duty has to be between 0 and 1")
+        if not 0 < frequency_hz <= self.MAX_PWM_FREQUENCY_HZ:
+            raise ValueError("frequency has to be between 0 and " + str(self.MAX_PWM_FREQUENCY_HZ) + " Hz")
+        if 0 < duty < 1 and self.min_switch_interval_sec > 0:
+            raise ValueError("PWM is not supported for outputs with a min switch interval")
+        with self.__lock:
+            self.__cancel_program()
+            if duty == 0 or duty == 1:
+                self.__switch(duty == 1)
+                return
+            logging.info("PWM OUT " + str(self.gpio_number) + " duty " + str(duty) + " at " + str(frequency_hz) + " Hz")
+            self.program = "pwm"
+            self.__switch(True)
+            period_sec = 1 / frequency_hz
+            self.__pwm(True, monotonic(), duty * period_sec, (1 - duty) * period_sec, self.__program_generation)
+
+    def __pwm(self, on: bool, due: float, on_sec: float, off_sec: float, generation: int):
+        with self.__lock:
+            if generation != self.__program_generation:
+                return
+            self.backend.write(self.gpio_number, not on if self.reverted else on)
+            next_due = due + (on_sec if on else off_sec)
+            now = monotonic()
+            if next_due < now - (on_sec + off_sec):
+                next_due = now   # fell behind more than a period. Re-anchor instead of catching up
+            self.__program_job = self.scheduler.call_at(next_due, lambda: self.__pwm(not on, next_due, on_sec, off_sec, generation))
+
+    def __cancel_program(self):
+        self.__program_generation += 1
+        if self.__program_job is not None:
+            self.__program_job.cancel()
+            self.__program_job = None
+        if self.program in ["blink", "pwm"] and self.__on is not None:
+            # restore the level of the logical state
+            self.backend.write(self.gpio_number, not self.__on if self.reverted else self.__on)
+        self.program = None
+
+    def __switch(self, on: bool):
+        if self.__pending is not None:
+            # a deferred write is waiting for the min switch interval. The latest request wins
+            if self.__pending != on:
+                self.writes_coalesced += 1
+                self.__coalesced_counter.inc()
+            self.__pending = on
+            return
+        if on == self.__on:
+            self.writes_suppressed += 1
+            self.__suppressed_counter.inc()
+            return
+        wait_sec = self.__last_write + self.min_switch_interval_sec - monotonic()
+        if wait_sec > 0:
+            self.__pending = on
+            self.__pending_job = self.scheduler.call_later(wait_sec, self.__apply_pending)
+            return
+        self.__write(on)
+
+    def __apply_pending(self):
+        with self.__lock:
+            on = self.__pending
+            self.__pending = None
+            self.__pending_job = None
+            if on is None or on == self.__on:
+                self.writes_suppressed += 1
+                self.__suppressed_counter.inc()
+                return
+            self.__write(on)
+
+    def __write(self, on: bool):
         logging.info("setting OUT " + str(self.gpio_number) + " " + ("on" if on else "off"))
-        if self.reverted:
-            on = not on
-        if on:
-            GPIO.output(self.gpio_number,GPIO.HIGH)
-            self.__datetime_last_on = datetime.now(UTC)
-            self.__datetime_last_change = datetime.now(UTC)
+        level = not on if self.reverted else on
+        self.backend.write(self.gpio_number, level)
+        self.__commit(on, level)
+
+    def _remaining_interval_sec(self) -> float:
+        """
+        Returns the time until the min switch interval of the last write is over
+        """
+        with self.__lock:
+            return max(self.__last_write + self.min_switch_interval_sec - monotonic(), 0)
+
+    def _begin_group_write(self, on: bool) -> Optional[bool]:
+        """
+        Prepares a write performed by an OutGpioGroup. Returns the level to write or None if the state is unchanged.
+        Group writes cancel running programs and pending writes. The group defers its write until the min switch
+        interval of the changed members is over
+        """
+        with self.__lock:
+            self.__cancel_program()
+            if self.__pending_job is not None:
+                self.__pending_job.cancel()
+                self.__pending_job = None
+            self.__pending = None
+            if on == self.__on:
+                self.writes_suppressed += 1
+                self.__suppressed_counter.inc()
+                return None
+            return not on if self.reverted else on
+
+    def _commit_group_write(self, on: bool):
+        with self.__lock:
+            self.__commit(on, not on if self.reverted else on)
+
+    def __commit(self, on: bool, level: bool, initial: bool = False):
+        self.__on = on
+        self.__last_write = monotonic()
+        self.writes_applied += 1
+        self.__applied_counter.inc()
+        now = datetime.now(UTC)
+        if level:
+            self.__datetime_last_on = now
         else:
-            GPIO.output(self.gpio_number,GPIO.LOW)
-            self.__datetime_last_off = datetime.now(UTC)
-            self.__datetime_last_change = datetime.now(UTC)
+            self.__datetime_last_off = now
+        self.__datetime_last_change = now
+        self.bus.publish(self, "out", on, now, initial)
+
+    def register_listener(self, listener: Callable[[], None]) -> Subscription:
+        """
+        Registers a listener which is called (on the dispatch thread of the event bus) after each state change
+        """
+        return self.bus.subscribe(lambda event: listener(), names=[self.name])
+
+    def close(self):
+        """
+        Stops programs and pending writes, switches off and frees the pin
+        """
+        with self.__lock:
+            self.__cancel_program()
+            if self.__pending_job is not None:
+                self.__pending_job.cancel()
+                self.__pending_job = None
+            self.__pending = None
+            self.backend.write(self.gpio_number, self.reverted)
+            self.backend.release(self.gpio_number)
+        logging.info("GPIO OUT " + self.name + " on " + str(self.gpio_number) + " released")
+
+    def write_counters(self) -> Dict[str, Any]:
+        return {
+            'applied': self.writes_applied,
+            'suppressed': self.writes_suppressed,
+            'coalesced': self.writes_coalesced,
+            'pending': 0 if self.__pending is None else 1,
+            'program': self.program
+        }
 
     def is_on(self) -> bool:
-        return GPIO.input(self.gpio_number)
+        return self.backend.read(self.gpio_number)
 
     @property
     def on(self) -> bool:
-        return self.is_on() if not self.reverted else not self.is_on()
+        return self.__on
 
 
 
+class OutGpioGroup:
+    """
+    Named set of outputs (e.g. a relay board) which is switched at once. The state is a bit mask; bit 0 is the
+    first member. All member levels are written by a single backend call (one group write for lgpio), so the
+    outputs change without the skew of one-by-one writes. If a member to change is within its min switch interval,
+    the whole write is deferred until the interval is over; the last requested mask wins
+    """
+
+    def __init__(self, name: str, description: str, members: List[OutGpio], backend: Optional[GpioBackend] = None):
+        if len(members) == 0:
+            raise ValueError("group " + name + " has no members")
+        self.name = name
+        self.description = description
+        self.members = members
+        self.backend = backend if backend is not None else members[0].backend
+        self.__lock = Lock()
+        self.__pending_mask: Optional[int] = None
+        self.__pending_job: Optional[Job] = None
+        self.writes = 0
+        self.__write_counter = metrics.counter("gpio_group_writes", "writes of output groups", group=name)
+        self.__write_histogram = metrics.histogram("gpio_group_write_seconds", "duration of the backend write of output groups", group=name)
+        self.backend.setup_group([member.gpio_number for member in members])
+        logging.info("GPIO GROUP " + name + " registered with " + ", ".join(member.name for member in members))
+
+    @property
+    def max_mask(self) -> int:
+        return (1 << len(self.members)) - 1
+
+    @property
+    def mask(self) -> int:
+        return sum(1 << index for index, member in enumerate(self.members) if member.on)
+
+    def states(self) -> Dict[str, bool]:
+        return {member.name: member.on is True for member in self.members}
+
+    def set(self, mask: int):
+        if not 0 <= mask <= self.max_mask:
+            raise ValueError("mask has to be between 0 and " + str(self.max_mask))
+        with self.__lock:
+            if self.__pending_job is not None:
+                self.__pending_mask = mask
+                return
+            wait_sec = max([member._remaining_interval_sec() for index, member in enumerate(self.members) if ((mask >> index) & 1 == 1) != (member.on is True)], default=0)
+            if wait_sec > 0:
+                self.__pending_mask = mask
+                self.__pending_job = self.members[0].scheduler.call_later(wait_sec, self.__apply_pending)
+                return
+            self.__write(mask)
+
+    def __apply_pending(self):
+        with self.__lock:
+            mask = self.__pending_mask
+            self.__pending_mask = None
+            self.__pending_job = None
+        if mask is not None:
+            self.set(mask)
+
+    def __write(self, mask: int):
+        # called with the group lock held
+        changed = []
+        levels = {}
+        for index, member in enumerate(self.members):
+            on = (mask >> index) & 1 == 1
+            level = member._begin_group_write(on)
+            if level is not None:
+                changed.append((member, on))
+                levels[member.gpio_number] = level
+        if len(levels) == 0:
+            return
+        logging.info("setting GROUP " + self.name + " to " + bin(mask))
+        with self.__write_histogram.time():
+            self.backend.write_many(levels)
+        self.writes += 1
+        self.__write_counter.inc()
+        for member, on in changed:
+            member._commit_group_write(on)
+
+    def set_states(self, states: Dict[str, bool]):
+        """
+        Sets the given members and keeps the other ones unchanged
+        """
+        names = [member.name for member in self.members]
+        for name in states.keys():
+            if name not in names:
+                raise ValueError("unknown member " + name)
+        mask = self.mask
+        for index, name in enumerate(names):
+            if name in states:
+                mask = (mask | (1 << index)) if states[name] else (mask & ~(1 << index))
+        self.set(mask)
+
+    def close(self):
+        with self.__lock:
+            if self.__pending_job is not None:
+                self.__pending_job.cancel()
+                self.__pending_job = None
+            self.__pending_mask = None
+        self.backend.release_group([member.gpio_number for member in self.members])
+
+    def register_listener(self, listener: Callable[[], None]) -> Subscription:
+        """
+        Registers a listener which is called after each state change of a member
+        """
+        return self.members[0].bus.subscribe(lambda event: listener(), names=[member.name for member in self.members])
+
+
 
 class InGpio:
 
-    def __init__(self, gpio_number: int, name: str, description: str, reverted: bool):
+    def __init__(self, gpio_number: int, name: str, description: str, reverted: bool, edge: str = "both", bouncetime_ms: int = 50, poll_interval_sec: float = 60, stats_windows_sec: List[int] = (10, 60, 900), backend: Optional[GpioBackend] = None, bus: Optional[EventBus] = None, setup: bool = True, pull: str = "off", poll_thread: bool = True,
+                 debounce_ms: int = 0, majority_samples: int = 1, min_stable_ms: int = 0, scheduler: Optional[Scheduler] = None):
+        """
+        Args:
+            edge: raw electrical edge which triggers a state check ('rising', 'falling' or 'both')
+            bouncetime_ms: debounce time of the edge detection. 0 disables debouncing
+            poll_interval_sec: interval of the fallback polling which reconciles missed edges
+            stats_windows_sec: window sizes of the statistics (duty cycle, edge rate, pulse widths)
+            setup: False if the pin is already set up (e.g. by backend.setup_inputs())
+            pull: pull resistor of the pin ('off', 'up' or 'down')
+            poll_thread: False if the owner calls poll() instead of a polling thread (e.g. the event loop in unified mode)
+            debounce_ms: software debounce. Changes following an accepted change within this time are suppressed
+            majority_samples: number of reads per sample. The majority of them is the sampled level
+            min_stable_ms: a new level has to be stable for this time before it is accepted (glitch filter)
+        """
+        if edge.lower() not in EDGES:
+            raise ValueError("unsupported edge '" + edge + "'. Supported: " + ", ".join(EDGES))
+        if pull.lower() not in PULLS:
+            raise ValueError("unsupported pull '" + pull + "'. Supported: " + ", ".join(PULLS))
         self.name = name
         self.description = description
         self.gpio_number = gpio_number
         self.reverted = reverted
+        self.backend = backend if backend is not None else default_backend()
+        self.bus = bus if bus is not None else event_bus
+        self.edge = edge.lower()
+        self.bouncetime_ms = bouncetime_ms
+        self.poll_interval_sec = poll_interval_sec
+        self.pull = pull.lower()
+        self.scheduler = scheduler if scheduler is not None else default_scheduler
+        self.__filter = InputFilter(debounce_ms, majority_samples, min_stable_ms)
+        self.__recheck_job: Optional[Job] = None
+        self.__edge_recheck_job: Optional[Job] = None
+        self.last_poll = monotonic()
+        self.__closed = False
+        self.__lock = RLock()
         self.__on = None
         self.__datetime_last_on = datetime.now(UTC)
         self.__datetime_last_off = datetime.now(UTC)
         self.__datetime_last_change = datetime.now(UTC)
-        self.listener = lambda: None
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setup(self.gpio_number, GPIO.IN)
+        self.__statistics = MultiWindowStatistics(stats_windows_sec)
+        self.__edge_counter = metrics.counter("gpio_input_edges", "edge interrupts per input pin", pin=name)
+        self.__change_counter = metrics.counter("gpio_input_changes", "state changes per input pin", pin=name)
+        self.__raw_change_counter = metrics.counter("gpio_input_raw_changes", "raw level changes per input pin before the input filter", pin=name)
+        self.__check_histogram = metrics.histogram("gpio_input_check_seconds", "duration of sampling an input pin and publishing its change", pin=name)
+        if setup:
+            self.backend.setup_input(self.gpio_number, self.pull)
         logging.info("GPIO IN " + name + " registered on " + str(self.gpio_number) + (" (reverted=true)" if self.reverted else ""))
-        GPIO.add_event_detect(self.gpio_number, GPIO.BOTH, callback=self.__check())
-        Thread(target=self.__loop, daemon=True).start()
+        self.__check()
+        self.backend.add_edge_detect(self.gpio_number, self.edge, self.__on_edge, self.bouncetime_ms)
+        if poll_thread:
+            Thread(target=self.__loop, daemon=True).start()
 
     @property
     def on(self) -> bool:
@@ -87,30 +798,121 @@ class InGpio:
     def last_change(self) -> datetime:
         return self.__datetime_last_change
 
-    def register_listener(self, listener):
-        self.listener = listener
+    def statistics(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns the windowed statistics (duty cycle, on/off time, edge count and rate, pulse widths) keyed by window (e.g. '1m')
+        """
+        with self.__lock:
+            return self.__statistics.statistics()
+
+    def edge_counts(self) -> Dict[str, int]:
+        """
+        Returns the number of raw level changes seen by the sampler and of the changes which passed the input filter
+        """
+        with self.__lock:
+            return self.__filter.counts()
+
+    def set_filter(self, debounce_ms: int, majority_samples: int, min_stable_ms: int):
+        """
+        Changes the options of the input filter (see InputFilter). A pending candidate is kept
+        """
+        if majority_samples < 1 or debounce_ms < 0 or min_stable_ms < 0:
+            raise ValueError("invalid input filter of " + self.name)
+        with self.__lock:
+            self.__filter.debounce_sec = debounce_ms / 1000
+            self.__filter.majority_samples = majority_samples
+            self.__filter.min_stable_sec = min_stable_ms / 1000
+
+    def register_listener(self, listener: Callable[[], None]) -> Subscription:
+        """
+        Registers an additional listener which is called (on the dispatch thread of the event bus) after each state change
+        """
+        return self.bus.subscribe(lambda event: listener(), names=[self.name])
+
+    def poll(self):
+        """
+        Samples the pin and publishes a missed change
+        """
+        self.last_poll = monotonic()
+        if self.__closed:
+            return
+        try:
+            self.__check()
+        except Exception as e:
+            logging.error("Error in GPIO IN " + self.name + " listener: " + str(e))
+
+    def __on_edge(self, channel):
+        if self.__closed:
+            return
+        self.__edge_counter.inc()
+        try:
+            self.__check()
+        except Exception as e:
+            logging.error("Error in GPIO IN " + self.name + " edge callback: " + str(e))
+        if self.bouncetime_ms > 0:
+            # edges within the bounce time are dropped by the edge detection (e.g. the trailing edge of a short
+            # pulse). The pin is sampled again once the bounce time of the last edge is over
+            with self.__lock:
+                if self.__edge_recheck_job is not None:
+                    self.__edge_recheck_job.cancel()
+                if not self.__closed:
+                    self.__edge_recheck_job = self.scheduler.call_later(self.bouncetime_ms / 1000, self.__edge_recheck)
 
     def __check(self):
-        new_on = GPIO.input(self.gpio_number) == 1
-        if new_on != self.__on:
+        start = perf_counter()
+        with self.__lock:
+            self.__check_locked()
+        self.__check_histogram.observe(perf_counter() - start)
+
+    def __recheck(self):
+        with self.__lock:
+            self.__recheck_job = None
+        self.poll()
+
+    def __edge_recheck(self):
+        with self.__lock:
+            self.__edge_recheck_job = None
+        self.poll()
+
+    def __check_locked(self):
+        raw_edges = self.__filter.raw_edges
+        new_on = self.__filter.update([self.backend.read(self.gpio_number) for _ in range(self.__filter.majority_samples)], monotonic())
+        self.__raw_change_counter.inc(self.__filter.raw_edges - raw_edges)
+        if new_on is None:
+            if self.__filter.due is not None and self.__recheck_job is None and not self.__closed:
+                # the pending level is sampled again once it may be accepted
+                self.__recheck_job = self.scheduler.call_at(self.__filter.due, self.__recheck)
+        elif new_on != self.__on:
+            initial = self.__on is None
+            self.__change_counter.inc()
             self.__on = new_on
             self.__datetime_last_change = datetime.now(UTC)
             if new_on:
                 self.__datetime_last_on = datetime.now(UTC)
             else:
                 self.__datetime_last_off = datetime.now(UTC)
+            self.__statistics.update(self.on)
 
             msg = "GPIO IN " + self.name + " new effective state: " + str(self.on) + " last_change: " + self.__datetime_last_change.strftime("%Y-%m-%dT%H:%M:%S")
-            config = "GPIO " + str(self.gpio_number) + ": " + str(GPIO.input(self.gpio_number)) + ("; reverted" if self.reverted else "")
+            config = "GPIO " + str(self.gpio_number) + ": " + str(int(new_on)) + ("; reverted" if self.reverted else "")
             logging.info(msg + " (" + config + ")")
 
-            self.listener()
+            self.bus.publish(self, "in", self.on, self.__datetime_last_change, initial)
+
+    def close(self):
+        """
+        Stops the edge detection and polling and frees the pin
+        """
+        with self.__lock:
+            self.__closed = True
+            if self.__recheck_job is not None:
+                self.__recheck_job.cancel()
+            if self.__edge_recheck_job is not None:
+                self.__edge_recheck_job.cancel()
+            self.backend.release(self.gpio_number)
+        logging.info("GPIO IN " + self.name + " on " + str(self.gpio_number) + " released")
 
     def __loop(self):
-        while True:
-            try:
-                self.__check()
-            except Exception as e:
-                logging.error("Error in GPIO IN " + self.name + " listener: " + str(e))
-            finally:
-                sleep(2)
\ No newline at end of file
+        while not self.__closed:
+            self.poll()
+            sleep(self.poll_interval_sec)
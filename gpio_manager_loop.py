@@ -0,0 +1,265 @@
+import json
+import asyncio
+import logging
+from collections import deque
+from http import HTTPStatus
+from http.client import parse_headers
+from io import BytesIO
+from threading import Lock
+from time import monotonic
+from types import SimpleNamespace
+from urllib.parse import urlparse, parse_qs
+from typing import Callable, Dict, List, Optional, Set, Tuple
+from event_history import EventHistory
+from gpio_metrics import registry as metrics
+from gpio_manager import OutGpio, InGpio, OutGpioGroup, EventBus, GpioEvent, StateSnapshot, state_snapshot
+from pulse_counter import PulseCounter
+from gpio_manager_web import SimpleRequestHandler, ChangeRing, EventsQuery, sse_frame, long_poll_body, MAX_CLIENT_BUFFER, HEARTBEAT_SEC, KEEP_ALIVE
+
+
+
+class LoopBridge:
+    """
+    Hands the pin changes over to an asyncio loop. An inline bus observer appends the events of all pins to a
+    single thread-safe queue and wakes the loop at most once per batch. Listeners run on the loop, so the front
+    ends served by the loop are updated without a dispatch thread per subscriber
+    """
+
+    def __init__(self, bus: EventBus, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.__queue = deque()
+        self.__lock = Lock()
+        self.__scheduled = False
+        self.__listeners: List[Tuple[Optional[Set[str]], Callable[[GpioEvent], None]]] = []
+        self.delivered = 0
+        self.wakeups = 0
+        self.__delay_histogram = metrics.histogram("gpio_loop_dispatch_delay_seconds", "delay between publishing a pin change and handling it on the event loop")
+        bus.add_observer(self.__on_event)
+
+    def subscribe(self, callback: Callable[[GpioEvent], None], names: Optional[List[str]] = None) -> Tuple[Optional[Set[str]], Callable[[GpioEvent], None]]:
+        """
+        Registers a listener which is called on the loop for each change of the given pins (all if None)
+        """
+        listener = (None if names is None else set(names), callback)
+        self.__listeners = self.__listeners + [listener]
+        return listener
+
+    def unsubscribe(self, listener: Tuple[Optional[Set[str]], Callable[[GpioEvent], None]]):
+        self.__listeners = [registered for registered in self.__listeners if registered is not listener]
+
+    def call_every(self, interval_sec: float, fn: Callable[[], None]):
+        """
+        Calls fn on the loop every interval_sec
+        """
+        def run():
+            try:
+                fn()
+            except Exception as e:
+                logging.error("Error in periodic loop call: " + str(e))
+            self.loop.call_later(interval_sec, run)
+        self.loop.call_later(interval_sec, run)
+
+    def __on_event(self, event: GpioEvent):
+        # runs on the publishing thread
+        self.__queue.append(event)
+        with self.__lock:
+            if self.__scheduled:
+                return
+            self.__scheduled = True
+        self.loop.call_soon_threadsafe(self.__drain)
+
+    def __drain(self):
+        with self.__lock:
+            self.__scheduled = False
+        self.wakeups += 1
+        while self.__queue:
+            event = self.__queue.popleft()
+            self.__delay_histogram.observe(monotonic() - event.monotonic)
+            for names, callback in self.__listeners:
+                if names is None or event.name in names:
+                    try:
+                        callback(event)
+                    except Exception as e:
+                        logging.error("Error in loop listener of " + event.name + ": " + str(e))
+            self.delivered += 1
+
+
+
+class LoopChangeStream:
+    """
+    Counterpart of ChangeStream which is served by the event loop. The ring buffer of recent changes is only
+    accessed on the loop
+    """
+
+    def __init__(self, bridge: LoopBridge, ring_size: int = 1000):
+        self.__ring = ChangeRing(ring_size)
+        self.__waiters: Set[asyncio.Future] = set()
+        self.__clients: Dict[asyncio.StreamWriter, Optional[Set[str]]] = {}
+        bridge.subscribe(self.__on_event)
+
+    @property
+    def client_count(self) -> int:
+        return len(self.__clients)
+
+    @property
+    def latest_seq(self) -> int:
+        return self.__ring.latest_seq
+
+    def __on_event(self, event: GpioEvent):
+        payload = self.__ring.append(event)
+        for waiter in self.__waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+        frame = sse_frame(event.seq, payload)
+        for writer, names in list(self.__clients.items()):
+            if names is None or event.name in names:
+                if writer.transport.get_write_buffer_size() > MAX_CLIENT_BUFFER:
+                    logging.warning("dropping slow event stream client")
+                    self.__clients.pop(writer, None)
+                    writer.close()
+                else:
+                    writer.write(frame)
+
+    def events_since(self, since: int, names: Optional[List[str]] = None) -> List[str]:
+        return self.__ring.events_since(since, names)
+
+    async def wait_since(self, since: int, wait_sec: float, names: Optional[List[str]] = None) -> List[str]:
+        """
+        Returns the (json) changes newer than since. Waits up to wait_sec if there are none yet
+        """
+        deadline = monotonic() + wait_sec
+        while True:
+            events = self.events_since(since, names)
+            remaining = deadline - monotonic()
+            if len(events) > 0 or remaining <= 0:
+                return events
+            waiter = asyncio.get_running_loop().create_future()
+            self.__waiters.add(waiter)
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                self.__waiters.discard(waiter)
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, names: Optional[List[str]], last_event_id: Optional[int]):
+        """
+        Streams the changes to a Server-Sent Events client until it disconnects
+        """
+        accepted = None if names is None else set(names)
+        if last_event_id is not None:
+            writer.write(self.__ring.frames_since(last_event_id, accepted))
+        self.__clients[writer] = accepted
+        try:
+            while not writer.is_closing():
+                try:
+                    # SSE clients do not send anything after the request. Readable means closed
+                    if not await asyncio.wait_for(reader.read(4096), HEARTBEAT_SEC):
+                        break
+                except asyncio.TimeoutError:
+                    writer.write(KEEP_ALIVE)
+        finally:
+            self.__clients.pop(writer, None)
+
+
+
+class BufferedRequestHandler(SimpleRequestHandler):
+    """
+    Runs the request handling of the threaded web server on a buffered request instead of a socket
+    """
+
+    def __init__(self, request: bytes, client_address, server):
+        self.rfile = BytesIO(request)
+        self.wfile = BytesIO()
+        self.client_address = client_address
+        self.server = server
+        self.close_connection = True
+        self.handle_one_request()
+
+
+
+class LoopWebServer:
+    """
+    Plain web API served by the event loop. Connections are handled by asyncio streams and the requests by the
+    handler of the threaded web server; the change stream (SSE and long-poll) is served natively on the loop
+    """
+
+    def __init__(self, bridge: LoopBridge, in_gpios: Dict[str, InGpio], out_gpios: Dict[str, OutGpio], host='0.0.0.0', port=8000, snapshot: Optional[StateSnapshot] = None, history: Optional[EventHistory] = None, groups: Optional[Dict[str, OutGpioGroup]] = None, counters: Optional[Dict[str, PulseCounter]] = None):
+        self.host = host
+        self.port = port
+        self.loop = bridge.loop
+        self.change_stream = LoopChangeStream(bridge)
+        # provides the attributes the request handler expects on the server
+        self.state = SimpleNamespace(
+            out_gpios=out_gpios,
+            in_gpios=in_gpios,
+            change_stream=self.change_stream,
+            snapshot=snapshot if snapshot is not None else state_snapshot,
+            history=history,
+            groups=groups if groups is not None else {},
+            counters=counters if counters is not None else {},
+            request_histograms={method: metrics.histogram("gpio_http_request_seconds", "duration of plain web requests", method=method) for method in ["GET", "POST"]})
+        self.__server = None
+
+    def start(self):
+        # binds before the loop runs, so a port conflict fails the startup
+        self.__server = self.loop.run_until_complete(asyncio.start_server(self.__handle_connection, self.host, self.port))
+        logging.info(f"Web server started on the event loop: http://{self.host}:{self.port}")
+
+    def stop(self):
+        if self.__server is not None:
+            self.__server.close()
+        logging.info("Web server stopped")
+
+    async def __handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                headers = parse_headers(BytesIO(head.split(b"\r\n", 1)[1]))
+                try:
+                    length = int(headers.get("Content-Length", 0))
+                    if length < 0:
+                        raise ValueError("negative length")
+                except ValueError:
+                    # the end of the body is unknown, so the connection can not be kept alive
+                    await self.__respond(writer, 400, "application/json", b'{"error": "invalid Content-Length"}')
+                    break
+                body = await reader.readexactly(length) if length > 0 else b""
+                parsed_url = urlparse(head.split(b" ", 2)[1].decode("latin-1"))
+                if parsed_url.path == "/events":
+                    if not await self.__handle_events(reader, writer, parse_qs(parsed_url.query), headers.get("Last-Event-ID")):
+                        break
+                    continue
+                handler = BufferedRequestHandler(head + body, writer.get_extra_info("peername"), self.state)
+                writer.write(handler.wfile.getvalue())
+                await writer.drain()
+                if handler.close_connection:
+                    break
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, IndexError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def __handle_events(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, query_params: Dict[str, List[str]], last_event_id: Optional[str]) -> bool:
+        """
+        Returns True if the connection is kept alive
+        """
+        stream = self.change_stream
+        try:
+            query = EventsQuery.parse(query_params, last_event_id)
+        except ValueError as e:
+            await self.__respond(writer, 400, "application/json", json.dumps({'error': str(e)}).encode("utf-8"))
+            return True
+        if query.wait_sec is not None:
+            events = await stream.wait_since(stream.latest_seq if query.since is None else query.since, query.wait_sec, query.names)
+            await self.__respond(writer, 200, "application/json", long_poll_body(stream.latest_seq, events))
+            return True
+
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-type: text/event-stream\r\nCache-Control: no-cache\r\nConnection: close\r\n\r\n")
+        await stream.serve(reader, writer, query.names, query.last_event_id)
+        return False
+
+    @staticmethod
+    async def __respond(writer: asyncio.StreamWriter, status: int, content_type: str, body: bytes):
+        writer.write(("HTTP/1.1 " + str(status) + " " + HTTPStatus(status).phrase + "\r\nContent-type: " + content_type + "\r\nContent-Length: " + str(len(body)) + "\r\n\r\n").encode("latin-1") + body)
+        await writer.drain()
@@ -1,25 +1,107 @@
-from typing import Dict
-from gpio_manager import OutGpio, InGpio
+import asyncio
+import logging
+from threading import Thread
+from datetime import datetime, UTC
+from time import monotonic
+from typing import Any, Callable, Dict, List, Optional, Set
+from pydantic import AnyUrl
+from event_history import EventHistory, parse_time, start_of_today
+from gpio_metrics import registry as metrics, timed
+from gpio_manager import OutGpio, InGpio, OutGpioGroup, GpioEvent, StateSnapshot, PinSnapshot, event_bus, state_snapshot
+from gpio_manager_loop import LoopBridge
+from pulse_counter import PulseCounter
 from mcplib.server import MCPServer
 
+
+
+class ResourceSubscriber:
+    """
+    Resource subscriptions of an MCP client (session). Changes of the subscribed resources are collected and
+    sent at most once per notify_interval_sec, so a burst of edges results in a single update per resource.
+    Runs on the loop of the MCP server
+    """
+
+    def __init__(self, session: Any, loop: asyncio.AbstractEventLoop, notify_interval_sec: float, on_closed: Callable[["ResourceSubscriber"], None]):
+        self.session = session
+        self.loop = loop
+        self.notify_interval_sec = notify_interval_sec
+        self.on_closed = on_closed
+        self.uris: Set[str] = set()
+        self.notifications = 0
+        self.__notification_counter = metrics.counter("gpio_mcp_resource_updates", "resource update notifications sent to MCP clients")
+        self.__pending: Set[str] = set()
+        self.__last_flush = float("-inf")
+        self.__handle: Optional[asyncio.TimerHandle] = None
+
+    def offer(self, uri: str):
+        if uri not in self.uris:
+            return
+        self.__pending.add(uri)
+        if self.__handle is None:
+            delay = max(0.0, self.__last_flush + self.notify_interval_sec - monotonic())
+            self.__handle = self.loop.call_later(delay, self.__flush)
+
+    def close(self):
+        if self.__handle is not None:
+            self.__handle.cancel()
+            self.__handle = None
+
+    def __flush(self):
+        self.__handle = None
+        self.__last_flush = monotonic()
+        uris, self.__pending = self.__pending, set()
+        for uri in uris:
+            self.loop.create_task(self.__send(uri))
+
+    async def __send(self, uri: str):
+        try:
+            await self.session.send_resource_updated(AnyUrl(uri))
+            self.notifications += 1
+            self.__notification_counter.inc()
+        except Exception as e:
+            logging.info("dropping resource subscriptions of closed MCP session: " + str(e))
+            self.close()
+            self.on_closed(self)
+
+
+
 class GpioManagerMCPServer(MCPServer):
 
 
-    def __init__(self, name: str, port: int, in_gpios: Dict[str, InGpio], out_gpios: Dict[str, OutGpio]):
+    def __init__(self, name: str, port: int, in_gpios: Dict[str, InGpio], out_gpios: Dict[str, OutGpio], snapshot: Optional[StateSnapshot] = None, history: Optional[EventHistory] = None, groups: Optional[Dict[str, OutGpioGroup]] = None, bridge: Optional[LoopBridge] = None,
+                 counters: Optional[Dict[str, PulseCounter]] = None, notify_interval_sec: float = 0.5):
+        """
+        Args:
+            bridge: LoopBridge of the unified mode. Changes are handled on its loop instead of a dispatch thread
+            notify_interval_sec: minimum interval between two resource update notifications to the same client
+        """
         super().__init__(name, port)
+        self.notify_interval_sec = notify_interval_sec
+        self.loop: Optional[asyncio.AbstractEventLoop] = None   # loop of the MCP server, known with the first subscription
+        self.__subscribers: Dict[Any, ResourceSubscriber] = {}
+        self.__register_subscriptions()
         self.out_gpios = out_gpios
         self.in_gpios = in_gpios
-        for in_gpio in in_gpios.values():
-            in_gpio.register_listener(lambda gpio=in_gpio: self.on_in_changed(gpio))
+        self.groups = groups if groups is not None else {}
+        self.counters = counters if counters is not None else {}
+        self.snapshot = snapshot if snapshot is not None else state_snapshot
+        self.history = history
+        # a single subscription for all inputs, including the ones added by a config reload
+        if bridge is None:
+            event_bus.subscribe(self.__on_event)
+        else:
+            bridge.subscribe(self.__on_event)
 
-        @self.mcp.tool(name="list_names", description="Returns lists of all available input sensor and output actuator names.")
+        @self.tool(name="list_names", description="Returns lists of all available input sensor and output actuator names.")
         def list_names() -> str:
             """Provides the identifiers of all connected hardware pins to the AI."""
             inputs = ", ".join(self.in_gpios.keys()) or "None"
             outputs = ", ".join(self.out_gpios.keys()) or "None"
-            return f"Inputs: {inputs} | Outputs: {outputs}"
+            groups = ", ".join(self.groups.keys()) or "None"
+            counters = ", ".join(self.counters.keys()) or "None"
+            return f"Inputs: {inputs} | Outputs: {outputs} | Groups: {groups} | Counters: {counters}"
 
-        @self.mcp.tool(name="get_description", description="Returns a human-readable description of a specific pin's purpose.")
+        @self.tool(name="get_description", description="Returns a human-readable description of a specific pin's purpose.")
         def get_description(name: str) -> str:
             """
             Retrieves the 'description' field of a pin (e.g., 'Main garden light').
@@ -30,6 +112,8 @@ class GpioManagerMCPServer(MCPServer):
                 return f"Input '{name}': {self.in_gpios[name].description}"
             elif name in self.out_gpios:
                 return f"Output '{name}': {self.out_gpios[name].description}"
+            elif name in self.counters:
+                return f"Counter '{name}': {self.counters[name].description}"
             return f"Error: pin '{name}' not found."
 
 
@@ -47,52 +131,94 @@ class GpioManagerMCPServer(MCPServer):
                      and current state (ON/OFF) of each sensor. If no input sensors are
                      registered, it returns a clear fallback message.
             """
-            lines = ["Current GPIO Sensor Status:"]
-            for name, sensor in self.in_gpios.items():
-                state = "ON" if sensor.on else "OFF"
-                desc = sensor.description or "No description"
-                lines.append(f"- {name} ({desc}): {state}")
+            return self.snapshot.cached("mcp_inputs", self.__render_input_sensor_state)
 
-            if len(lines) == 1:
-                return "No sensors connected."
-
-            return "\n".join(lines)
+        @self.mcp.resource("inputpin://{name}")
+        def get_input_pin_state(name: str) -> str:
+            """
+            Retrieves the state of a single input sensor ('inputpin://<name>'). Clients may subscribe to it
+            to be notified about its changes instead of polling.
+            """
+            entry = self.snapshot.get(name)
+            if name not in self.in_gpios or entry is None:
+                raise ValueError(f"input '{name}' not found")
+            return entry.text
 
 
-        @self.mcp.tool(name="get_state", description="Returns the current logical state and activity timestamps (UTC) of a specific pin.")
+        @self.tool(name="get_state", description="Returns the current logical state and activity timestamps (UTC) of a specific pin.")
         def get_state(name: str) -> str:
             """
             Provides real-time status (ON/OFF) and telemetry data.
             Args:
                 name: The identifier of the pin (e.g., 'motion_sensor', 'led_strip').
             """
-            try:
-                # Identify if the pin is an input or an output
-                device = self.in_gpios.get(name) or self.out_gpios.get(name)
-                dev_type = "Input" if name in self.in_gpios else "Output"
+            if name in self.in_gpios or name in self.out_gpios:
+                entry = self.snapshot.get(name)
+                if entry is None:
+                    return f"Error retrieving {name} state: not available yet"
+                return entry.text
+            return f"Error: pin '{name}' not found. Use 'list_names' to see available pins."
 
-                if device:
-                    state = "ON" if device.on else "OFF"
-
-                    # Formatting timestamps to ISO 8601 strings
-                    last_on = device.last_on.strftime("%Y-%m-%dT%H:%M:%S") if device.last_on else "Never"
-                    last_off = device.last_off.strftime("%Y-%m-%dT%H:%M:%S") if device.last_off else "Never"
-                    last_change = device.last_change.strftime("%Y-%m-%dT%H:%M:%S") if device.last_change else "Never"
-                    description_line = f"\nDescription: {device.description}" if device.description else ""
-
-                    return (f"Pin {dev_type} '{name}': {state}\n"
-                            f"Last ON: {last_on} UTC\n"
-                            f"Last OFF: {last_off} UTC\n"
-                            f"Last Change: {last_change} UTC"
-                            f"{description_line}")
+        @self.tool(name="get_counter", description="Returns the cumulative pulse count, the pulse rates and the frequency of a pulse counter (e.g. flow or energy meter).")
+        def get_counter(name: str) -> str:
+            """
+            Provides the readings of a pulse counter input.
+            Args:
+                name: The identifier of the counter (e.g., 'water_meter').
+            """
+            if name not in self.counters:
+                return f"Error: counter '{name}' not found. Use 'list_names' to see available counters."
+            state = self.counters[name].state()
+            return (f"Counter '{name}': {state['count']} pulses in total, {state['pulses_per_sec']} pulses/s (last second), "
+                    f"{state['pulses_per_min']} pulses/min (last minute), frequency {state['frequency_hz']} Hz")
 
+        @self.tool(name="get_statistics", description="Returns windowed statistics (duty cycle, on/off time, edge rate, pulse widths) of an input sensor.")
+        def get_statistics(name: str) -> str:
+            """
+            Provides the statistics of an input pin for several time windows (e.g. 10s, 1m, 15m).
+            Args:
+                name: The identifier of the input pin (e.g., 'motion_sensor').
+            """
+            if name not in self.in_gpios:
+                return f"Error: pin '{name}' not found or is not an input sensor."
+            lines = [f"Statistics of input '{name}':"]
+            for window, stats in self.in_gpios[name].statistics().items():
+                lines.append(f"- {window}: duty cycle {stats['duty_cycle'] * 100:.1f}%, on {stats['on_sec']}s, off {stats['off_sec']}s, "
+                             f"{stats['edges']} edges ({stats['edge_rate_per_sec']}/s), "
+                             f"pulse width min/p50/p95/max: {stats['pulse_min_sec']}/{stats['pulse_p50_sec']}/{stats['pulse_p95_sec']}/{stats['pulse_max_sec']}s")
+            edges = self.in_gpios[name].edge_counts()
+            lines.append(f"- since start: {edges['raw']} raw level changes, {edges['filtered']} passed the input filter")
+            return "\n".join(lines)
 
-                return f"Error: pin '{name}' not found. Use 'list_names' to see available pins."
+        @self.tool(name="get_states", description="Returns the current states of several pins at once (all pins if no names are given).")
+        def get_states(names: Optional[List[str]] = None) -> str:
+            """
+            Provides the status of many pins in one call instead of one get_state call per pin.
+            Args:
+                names: Identifiers of the pins, e.g. ["door", "pump"]. Empty or omitted for all pins.
+            """
+            names = names or list(self.in_gpios.keys()) + list(self.out_gpios.keys())
+            lines = []
+            for name in names:
+                entry = self.snapshot.get(name) if name in self.in_gpios or name in self.out_gpios else None
+                lines.append(entry.text if entry is not None else f"Error: pin '{name}' not found.")
+            return "\n".join(lines)
 
-            except Exception as e:
-                return f"Error retrieving {name} state: {str(e)}"
+        @self.tool(name="set_states", description="Changes the states of several output actuators at once.")
+        def set_states(states: Dict[str, bool]) -> str:
+            """
+            Switches many outputs in one call. Nothing is switched if one of the names is not an output.
+            Args:
+                states: Output name to the wanted state, e.g. {"pump": true, "fan": false}.
+            """
+            unknown = [name for name in states.keys() if name not in self.out_gpios]
+            if len(unknown) > 0:
+                return f"Error: {', '.join(unknown)} not found or not an output actuator. Nothing was switched."
+            for name, on in states.items():
+                self.out_gpios[name].switch(on)
+            return "Successfully set " + ", ".join(f"{name} to {'ON' if on else 'OFF'}" for name, on in states.items())
 
-        @self.mcp.tool(name="set_state", description="Changes the state of an output actuator.")
+        @self.tool(name="set_state", description="Changes the state of an output actuator.")
         def set_state(name: str, on: bool) -> str:
             """
             Physically switches an output pin.
@@ -106,10 +232,200 @@ class GpioManagerMCPServer(MCPServer):
                 return f"Successfully set {name} to {state}"
             return f"Error: pin '{name}' not found or is not an output actuator."
 
+        @self.tool(name="pulse", description="Switches an output actuator on for a given duration (timed on the device) and off afterwards.")
+        def pulse(name: str, duration_ms: int) -> str:
+            """
+            Pulses an output pin, e.g. to trigger a door opener relay.
+            Args:
+                name: Identifier of the output (e.g., 'door_opener').
+                duration_ms: Duration of the pulse in milliseconds.
+            """
+            if name not in self.out_gpios:
+                return f"Error: pin '{name}' not found or is not an output actuator."
+            try:
+                self.out_gpios[name].pulse(duration_ms / 1000)
+            except ValueError as e:
+                return f"Error: {str(e)}"
+            return f"Successfully pulsed {name} for {duration_ms} ms"
+
+        @self.tool(name="blink", description="Blinks an output actuator (timed on the device).")
+        def blink(name: str, on_ms: int, off_ms: int, count: int = 0) -> str:
+            """
+            Blinks an output pin, e.g. a warning LED.
+            Args:
+                name: Identifier of the output (e.g., 'warn_led').
+                on_ms: On duration of each blink in milliseconds.
+                off_ms: Off duration of each blink in milliseconds.
+                count: Number of blinks. 0 blinks until the next set_state.
+            """
+            if name not in self.out_gpios:
+                return f"Error: pin '{name}' not found or is not an output actuator."
+            try:
+                self.out_gpios[name].blink(on_ms / 1000, off_ms / 1000, count)
+            except ValueError as e:
+                return f"Error: {str(e)}"
+            return f"Successfully started blinking {name} ({on_ms}/{off_ms} ms, {count if count > 0 else 'endless'})"
+
+        @self.tool(name="pwm", description="Drives an output actuator with software PWM (e.g. to dim a LED).")
+        def pwm(name: str, duty: float, frequency_hz: float = 100) -> str:
+            """
+            Starts software PWM on an output pin.
+            Args:
+                name: Identifier of the output (e.g., 'led_strip').
+                duty: Duty cycle between 0 (off) and 1 (fully on).
+                frequency_hz: PWM frequency in Hz.
+            """
+            if name not in self.out_gpios:
+                return f"Error: pin '{name}' not found or is not an output actuator."
+            try:
+                self.out_gpios[name].pwm(duty, frequency_hz)
+            except ValueError as e:
+                return f"Error: {str(e)}"
+            return f"Successfully set PWM of {name} to duty {duty} at {frequency_hz} Hz"
+
+        @self.tool(name="get_group", description="Returns the states of all outputs of an output group (e.g. a relay board) and its bit mask.")
+        def get_group(name: str) -> str:
+            """
+            Provides the member states of an output group. Bit 0 of the mask is the first member.
+            Args:
+                name: Identifier of the group (e.g., 'relays').
+            """
+            if name not in self.groups:
+                return f"Error: group '{name}' not found. Use 'list_names' to see available groups."
+            group = self.groups[name]
+            members = ", ".join(f"{member}: {'ON' if on else 'OFF'}" for member, on in group.states().items())
+            return f"Group '{name}' mask {bin(group.mask)} ({members})"
+
+        @self.tool(name="set_group", description="Switches all outputs of an output group at once (simultaneously on the device).")
+        def set_group(name: str, states: Dict[str, bool]) -> str:
+            """
+            Switches several outputs of a group in one atomic write. Members which are not given keep their state.
+            Args:
+                name: Identifier of the group (e.g., 'relays').
+                states: Output name to the wanted state, e.g. {"pump": true, "fan": false}.
+            """
+            if name not in self.groups:
+                return f"Error: group '{name}' not found. Use 'list_names' to see available groups."
+            try:
+                self.groups[name].set_states(states)
+            except ValueError as e:
+                return f"Error: {str(e)}"
+            return f"Successfully set group {name} to mask {bin(self.groups[name].mask)}"
+
+        @self.tool(name="get_history", description="Returns how often a pin switched on/off within a time range (default: today) and its latest transitions.")
+        def get_history(name: str, from_time: str = "", to_time: str = "", limit: int = 10) -> str:
+            """
+            Answers questions like 'how often did the door open today' from the persistent history.
+            Args:
+                name: The identifier of the pin.
+                from_time: Start of the range as ISO 8601 datetime (UTC) or epoch seconds. Default: today 00:00 UTC.
+                to_time: End of the range as ISO 8601 datetime (UTC) or epoch seconds. Default: now.
+                limit: Maximum number of listed transitions (the latest ones).
+            """
+            if self.history is None:
+                return "Error: history is disabled."
+            if name not in self.in_gpios and name not in self.out_gpios:
+                return f"Error: pin '{name}' not found. Use 'list_names' to see available pins."
+            try:
+                start = parse_time(from_time) if from_time else start_of_today()
+                end = parse_time(to_time) if to_time else datetime.now(UTC)
+            except ValueError as e:
+                return f"Error: invalid time: {str(e)}"
+            summary = self.history.summary(name, start, end)
+            lines = [f"Pin '{name}' from {summary['from']} to {summary['to']}: switched ON {summary['on_count']} times, OFF {summary['off_count']} times"]
+            events = self.history.query(name, start, end, limit=max(summary['on_count'] + summary['off_count'], 1))[-limit:] if limit > 0 else []
+            for event in events:
+                lines.append(f"- {event['time']}: {'ON' if event['value'] else 'OFF'}")
+            return "\n".join(lines)
+
+    def start(self):
+        # serves requests first. The mDNS registration (probing and announcing take seconds) runs in the background
+        Thread(target=self.__start_loop, daemon=True).start()
+        asyncio.run_coroutine_threadsafe(self.mcp.run_sse_async(), self.new_loop)
+        Thread(target=self._register_mdns, daemon=True).start()
+        logging.info(f"MCP Server '{self.name}' running on http://0.0.0.0:{self.port}/sse")
+
+    def __start_loop(self):
+        asyncio.set_event_loop(self.new_loop)
+        self.new_loop.run_forever()
+
+    def start_on_loop(self, loop: asyncio.AbstractEventLoop):
+        """
+        Serves MCP on the given (not yet running) loop instead of an own thread
+        """
+        Thread(target=self._register_mdns, daemon=True).start()
+        loop.create_task(self.mcp.run_sse_async())
+        logging.info(f"MCP Server '{self.name}' running on the event loop http://0.0.0.0:{self.port}/sse")
+
+    def tool(self, name: str, description: str):
+        """
+        Registers an MCP tool whose call durations are recorded
+        """
+        def decorator(fn):
+            histogram = metrics.histogram("gpio_mcp_tool_seconds", "duration of MCP tool calls", tool=name)
+            return self.mcp.tool(name=name, description=description)(timed(histogram)(fn))
+        return decorator
+
+    def __render_input_sensor_state(self, entries: Dict[str, PinSnapshot]) -> str:
+        lines = ["Current GPIO Sensor Status:"]
+        for name, sensor in self.in_gpios.items():
+            entry = entries.get(name)
+            state = "ON" if entry and entry.on else "OFF"
+            desc = sensor.description or "No description"
+            lines.append(f"- {name} ({desc}): {state}")
+
+        if len(lines) == 1:
+            return "No sensors connected."
+
+        return "\n".join(lines)
+
+    def __on_event(self, event: GpioEvent):
+        in_gpio = self.in_gpios.get(event.name)
+        if event.kind == "in" and in_gpio is not None:
+            self.on_in_changed(in_gpio)
+
     def on_in_changed(self, in_gpio: InGpio):
-        status = "ON" if in_gpio.on else "OFF"
-        identifier = in_gpio.description if in_gpio.description else "Unknown sensor"
+        if self.loop is not None and len(self.__subscribers) > 0:
+            self.loop.call_soon_threadsafe(self.__notify, ["inputpin://" + in_gpio.name, "inputpin://state"])
+
+    def __notify(self, uris: List[str]):
+        for subscriber in list(self.__subscribers.values()):
+            for uri in uris:
+                subscriber.offer(uri)
+
+    def __register_subscriptions(self):
+        server = self.mcp._mcp_server
+
+        @server.subscribe_resource()
+        async def subscribe(uri: AnyUrl):
+            self.loop = asyncio.get_running_loop()
+            session = server.request_context.session
+            subscriber = self.__subscribers.get(session)
+            if subscriber is None:
+                subscriber = ResourceSubscriber(session, self.loop, self.notify_interval_sec, self.__remove_subscriber)
+                self.__subscribers[session] = subscriber
+            subscriber.uris.add(str(uri))
+
+        @server.unsubscribe_resource()
+        async def unsubscribe(uri: AnyUrl):
+            subscriber = self.__subscribers.get(server.request_context.session)
+            if subscriber is not None:
+                subscriber.uris.discard(str(uri))
+                if len(subscriber.uris) == 0:
+                    self.__remove_subscriber(subscriber)
+
+        # the low level server announces subscribe=False regardless of the registered handlers
+        get_capabilities = server.get_capabilities
+
+        def get_capabilities_with_subscribe(*args, **kwargs):
+            capabilities = get_capabilities(*args, **kwargs)
+            if capabilities.resources is not None:
+                capabilities.resources.subscribe = True
+            return capabilities
+        server.get_capabilities = get_capabilities_with_subscribe
 
-        #self.mcp.push_log(f"Sensor '{identifier}' changed to {status}.", level="info")
-        #self.mcp.push_resource_update("inputpin://state")
+    def __remove_subscriber(self, subscriber: ResourceSubscriber):
+        subscriber.close()
+        if self.__subscribers.get(subscriber.session) is subscriber:
+            del self.__subscribers[subscriber.session]
 
@@ -0,0 +1,517 @@
+import json
+import uuid
+import socket
+import logging
+import tornado.ioloop
+from threading import Thread
+from time import perf_counter
+from typing import Any, List, Optional
+from webthing import (Action, MultipleThings, Property, Thing, Value, WebThingServer)
+from webthing.utils import get_ip
+from zeroconf import ServiceInfo, Zeroconf
+from gpio_metrics import registry as metrics
+from gpio_manager import OutGpio, InGpio, OutGpioGroup, state_snapshot
+from gpio_manager_loop import LoopBridge
+from pulse_counter import PulseCounter
+
+
+def unsubscribe(thing: Thing):
+    """
+    Stops the change notifications of a removed thing and closes its websocket subscribers
+    """
+    if thing.bridge is None:
+        thing.subscription.bus.unsubscribe(thing.subscription)
+    else:
+        thing.bridge.unsubscribe(thing.subscription)
+    for subscriber in list(thing.subscribers):
+        subscriber.close()
+
+
+class PulseAction(Action):
+
+    def __init__(self, thing, input_):
+        Action.__init__(self, uuid.uuid4().hex, thing, 'pulse', input_=input_)
+
+    def perform_action(self):
+        self.thing.out.pulse(self.input['duration_ms'] / 1000)
+
+
+class BlinkAction(Action):
+
+    def __init__(self, thing, input_):
+        Action.__init__(self, uuid.uuid4().hex, thing, 'blink', input_=input_)
+
+    def perform_action(self):
+        self.thing.out.blink(self.input['on_ms'] / 1000, self.input['off_ms'] / 1000, self.input.get('count', 0))
+
+
+class PwmAction(Action):
+
+    def __init__(self, thing, input_):
+        Action.__init__(self, uuid.uuid4().hex, thing, 'pwm', input_=input_)
+
+    def perform_action(self):
+        self.thing.out.pwm(self.input['duty'], self.input['frequency'])
+
+
+
+class OutThing(Thing):
+
+    # regarding capabilities refer https://iot.mozilla.org/schemas
+    # there is also another schema registry http://iotschema.org/docs/full.html not used by webthing
+
+    def __init__(self, out: OutGpio, bridge: Optional[LoopBridge] = None):
+        Thing.__init__(
+            self,
+            'urn:dev:ops:gpio_out-1',
+            'Out ' + out.name,
+            ['GpioOut'],
+            ""
+        )
+
+        self.ioloop = tornado.ioloop.IOLoop.current()
+        self.out = out
+
+        self.is_on = Value(state_snapshot.get(out.name).on, out.switch)
+        self.add_property(
+            Property(self,
+                     'is-on',
+                     self.is_on,
+                     metadata={
+                         'title': 'is on',
+                         "type": "boolean",
+                         'description': 'True if is on',
+                         'readOnly': False,
+                     }))
+
+        self.add_available_action(
+            'pulse',
+            {
+                'title': 'pulse',
+                'description': 'switches on for the given duration and off afterwards',
+                'input': {
+                    'type': 'object',
+                    'required': ['duration_ms'],
+                    'properties': {
+                        'duration_ms': {'type': 'integer', 'minimum': 1, 'unit': 'milliseconds'}
+                    }
+                }
+            },
+            PulseAction)
+
+        self.add_available_action(
+            'blink',
+            {
+                'title': 'blink',
+                'description': 'blinks count times (0 = endlessly until the next switch)',
+                'input': {
+                    'type': 'object',
+                    'required': ['on_ms', 'off_ms'],
+                    'properties': {
+                        'on_ms': {'type': 'integer', 'minimum': 1, 'unit': 'milliseconds'},
+                        'off_ms': {'type': 'integer', 'minimum': 1, 'unit': 'milliseconds'},
+                        'count': {'type': 'integer', 'minimum': 0}
+                    }
+                }
+            },
+            BlinkAction)
+
+        self.add_available_action(
+            'pwm',
+            {
+                'title': 'pwm',
+                'description': 'software PWM with the given duty cycle (0..1) and frequency',
+                'input': {
+                    'type': 'object',
+                    'required': ['duty', 'frequency'],
+                    'properties': {
+                        'duty': {'type': 'number', 'minimum': 0, 'maximum': 1},
+                        'frequency': {'type': 'number', 'minimum': 1, 'maximum': OutGpio.MAX_PWM_FREQUENCY_HZ, 'unit': 'hertz'}
+                    }
+                }
+            },
+            PwmAction)
+
+        self.bridge = bridge
+        if bridge is None:
+            self.subscription = self.out.register_listener(self.on_value_changed)
+        else:
+            self.subscription = bridge.subscribe(lambda event: self._on_value_changed(), names=[out.name])
+
+    def close(self):
+        unsubscribe(self)
+
+    def on_value_changed(self):
+        self.ioloop.add_callback(self._on_value_changed)
+
+    def _on_value_changed(self):
+        self.is_on.notify_of_external_update(state_snapshot.get(self.out.name).on)
+
+
+
+class GroupThing(Thing):
+
+    def __init__(self, group: OutGpioGroup, bridge: Optional[LoopBridge] = None):
+        Thing.__init__(
+            self,
+            'urn:dev:ops:gpio_group-1',
+            'Group ' + group.name,
+            ['GpioGroup'],
+            ""
+        )
+
+        self.ioloop = tornado.ioloop.IOLoop.current()
+        self.group = group
+
+        self.mask = Value(group.mask, lambda mask: group.set(int(mask)))
+        self.add_property(
+            Property(self,
+                     'mask',
+                     self.mask,
+                     metadata={
+                         'title': 'mask',
+                         "type": "integer",
+                         'description': 'states of the outputs ' + ", ".join(member.name for member in group.members) + ' as bit mask (bit 0 is the first one)',
+                         'minimum': 0,
+                         'maximum': group.max_mask,
+                         'readOnly': False,
+                     }))
+
+        self.bridge = bridge
+        if bridge is None:
+            self.subscription = self.group.register_listener(self.on_value_changed)
+        else:
+            self.subscription = bridge.subscribe(lambda event: self._on_value_changed(), names=[member.name for member in group.members])
+
+    def close(self):
+        unsubscribe(self)
+
+    def on_value_changed(self):
+        self.ioloop.add_callback(self._on_value_changed)
+
+    def _on_value_changed(self):
+        self.mask.notify_of_external_update(self.group.mask)
+
+
+
+class InThing(Thing):
+
+    # regarding capabilities refer https://iot.mozilla.org/schemas
+    # there is also another schema registry http://iotschema.org/docs/full.html not used by webthing
+
+    def __init__(self, in_gpio: InGpio, coalesce_window_ms: int = 20, bridge: Optional[LoopBridge] = None):
+        """
+        Args:
+            coalesce_window_ms: property changes within this window are sent as one propertyStatus message
+                                carrying the latest values
+            bridge: LoopBridge of the unified mode. Changes are handled on its loop instead of a dispatch thread
+        """
+        Thing.__init__(
+            self,
+            'urn:dev:ops:gpio_in-1',
+            'In ' + in_gpio.name,
+            ['GpioIn'],
+            ""
+        )
+
+        self.ioloop = tornado.ioloop.IOLoop.current()
+        self.in_gpio = in_gpio
+        self.coalesce_window_ms = coalesce_window_ms
+        self.__pending_properties = {}
+        self.__pending_updates = 0
+        self.__flush_handle = None
+        self.messages_sent = 0
+        self.messages_saved = 0
+        self.__sent_counter = metrics.counter("gpio_webthing_messages", "propertyStatus websocket messages", pin=in_gpio.name, result="sent")
+        self.__saved_counter = metrics.counter("gpio_webthing_messages", "propertyStatus websocket messages", pin=in_gpio.name, result="saved")
+        self.__flush_histogram = metrics.histogram("gpio_webthing_flush_seconds", "duration of sending coalesced property updates", pin=in_gpio.name)
+
+        self.is_on = Value(in_gpio.on)
+        self.add_property(
+            Property(self,
+                     'on',
+                     self.is_on,
+                     metadata={
+                         'title': 'is on',
+                         "type": "boolean",
+                         'description': 'True if is on',
+                         'readOnly': True,
+                     }))
+
+        self.last_on = Value(in_gpio.last_on.strftime("%Y-%m-%dT%H:%M:%S"))
+        self.add_property(
+            Property(self,
+                     'last_on',
+                     self.last_on,
+                     metadata={
+                         'title': 'last on',
+                         "type": "string",
+                         'description': 'datetime of last on (ISO8601)',
+                         'readOnly': True,
+                     }))
+
+        self.last_off = Value(in_gpio.last_off.strftime("%Y-%m-%dT%H:%M:%S"))
+        self.add_property(
+            Property(self,
+                     'last_off',
+                     self.last_off,
+                     metadata={
+                         'title': 'last off',
+                         "type": "string",
+                         'description': 'datetime of last off (ISO8601)',
+                         'readOnly': True,
+                     }))
+
+        self.last_change = Value(in_gpio.last_change.strftime("%Y-%m-%dT%H:%M:%S"))
+        self.add_property(
+            Property(self,
+                     'last_change',
+                     self.last_change,
+                     metadata={
+                         'title': 'last change',
+                         "type": "string",
+                         'description': 'datetime of last change (ISO8601)',
+                         'readOnly': True,
+                     }))
+
+        self.statistics = Value(in_gpio.statistics())
+        self.add_property(
+            Property(self,
+                     'statistics',
+                     self.statistics,
+                     metadata={
+                         'title': 'statistics',
+                         "type": "object",
+                         'description': 'windowed statistics per window (duty cycle, on/off seconds, edge count and rate, pulse widths)',
+                         'readOnly': True,
+                     }))
+
+        self.bridge = bridge
+        if bridge is None:
+            self.subscription = self.in_gpio.register_listener(self.on_value_changed)
+        else:
+            self.subscription = bridge.subscribe(lambda event: self._on_value_changed(), names=[in_gpio.name])
+        self.__statistics_callback = tornado.ioloop.PeriodicCallback(self._refresh_statistics, 10 * 1000)
+        self.__statistics_callback.start()
+
+    def close(self):
+        self.__statistics_callback.stop()
+        if self.__flush_handle is not None:
+            self.ioloop.remove_timeout(self.__flush_handle)
+            self.__flush_handle = None
+        unsubscribe(self)
+
+    def on_value_changed(self):
+        self.ioloop.add_callback(self._on_value_changed)
+
+    def _refresh_statistics(self):
+        self.statistics.notify_of_external_update(self.in_gpio.statistics())
+
+    def _on_value_changed(self):
+        entry = state_snapshot.get(self.in_gpio.name)
+        self.is_on.notify_of_external_update(entry.on)
+        self.last_on.notify_of_external_update(entry.last_on)
+        self.last_off.notify_of_external_update(entry.last_off)
+        self.last_change.notify_of_external_update(entry.last_change)
+        self._refresh_statistics()
+
+    def property_notify(self, property_):
+        # collect instead of sending one message per property and subscriber
+        self.__pending_properties[property_.name] = property_
+        self.__pending_updates += 1
+        if self.__flush_handle is None:
+            self.__flush_handle = self.ioloop.call_later(self.coalesce_window_ms / 1000, self.__flush)
+
+    def __flush(self):
+        self.__flush_handle = None
+        if len(self.__pending_properties) == 0:
+            return
+        message = json.dumps({
+            'messageType': 'propertyStatus',
+            'data': {name: property_.get_value() for name, property_ in self.__pending_properties.items()}
+        })
+        subscribers = list(self.subscribers)
+        self.messages_sent += len(subscribers)
+        self.messages_saved += (self.__pending_updates - 1) * len(subscribers)
+        self.__sent_counter.inc(len(subscribers))
+        self.__saved_counter.inc((self.__pending_updates - 1) * len(subscribers))
+        self.__pending_properties = {}
+        self.__pending_updates = 0
+        start = perf_counter()
+        for subscriber in subscribers:
+            try:
+                subscriber.write_message(message)
+            except Exception as e:
+                logging.warning("could not send property update of " + self.in_gpio.name + ": " + str(e))
+        self.__flush_histogram.observe(perf_counter() - start)
+
+
+
+class CounterThing(Thing):
+
+    def __init__(self, counter: PulseCounter, refresh_interval_ms: int = 1000):
+        """
+        Args:
+            refresh_interval_ms: interval of updating the properties. Pulses are not published one by one
+        """
+        Thing.__init__(
+            self,
+            'urn:dev:ops:gpio_counter-1',
+            'Counter ' + counter.name,
+            ['MultiLevelSensor'],
+            ""
+        )
+
+        self.counter = counter
+
+        self.count = Value(counter.count)
+        self.add_property(
+            Property(self,
+                     'count',
+                     self.count,
+                     metadata={
+                         'title': 'count',
+                         "type": "integer",
+                         'description': 'cumulative number of pulses (kept across restarts)',
+                         'readOnly': True,
+                     }))
+
+        self.pulses_per_sec = Value(0.0)
+        self.add_property(
+            Property(self,
+                     'pulses_per_sec',
+                     self.pulses_per_sec,
+                     metadata={
+                         '@type': 'LevelProperty',
+                         'title': 'pulses per second',
+                         "type": "number",
+                         'description': 'pulses of the last second',
+                         'readOnly': True,
+                     }))
+
+        self.pulses_per_min = Value(0.0)
+        self.add_property(
+            Property(self,
+                     'pulses_per_min',
+                     self.pulses_per_min,
+                     metadata={
+                         'title': 'pulses per minute',
+                         "type": "number",
+                         'description': 'pulses of the last minute',
+                         'readOnly': True,
+                     }))
+
+        self.frequency = Value(0.0)
+        self.add_property(
+            Property(self,
+                     'frequency',
+                     self.frequency,
+                     metadata={
+                         'title': 'frequency',
+                         "type": "number",
+                         'unit': 'hertz',
+                         'description': 'instantaneous frequency derived from the last interval between two pulses',
+                         'readOnly': True,
+                     }))
+
+        self.__refresh_callback = tornado.ioloop.PeriodicCallback(self._refresh, refresh_interval_ms)
+        self.__refresh_callback.start()
+
+    def close(self):
+        self.__refresh_callback.stop()
+        for subscriber in list(self.subscribers):
+            subscriber.close()
+
+    def _refresh(self):
+        state = self.counter.state()
+        self.count.notify_of_external_update(state['count'])
+        self.pulses_per_sec.notify_of_external_update(state['pulses_per_sec'])
+        self.pulses_per_min.notify_of_external_update(state['pulses_per_min'])
+        self.frequency.notify_of_external_update(state['frequency_hz'])
+
+
+
+def create_thing(gpio, bridge: Optional[LoopBridge] = None, coalesce_window_ms: int = 20) -> Thing:
+    if isinstance(gpio, OutGpio):
+        return OutThing(gpio, bridge=bridge)
+    elif isinstance(gpio, InGpio):
+        return InThing(gpio, coalesce_window_ms=coalesce_window_ms, bridge=bridge)
+    elif isinstance(gpio, PulseCounter):
+        return CounterThing(gpio)
+    else:
+        return GroupThing(gpio, bridge=bridge)
+
+
+
+class ReloadableThings(MultipleThings):
+    """
+    Things of pins which are added and removed at runtime. A removed thing leaves an empty slot and a re-created
+    pin takes the slot of its predecessor, so the hrefs of all other things are kept
+    """
+
+    def __init__(self, gpios: List[Any], name: str, bridge: Optional[LoopBridge] = None, coalesce_window_ms: int = 20):
+        """
+        Args:
+            coalesce_window_ms: coalescing window of the property changes of input things (see InThing)
+        """
+        self.bridge = bridge
+        self.coalesce_window_ms = coalesce_window_ms
+        self.ioloop = tornado.ioloop.IOLoop.current()
+        self.gpios = list(gpios)
+        super().__init__([create_thing(gpio, bridge, coalesce_window_ms) for gpio in gpios], name)
+
+    def on_pins_changed(self, removed: List[Any], added: List[Any]):
+        self.ioloop.add_callback(self.update, removed, added)
+
+    def get_things(self):
+        return [thing for thing in self.things if thing is not None]
+
+    def update(self, removed: List[Any], added: List[Any]):
+        """
+        Has to be called on the ioloop
+        """
+        slots = {}
+        for index, gpio in enumerate(self.gpios):
+            if gpio is not None and any(gpio is removed_gpio for removed_gpio in removed):
+                self.things[index].close()
+                self.things[index] = None
+                self.gpios[index] = None
+                slots[gpio.name] = index
+        for gpio in added:
+            index = slots.pop(gpio.name, len(self.things))
+            if index == len(self.things):
+                self.things.append(None)
+                self.gpios.append(None)
+            thing = create_thing(gpio, self.bridge, self.coalesce_window_ms)
+            thing.set_href_prefix('/' + str(index))
+            self.things[index] = thing
+            self.gpios[index] = gpio
+
+
+
+class GpioWebThingServer(WebThingServer):
+
+    def start(self):
+        # serves requests first. The mDNS registration (probing and announcing take seconds) runs in the background
+        self.server.listen(self.port)
+        Thread(target=self.__register_mdns, daemon=True).start()
+        tornado.ioloop.IOLoop.current().start()
+
+    def __register_mdns(self):
+        try:
+            self.service_info = ServiceInfo('_webthing._tcp.local.',
+                                            '{}._webthing._tcp.local.'.format(self.name),
+                                            addresses=[socket.inet_aton(get_ip())],
+                                            port=self.port,
+                                            properties={'path': '/'},
+                                            server='{}.local.'.format(socket.gethostname()))
+            self.zeroconf = Zeroconf()
+            self.zeroconf.register_service(self.service_info)
+        except Exception as e:
+            logging.error("mDNS registration of the webthing server failed: " + str(e))
+
+    def stop(self):
+        if getattr(self, "zeroconf", None) is not None:
+            self.zeroconf.unregister_service(self.service_info)
+            self.zeroconf.close()
+        self.server.stop()
@@ -1,17 +1,339 @@
 import json
+import socket
 import threading
 import logging
+import selectors
+from collections import deque
+from dataclasses import dataclass
+from time import monotonic, perf_counter
 from urllib.parse import urlparse, parse_qs
-from http.server import HTTPServer, BaseHTTPRequestHandler
-from typing import Dict, Any
-from gpio_manager import OutGpio, InGpio # Ensure these match your local file
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Dict, Any, Optional, List, Iterable
+from datetime import datetime, UTC
+from event_history import EventHistory, parse_time, start_of_today
+from gpio_metrics import registry as metrics
+from pulse_counter import PulseCounter
+from gpio_manager import OutGpio, InGpio, OutGpioGroup, EventBus, GpioEvent, StateSnapshot, PinSnapshot, event_bus, state_snapshot # Ensure these match your local file
+
+
+
+def event_payload(event: GpioEvent) -> str:
+    return json.dumps({'seq': event.seq, 'name': event.name, 'type': event.kind, 'value': event.on, 'time': event.time.isoformat()})
+
+
+def sse_frame(seq: int, payload: str) -> bytes:
+    return ("id: " + str(seq) + "\nevent: change\ndata: " + payload + "\n\n").encode("utf-8")
+
+
+def long_poll_body(seq: int, events: List[str]) -> bytes:
+    return ('{"seq": ' + str(seq) + ', "events": [' + ", ".join(events) + ']}').encode("utf-8")
+
+
+# shared by the change streams of the threaded and the loop web server
+MAX_CLIENT_BUFFER = 256 * 1024    # event stream clients with more unsent data are dropped
+HEARTBEAT_SEC = 15
+KEEP_ALIVE = b": keep-alive\n\n"
+
+
+
+@dataclass(frozen=True)
+class EventsQuery:
+    """
+    Query of an /events request. A long-poll request if wait_sec is set, otherwise a Server-Sent Events stream
+    """
+    names: Optional[List[str]]
+    wait_sec: Optional[float] = None
+    since: Optional[int] = None            # long-poll: changes newer than this seq (default: the latest one)
+    last_event_id: Optional[int] = None    # SSE: changes to replay on a reconnect
+
+    @staticmethod
+    def parse(query_params: Dict[str, List[str]], last_event_id: Optional[str] = None) -> 'EventsQuery':
+        """
+        Args:
+            last_event_id: the Last-Event-ID header, which takes precedence over the last_event_id param
+        Raises ValueError on an invalid number
+        """
+        names = query_params['names'][0].split(",") if 'names' in query_params else None
+        if 'wait' in query_params:
+            # long-poll: /events?wait=<seconds>&since=<seq>
+            return EventsQuery(names,
+                               wait_sec=min(float(query_params['wait'][0]), 300),
+                               since=int(query_params['since'][0]) if 'since' in query_params else None)
+        last_event_id = last_event_id or (query_params['last_event_id'][0] if 'last_event_id' in query_params else None)
+        return EventsQuery(names, last_event_id=None if last_event_id is None else int(last_event_id))
+
+
+
+class ChangeRing:
+    """
+    Bounded ring buffer of recent pin changes used by the change streams of both web servers for long-poll
+    requests and reconnecting Server-Sent Events clients. Not thread-safe; the change stream guards it
+    """
+
+    def __init__(self, size: int = 1000):
+        self.__ring = deque(maxlen=size)    # (seq, name, json payload)
+        self.latest_seq = 0
+
+    def append(self, event: GpioEvent) -> str:
+        """
+        Returns the json payload of the change
+        """
+        payload = event_payload(event)
+        self.__ring.append((event.seq, event.name, payload))
+        self.latest_seq = event.seq
+        return payload
+
+    def events_since(self, since: int, names: Optional[Iterable[str]] = None) -> List[str]:
+        # the whole ring is scanned, as a change may be appended after one with a higher seq
+        return [payload for seq, name, payload in self.__ring if seq > since and (names is None or name in names)]
+
+    def frames_since(self, last_event_id: int, names: Optional[Iterable[str]] = None) -> bytes:
+        return b"".join(sse_frame(seq, payload) for seq, name, payload in self.__ring if seq > last_event_id and (names is None or name in names))
+
+
+
+class SseClient:
+
+    def __init__(self, sock: socket.socket, names: Optional[List[str]]):
+        self.sock = sock
+        self.names = None if names is None else set(names)
+        self.outbuf = bytearray()
+        self.closing = False    # the connection is closed once outbuf is sent
+
+    def accepts(self, name: str) -> bool:
+        return self.names is None or name in self.names
+
+
+
+class LongPollClient(SseClient):
+    """
+    A parked long-poll request. It is answered with the first matching changes, or with none at the deadline
+    """
+
+    def __init__(self, sock: socket.socket, names: Optional[List[str]], deadline: float):
+        super().__init__(sock, names)
+        self.deadline = deadline
+
+    def answer(self, seq: int, events: List[str]):
+        body = long_poll_body(seq, events)
+        self.outbuf += ("HTTP/1.1 200 OK\r\nContent-type: application/json\r\nContent-Length: " + str(len(body)) + "\r\nConnection: close\r\n\r\n").encode("utf-8")
+        self.outbuf += body
+        self.closing = True
+
+
+
+class ChangeStream:
+    """
+    Keeps a bounded ring buffer of recent pin changes and pushes them to Server-Sent Events clients. SSE sockets
+    and waiting long-poll requests are detached from the request threads and served by a single selector thread,
+    so idle subscribers do not occupy a thread each
+    """
+
+    def __init__(self, bus: EventBus, ring_size: int = 1000):
+        self.__ring = ChangeRing(ring_size)
+        self.__clients: Dict[socket.socket, SseClient] = {}
+        self.__lock = threading.Lock()           # guards the ring and the clients, so a client registers without missing a change
+        self.__selector = selectors.DefaultSelector()
+        self.__wakeup_receiver, self.__wakeup_sender = socket.socketpair()
+        self.__wakeup_receiver.setblocking(False)
+        self.__wakeup_sender.setblocking(False)
+        self.__selector.register(self.__wakeup_receiver, selectors.EVENT_READ)
+        bus.subscribe(self.__on_event, max_queue=10000, policy="drop")
+        threading.Thread(target=self.__loop, daemon=True).start()
+
+    @property
+    def client_count(self) -> int:
+        return len(self.__clients)
+
+    @property
+    def latest_seq(self) -> int:
+        return self.__ring.latest_seq
+
+    def __on_event(self, event: GpioEvent):
+        with self.__lock:
+            payload = self.__ring.append(event)
+            frame = sse_frame(event.seq, payload)
+            for client in self.__clients.values():
+                if client.closing or not client.accepts(event.name):
+                    continue
+                if isinstance(client, LongPollClient):
+                    client.answer(event.seq, [payload])
+                else:
+                    client.outbuf += frame
+        self.__wakeup()
+
+    def events_since(self, since: int, names: Optional[List[str]] = None) -> List[str]:
+        with self.__lock:
+            return self.__ring.events_since(since, names)
+
+    def add_poller(self, sock: socket.socket, since: Optional[int], wait_sec: float, names: Optional[List[str]] = None):
+        """
+        Answers a long-poll request with the (json) changes newer than since (default: the latest one). If there are
+        none yet, the socket is parked until a change arrives or wait_sec elapsed
+        """
+        client = LongPollClient(sock, names, monotonic() + wait_sec)
+        sock.setblocking(False)
+        with self.__lock:
+            events = self.__ring.events_since(self.__ring.latest_seq if since is None else since, client.names)
+            if len(events) > 0 or wait_sec <= 0:
+                client.answer(self.__ring.latest_seq, events)
+            self.__clients[sock] = client
+        self.__wakeup()
+
+    def add_client(self, sock: socket.socket, names: Optional[List[str]], last_event_id: Optional[int]):
+        client = SseClient(sock, names)
+        sock.setblocking(False)
+        with self.__lock:
+            if last_event_id is not None:
+                client.outbuf += self.__ring.frames_since(last_event_id, client.names)
+            self.__clients[sock] = client
+        self.__wakeup()
+
+    def __wakeup(self):
+        try:
+            self.__wakeup_sender.send(b"x")
+        except BlockingIOError:
+            pass   # wakeup is already pending
+
+    def __remove(self, sock: socket.socket):
+        with self.__lock:
+            self.__clients.pop(sock, None)
+        try:
+            self.__selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+        try:
+            sock.close()
+        except OSError:
+            pass
+
+    def __expire_pollers(self) -> float:
+        # answers the long-poll requests whose deadline passed. Returns the time until the next deadline
+        now = monotonic()
+        timeout = HEARTBEAT_SEC
+        with self.__lock:
+            for client in self.__clients.values():
+                if isinstance(client, LongPollClient) and not client.closing:
+                    if client.deadline <= now:
+                        client.answer(self.__ring.latest_seq, [])
+                    else:
+                        timeout = min(timeout, client.deadline - now)
+        return timeout
+
+    def __loop(self):
+        next_heartbeat = monotonic() + HEARTBEAT_SEC
+        timeout = HEARTBEAT_SEC
+        while True:
+            try:
+                for key, mask in self.__selector.select(timeout=timeout):
+                    if key.fileobj is self.__wakeup_receiver:
+                        try:
+                            while self.__wakeup_receiver.recv(4096):
+                                pass
+                        except BlockingIOError:
+                            pass
+                    elif mask & selectors.EVENT_READ:
+                        # SSE clients do not send anything after the request. Readable means closed
+                        try:
+                            if not key.fileobj.recv(4096):
+                                self.__remove(key.fileobj)
+                        except OSError:
+                            self.__remove(key.fileobj)
+
+                if monotonic() >= next_heartbeat:
+                    next_heartbeat = monotonic() + HEARTBEAT_SEC
+                    with self.__lock:
+                        for client in self.__clients.values():
+                            if not isinstance(client, LongPollClient):
+                                client.outbuf += KEEP_ALIVE
+                timeout = min(self.__expire_pollers(), max(next_heartbeat - monotonic(), 0))
+                self.__flush()
+            except Exception as e:
+                logging.error("Error in event stream: " + str(e))
+
+    def __flush(self):
+        with self.__lock:
+            clients = list(self.__clients.values())
+        for client in clients:
+            with self.__lock:
+                data = bytes(client.outbuf)
+                client.outbuf.clear()
+            try:
+                sent = client.sock.send(data) if len(data) > 0 else 0
+            except BlockingIOError:
+                sent = 0
+            except OSError:
+                self.__remove(client.sock)
+                continue
+            with self.__lock:
+                client.outbuf[:0] = data[sent:]
+                pending = len(client.outbuf)
+            if pending == 0 and client.closing:
+                self.__remove(client.sock)
+                continue
+            if pending > MAX_CLIENT_BUFFER:
+                logging.warning("dropping slow event stream client")
+                self.__remove(client.sock)
+                continue
+            events = selectors.EVENT_READ | (selectors.EVENT_WRITE if pending > 0 else 0)
+            try:
+                try:
+                    self.__selector.modify(client.sock, events)
+                except KeyError:
+                    self.__selector.register(client.sock, events)
+            except (ValueError, OSError):
+                self.__remove(client.sock)
+
+
+
+class GpioHTTPServer(ThreadingHTTPServer):
+    """
+    ThreadingHTTPServer which allows handlers to detach a connection (e.g. to hand it over to the ChangeStream)
+    instead of closing it when the request is done
+    """
+
+    # hundreds of event stream subscribers may (re)connect at once
+    request_queue_size = 128
+
+    def __init__(self, address, handler):
+        super().__init__(address, handler)
+        self.detached = set()
+
+    def detach(self, request):
+        self.detached.add(request)
+
+    def shutdown_request(self, request):
+        if request in self.detached:
+            self.detached.discard(request)
+        else:
+            super().shutdown_request(request)
+
 
 class SimpleRequestHandler(BaseHTTPRequestHandler):
 
+    # enables keep-alive. Requires a Content-Length header on each response
+    protocol_version = "HTTP/1.1"
+    # headers and body are written separately. Avoid the Nagle/delayed-ACK stall on kept-alive connections
+    disable_nagle_algorithm = True
+
     def log_message(self, format, *args):
         pass # Keep console clean
 
     def do_GET(self):
+        start = perf_counter()
+        try:
+            self._handle_get()
+        finally:
+            self.server.request_histograms["GET"].observe(perf_counter() - start)
+
+    def do_POST(self):
+        start = perf_counter()
+        try:
+            self._handle_post()
+        finally:
+            self.server.request_histograms["POST"].observe(perf_counter() - start)
+
+    def _handle_get(self):
         out_gpios: Dict[str, OutGpio] = self.server.out_gpios
         in_gpios: Dict[str, InGpio] = self.server.in_gpios
 
@@ -22,60 +344,237 @@ class SimpleRequestHandler(BaseHTTPRequestHandler):
         # 1. Handle Output GPIOs (Control)
         if path in out_gpios:
             gpio = out_gpios[path]
-            if 'set' in query_params:
-                val = query_params['set'][0].lower()
-                if val in ['true', '1', 'on']:
-                    gpio.switch(True)
-                else:
-                    gpio.switch(False)
+            try:
+                if 'set' in query_params:
+                    val = query_params['set'][0].lower()
+                    if val in ['true', '1', 'on']:
+                        gpio.switch(True)
+                    else:
+                        gpio.switch(False)
+                elif 'pulse' in query_params:
+                    # ?pulse=<duration_ms>
+                    gpio.pulse(int(query_params['pulse'][0]) / 1000)
+                elif 'blink' in query_params:
+                    # ?blink=<on_ms>,<off_ms>[,<count>]
+                    params = [int(param) for param in query_params['blink'][0].split(",")]
+                    gpio.blink(params[0] / 1000, params[1] / 1000, params[2] if len(params) > 2 else 0)
+                elif 'pwm' in query_params:
+                    # ?pwm=<duty>,<frequency_hz>
+                    duty, frequency_hz = [float(param) for param in query_params['pwm'][0].split(",")]
+                    gpio.pwm(duty, frequency_hz)
+            except (ValueError, IndexError) as e:
+                self._send_json(400, {'error': 'invalid parameter: ' + str(e)})
+                return
+
+            self._send_pin(path)
+            return
 
-            self._send_json(200, {'name': path, 'value': gpio.is_on, 'reverted': gpio.reverted})
+        # 2. Handle GPIO statistics
+        if path.endswith("/stats") and path[:-len("/stats")] in in_gpios:
+            name = path[:-len("/stats")]
+            self._send_json(200, {'name': name, 'statistics': in_gpios[name].statistics(), 'edges': in_gpios[name].edge_counts()})
+            return
+        if path.endswith("/stats") and path[:-len("/stats")] in out_gpios:
+            name = path[:-len("/stats")]
+            self._send_json(200, {'name': name, 'writes': out_gpios[name].write_counters()})
             return
 
-        # 2. Handle Input GPIOs (Read-only)
+        # 3. Handle Input GPIOs (Read-only)
         if path in in_gpios:
-            gpio = in_gpios[path]
-            self._send_json(200, {'name': path, 'value': gpio.on, 'reverted': gpio.reverted, 'last_change': gpio.last_change.isoformat()})
+            self._send_pin(path)
+            return
+
+        # 4. Handle output groups, e.g. /group/relays?set=0b0101
+        if path.startswith("group/") and path[len("group/"):] in self.server.groups:
+            group: OutGpioGroup = self.server.groups[path[len("group/"):]]
+            if 'set' in query_params:
+                try:
+                    group.set(int(query_params['set'][0], 0))
+                except ValueError as e:
+                    self._send_json(400, {'error': 'invalid parameter: ' + str(e)})
+                    return
+            self._send_json(200, {'name': group.name, 'mask': group.mask, 'states': group.states()})
+            return
+
+        # 5. Handle pulse counters, e.g. /counter/water
+        if path.startswith("counter/") and path[len("counter/"):] in self.server.counters:
+            self._send_json(200, self.server.counters[path[len("counter/"):]].state())
+            return
+
+        # 6. Handle persistent history, e.g. /history/door?from=2024-05-01T00:00:00&to=2024-05-02T00:00:00
+        if path.startswith("history/") and (path[len("history/"):] in in_gpios or path[len("history/"):] in out_gpios):
+            self._handle_history(path[len("history/"):], query_params)
+            return
+
+        # 7. Handle change stream (SSE or long-poll)
+        if path == "events":
+            self._handle_events(query_params)
+            return
+
+        # 8. Handle metrics
+        if path == "metrics":
+            self._send(200, "application/openmetrics-text; version=1.0.0; charset=utf-8", metrics.render().encode("utf-8"))
+            return
+
+        # 9. Handle bulk state of all GPIOs
+        if path == "state":
+            snapshot: StateSnapshot = self.server.snapshot
+            self._send_cacheable("application/json", snapshot.json(), snapshot.etag)
             return
 
-        # 3. Handle Index/Home Page
+        # 10. Handle Index/Home Page
+        snapshot: StateSnapshot = self.server.snapshot
+        html = snapshot.cached("html", lambda entries: self._render_index(entries).encode("utf-8"))
+        self._send_cacheable("text/html; charset=utf-8", html, snapshot.etag)
+
+    def _render_index(self, entries: Dict[str, PinSnapshot]) -> str:
         html = "<html><body><h1>GPIO Control Panel</h1><ul>"
         html += "<h3>Inputs</h3>"
-        for name, gpio in in_gpios.items():
-            status = "ON" if gpio.on else "OFF"
-            html += f"<li><a href='/{name}'>{name}</a> (IN {gpio.gpio_number}) - Current: {status} (last change {gpio.last_change.strftime('%Y-%m-%dT%H:%M:%S')})</li>"
+        for name, gpio in self.server.in_gpios.items():
+            entry = entries.get(name)
+            status = "ON" if entry and entry.on else "OFF"
+            html += f"<li><a href='/{name}'>{name}</a> (IN {gpio.gpio_number}) - Current: {status} (last change {entry.last_change if entry else 'Never'}) [<a href='/{name}/stats'>stats</a>]</li>"
 
         html += "<h3>Outputs</h3>"
-        for name, gpio in out_gpios.items():
-            status = "ON" if gpio.on else "OFF"
+        for name, gpio in self.server.out_gpios.items():
+            entry = entries.get(name)
+            status = "ON" if entry and entry.on else "OFF"
             html += f"<li><a href='/{name}'>{name}</a> (OUT {gpio.gpio_number}) - Current: {status} "
-            html += f"[<a href='/{name}?set=true'>ON</a> | <a href='/{name}?set=false'>OFF</a>]</li>"
+            html += f"[<a href='/{name}?set=true'>ON</a> | <a href='/{name}?set=false'>OFF</a> | <a href='/{name}?pulse=1000'>PULSE</a> | <a href='/{name}?blink=500,500'>BLINK</a>] [<a href='/{name}/stats'>stats</a>]</li>"
+
+        if len(self.server.groups) > 0:
+            html += "<h3>Groups</h3>"
+            for name, group in self.server.groups.items():
+                html += f"<li><a href='/group/{name}'>{name}</a> ({', '.join(member.name for member in group.members)}) - Current: {bin(group.mask)} "
+                html += f"[<a href='/group/{name}?set={group.max_mask}'>ALL ON</a> | <a href='/group/{name}?set=0'>ALL OFF</a>]</li>"
+
+        if len(self.server.counters) > 0:
+            html += "<h3>Counters</h3>"
+            for name, counter in self.server.counters.items():
+                html += f"<li><a href='/counter/{name}'>{name}</a> (COUNTER {counter.gpio_number})</li>"
 
         html += "</ul></body></html>"
-        self._send_html(200, html)
+        return html
 
 
-    def _send_html(self, status, message):
-        self.send_response(status)
-        self.send_header("Content-type", "text/html; charset=utf-8")
+    def _handle_history(self, name: str, query_params: Dict[str, List[str]]):
+        history: Optional[EventHistory] = self.server.history
+        if history is None:
+            self._send_json(404, {'error': 'history is disabled'})
+            return
+        try:
+            start = parse_time(query_params['from'][0]) if 'from' in query_params else start_of_today()
+            end = parse_time(query_params['to'][0]) if 'to' in query_params else datetime.now(UTC)
+            limit = int(query_params['limit'][0]) if 'limit' in query_params else 1000
+        except ValueError as e:
+            self._send_json(400, {'error': 'invalid parameter: ' + str(e)})
+            return
+        result = history.summary(name, start, end)
+        result['events'] = history.query(name, start, end, limit)
+        self._send_json(200, result)
+
+    def _handle_events(self, query_params: Dict[str, List[str]]):
+        stream: ChangeStream = self.server.change_stream
+        try:
+            query = EventsQuery.parse(query_params, self.headers.get("Last-Event-ID"))
+        except ValueError as e:
+            self._send_json(400, {'error': str(e)})
+            return
+        if query.wait_sec is not None:
+            # the request is answered by the change stream, which does not block a server thread while waiting
+            self.close_connection = True
+            self.server.detach(self.connection)
+            stream.add_poller(self.connection, query.since, query.wait_sec, query.names)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
         self.end_headers()
-        self.wfile.write(message.encode("utf-8"))
+        self.wfile.flush()
+        self.close_connection = True
+        self.server.detach(self.connection)
+        stream.add_client(self.connection, query.names, query.last_event_id)
+
+    def _handle_post(self):
+        out_gpios: Dict[str, OutGpio] = self.server.out_gpios
+
+        path = urlparse(self.path).path.lstrip("/")
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length < 0:
+                raise ValueError("negative length")
+        except ValueError:
+            # the end of the body is unknown, so the connection can not be kept alive
+            self.close_connection = True
+            self._send_json(400, {'error': 'invalid Content-Length'})
+            return
+        body = self.rfile.read(length)
+
+        # batched switching of outputs, e.g. {"pump": true, "fan": false}
+        if path == "state":
+            try:
+                changes = json.loads(body)
+            except ValueError as e:
+                self._send_json(400, {'error': 'invalid json: ' + str(e)})
+                return
+            if not isinstance(changes, dict):
+                self._send_json(400, {'error': 'expected a json object of output name to state'})
+                return
+            unknown = [name for name in changes.keys() if name not in out_gpios]
+            if len(unknown) > 0:
+                self._send_json(404, {'error': 'unknown outputs: ' + ", ".join(unknown)})
+                return
+            for name, on in changes.items():
+                out_gpios[name].switch(on is True or str(on).lower() in ['true', '1', 'on'])
+            snapshot: StateSnapshot = self.server.snapshot
+            self._send_json(200, {name: snapshot.get(name).data for name in changes.keys()})
+            return
+
+        self._send_json(404, {'error': 'not found'})
+
+    def _send_pin(self, name: str):
+        entry = self.server.snapshot.get(name)
+        if entry is None:
+            self._send_json(503, {'error': 'state of ' + name + ' not available yet'})
+        else:
+            self._send_cacheable("application/json", entry.json, entry.etag)
+
+    def _send_cacheable(self, content_type: str, body: bytes, etag: str):
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self._send(200, content_type, body, {"ETag": etag})
 
     def _send_json(self, status, data: Dict[str, Any]):
+        self._send(status, "application/json", json.dumps(data).encode("utf-8"))
+
+    def _send(self, status, content_type: str, body: bytes, headers: Optional[Dict[str, str]] = None):
         self.send_response(status)
-        self.send_header("Content-type", "application/json")
+        self.send_header("Content-type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for header, value in (headers or {}).items():
+            self.send_header(header, value)
         self.end_headers()
-        self.wfile.write(json.dumps(data).encode("utf-8"))
+        self.wfile.write(body)
 
 class GpioManagerWebServer:
-    def __init__(self, in_gpios: Dict[str, InGpio], out_gpios: Dict[str, OutGpio], host='0.0.0.0', port=8000):
+    def __init__(self, in_gpios: Dict[str, InGpio], out_gpios: Dict[str, OutGpio], host='0.0.0.0', port=8000, bus: Optional[EventBus] = None, snapshot: Optional[StateSnapshot] = None, history: Optional[EventHistory] = None, groups: Optional[Dict[str, OutGpioGroup]] = None, counters: Optional[Dict[str, PulseCounter]] = None):
         self.host = host
         self.port = port
         self.address = (self.host, self.port)
-        self.server = HTTPServer(self.address, SimpleRequestHandler)
+        self.server = GpioHTTPServer(self.address, SimpleRequestHandler)
         # Store references in the server object for the RequestHandler to use
         self.server.out_gpios = out_gpios
         self.server.in_gpios = in_gpios
+        self.server.change_stream = ChangeStream(bus if bus is not None else event_bus)
+        self.server.snapshot = snapshot if snapshot is not None else state_snapshot
+        self.server.history = history
+        self.server.groups = groups if groups is not None else {}
+        self.server.counters = counters if counters is not None else {}
+        self.server.request_histograms = {method: metrics.histogram("gpio_http_request_seconds", "duration of plain web requests", method=method) for method in ["GET", "POST"]}
         self.server_thread = None
 
     def start(self):
@@ -1,169 +1,113 @@
 import sys
-from webthing import (MultipleThings, Property, Thing, Value, WebThingServer)
-from dataclasses import dataclass
-from typing import List
+import os
+import asyncio
+from time import sleep, monotonic
+from typing import List, Optional
 import logging
-import tornado.ioloop
-from gpio_manager import OutGpio, InGpio
-from gpio_manager_web import GpioManagerWebServer
-from gpio_manager_mcp import GpioManagerMCPServer
+from event_history import EventHistory
+from gpio_config import Config, PinRegistry, ConfigWatcher, is_config_file, load_configs, load_rules
+from gpio_manager import event_bus
+from output_state import OutputStateStore
+from pulse_counter import PulseCountStore
+from rule_engine import RuleEngine
+
+
+FRONTENDS = ["webthing", "web", "mcp"]
+
+
+def run_server(name: str, port: int, confs: List[Config], unified: bool = False, frontends: List[str] = FRONTENDS, state_file: str = "", config_file: Optional[str] = None, coalesce_window_ms: int = 20):
+    """
+    Args:
+        unified: serves webthing, the plain web API, MCP and the pin change dispatch on a single asyncio loop
+                 instead of a thread per server, subscriber and input poll loop
+        frontends: served front ends (webthing on port, web on port+1, mcp on port+2). Only their libraries are imported
+        state_file: restores the outputs to their last known state saved in this file instead of switching them off
+        config_file: file of the pin configuration and rules which is reloaded when modified. Only changed pins are re-created
+        coalesce_window_ms: webthing property changes of an input within this window are sent as one message
+    """
+    history_file = os.environ.get("GPIO_HISTORY", "gpio_history.bin")
+    history = EventHistory(history_file) if history_file else None
+    if history is not None:
+        event_bus.add_observer(history.on_event)
+    store = OutputStateStore(state_file) if state_file else None
+    if store is not None:
+        event_bus.add_observer(store.on_event)
+
+    count_file = os.environ.get("GPIO_COUNTS", "gpio_counts.json")
+    count_store = PulseCountStore(count_file) if count_file else None
+
+    registry = PinRegistry(store=store, poll_thread=not unified, count_store=count_store)
+    registry.apply(confs)
+    outs, ins, groups, counters = registry.outs, registry.ins, registry.groups, registry.counters
+    watcher = None
+    if config_file:
+        # the rules of the config file link inputs to outputs in process
+        rule_engine = RuleEngine(event_bus, lambda: {**registry.ins, **registry.outs}, registry.outs)
+        rule_engine.apply(load_rules(config_file))
+
+        def reload(confs: List[Config]):
+            registry.apply(confs)
+            rule_engine.apply(load_rules(config_file))
+        watcher = ConfigWatcher(config_file, reload)
+
+    bridge = None
+    if unified:
+        from gpio_manager_loop import LoopBridge
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        bridge = LoopBridge(event_bus, loop)
+        bridge.call_every(1, lambda: [in_gpio.poll() for in_gpio in list(ins.values()) if monotonic() - in_gpio.last_poll >= in_gpio.poll_interval_sec])
+        if watcher is not None:
+            bridge.call_every(2, watcher.check)
+    elif watcher is not None:
+        watcher.start()
+
+    web_server = None
+    if "web" in frontends:
+        if unified:
+            from gpio_manager_loop import LoopWebServer
+            web_server = LoopWebServer(bridge, port=port+1, in_gpios=ins, out_gpios=outs, history=history, groups=groups, counters=counters)
+        else:
+            from gpio_manager_web import GpioManagerWebServer
+            web_server = GpioManagerWebServer(port=port+1, in_gpios=ins, out_gpios=outs, history=history, groups=groups, counters=counters)
+    mcp_server = None
+    if "mcp" in frontends:
+        from gpio_manager_mcp import GpioManagerMCPServer
+        mcp_server = GpioManagerMCPServer(name, port=port+2, in_gpios=ins, out_gpios=outs, history=history, groups=groups, bridge=bridge, counters=counters)
+    server = None
+    if "webthing" in frontends:
+        from gpio_manager_things import ReloadableThings, GpioWebThingServer
+        things = ReloadableThings(list(outs.values()) + list(ins.values()) + list(groups.values()) + list(counters.values()), "outs", bridge=bridge, coalesce_window_ms=coalesce_window_ms)
+        registry.add_listener(things.on_pins_changed)
+        server = GpioWebThingServer(things, port=port, disable_host_validation=True)
 
-
-@dataclass
-class Config:
-    type: str
-    name: str
-    description: str
-    port: int
-    reverted: bool
-
-    @staticmethod
-    def parse(conf: str):
-        logging.info("parsing " + conf)
-        parts = conf.split(":")
-        try:
-            if len(parts) > 4:
-                return Config(parts[0], parts[1], parts[2], int(parts[3]), bool(parts[4]))
-            elif len(parts) > 3:
-                return Config(parts[0], parts[1], parts[2], int(parts[3]), False)
-            else:
-                return Config(parts[0], parts[1], parts[1], int(parts[2]), False)
-        except Exception as e:
-            logging.error("error parsing '" + conf + "':   " + str(e))
-            raise e
-
-
-class OutThing(Thing):
-
-    # regarding capabilities refer https://iot.mozilla.org/schemas
-    # there is also another schema registry http://iotschema.org/docs/full.html not used by webthing
-
-    def __init__(self, out: OutGpio):
-        Thing.__init__(
-            self,
-            'urn:dev:ops:gpio_out-1',
-            'Out ' + out.name,
-            ['GpioOut'],
-            ""
-        )
-
-        self.ioloop = tornado.ioloop.IOLoop.current()
-        self.out = out
-
-        self.is_on = Value(out.is_on, out.switch)
-        self.add_property(
-            Property(self,
-                     'is-on',
-                     self.is_on,
-                     metadata={
-                         'title': 'is on',
-                         "type": "boolean",
-                         'description': 'True if is on',
-                         'readOnly': False,
-                     }))
-
-    def on_value_changed(self):
-        self.ioloop.add_callback(self._on_value_changed)
-
-    def _on_value_changed(self):
-        pass
-
-
-
-class InThing(Thing):
-
-    # regarding capabilities refer https://iot.mozilla.org/schemas
-    # there is also another schema registry http://iotschema.org/docs/full.html not used by webthing
-
-    def __init__(self, in_gpio: InGpio):
-        Thing.__init__(
-            self,
-            'urn:dev:ops:gpio_in-1',
-            'In ' + in_gpio.name,
-            ['GpioIn'],
-            ""
-        )
-
-        self.ioloop = tornado.ioloop.IOLoop.current()
-        self.in_gpio = in_gpio
-
-        self.is_on = Value(in_gpio.on)
-        self.add_property(
-            Property(self,
-                     'on',
-                     self.is_on,
-                     metadata={
-                         'title': 'is on',
-                         "type": "boolean",
-                         'description': 'True if is on',
-                         'readOnly': True,
-                     }))
-
-        self.last_on = Value(in_gpio.last_on.strftime("%Y-%m-%dT%H:%M:%S"))
-        self.add_property(
-            Property(self,
-                     'last_on',
-                     self.last_on,
-                     metadata={
-                         'title': 'last on',
-                         "type": "string",
-                         'description': 'datetime of last on (ISO8601)',
-                         'readOnly': True,
-                     }))
-
-        self.last_off = Value(in_gpio.last_off.strftime("%Y-%m-%dT%H:%M:%S"))
-        self.add_property(
-            Property(self,
-                     'last_off',
-                     self.last_off,
-                     metadata={
-                         'title': 'last off',
-                         "type": "string",
-                         'description': 'datetime of last off (ISO8601)',
-                         'readOnly': True,
-                     }))
-
-        self.last_change = Value(in_gpio.last_change.strftime("%Y-%m-%dT%H:%M:%S"))
-        self.add_property(
-            Property(self,
-                     'last_change',
-                     self.last_change,
-                     metadata={
-                         'title': 'last change',
-                         "type": "string",
-                         'description': 'datetime of last change (ISO8601)',
-                         'readOnly': True,
-                     }))
-
-        self.in_gpio.register_listener(self.on_value_changed)
-
-    def on_value_changed(self):
-        self.ioloop.add_callback(self._on_value_changed)
-
-    def _on_value_changed(self):
-        self.is_on.notify_of_external_update(self.in_gpio.on)
-        self.last_on.notify_of_external_update(self.in_gpio.last_on.strftime("%Y-%m-%dT%H:%M:%S"))
-        self.last_off.notify_of_external_update(self.in_gpio.last_off.strftime("%Y-%m-%dT%H:%M:%S"))
-        self.last_change.notify_of_external_update(self.in_gpio.last_change.strftime("%Y-%m-%dT%H:%M:%S"))
-
-
-def run_server(name: str, port: int, confs: List[Config]):
-    in_leds = [OutThing(OutGpio(conf.port, conf.name, conf.description, conf.reverted)) for conf in confs if conf.type.lower() == 'out']
-    out_leds = [InThing(InGpio(conf.port, conf.name, conf.description, conf.reverted)) for conf in confs if conf.type.lower() == 'in']
-    leds = in_leds + out_leds
-    server = WebThingServer(MultipleThings(leds, "outs"), port=port, disable_host_validation=True)
-    web_server = GpioManagerWebServer(port=port+1, in_gpios={thing.in_gpio.name: thing.in_gpio for thing in out_leds}, out_gpios={thing.out.name: thing.out for thing in in_leds})
-    mcp_server = GpioManagerMCPServer(name, port=port+2, in_gpios={thing.in_gpio.name: thing.in_gpio for thing in out_leds}, out_gpios={thing.out.name: thing.out for thing in in_leds})
     try:
-        logging.info('starting the server on port ' + str(port))
-        web_server.start()
-        mcp_server.start()
-        server.start()
+        logging.info('starting the server on port ' + str(port) + ' (' + ", ".join(frontends) + (', unified event loop' if unified else '') + ')')
+        if web_server is not None:
+            web_server.start()
+        if mcp_server is not None:
+            if unified:
+                mcp_server.start_on_loop(bridge.loop)
+            else:
+                mcp_server.start()
+        if server is not None:
+            server.start()
+        elif unified:
+            bridge.loop.run_forever()
+        else:
+            while True:
+                sleep(1)
     except KeyboardInterrupt:
         logging.info('stopping the server')
-        web_server.stop()
-        mcp_server.stop()
-        server.stop()
+        for front_end in [web_server, mcp_server, server]:
+            if front_end is not None:
+                front_end.stop()
+        if history is not None:
+            history.close()
+        if store is not None:
+            store.close()
+        if count_store is not None:
+            count_store.close()
         logging.info('done')
 
 
@@ -176,9 +120,19 @@ if __name__ == '__main__':
         port = int(sys.argv[2])
         gpio = sys.argv[3]
         logging.info("gpio: " + gpio)
-        gpio = gpio.replace("_", " ")
-        confs = [Config.parse(conf) for conf in gpio.split("&")]
-        run_server(name, port, confs)
+        config_file = None
+        if is_config_file(gpio):
+            # e.g. pins.yaml. Reloaded if modified
+            config_file = gpio
+            confs = load_configs(config_file)
+        else:
+            gpio = gpio.replace("_", " ")
+            confs = [Config.parse(conf) for conf in gpio.split("&")]
+        run_server(name, port, confs, config_file=config_file,
+                   unified=os.environ.get("GPIO_LOOP", "threads").lower() == "asyncio",
+                   frontends=[frontend.strip().lower() for frontend in os.environ.get("GPIO_FRONTENDS", ",".join(FRONTENDS)).split(",") if frontend.strip()],
+                   state_file=os.environ.get("GPIO_RESTORE_STATE", ""),
+                   coalesce_window_ms=int(os.environ.get("GPIO_COALESCE_MS", "20")))
     except Exception as e:
         logging.error(str(e))
         raise e
@@ -0,0 +1,151 @@
+import os
+from bisect import bisect_left
+from functools import wraps
+from threading import Lock
+from time import perf_counter
+from typing import Callable, Dict, List, Tuple, Optional
+
+
+
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _format_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(labels) + ([extra] if extra is not None else [])
+    if len(pairs) == 0:
+        return ""
+    return "{" + ",".join(name + '="' + str(value).replace("\\", "\\\\").replace('"', '\\"') + '"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+
+class Counter:
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        # relies on the GIL instead of a lock. A lost increment under contention is acceptable for monitoring
+        if self.registry.enabled:
+            self.value += amount
+
+
+
+class Histogram:
+
+    def __init__(self, registry, buckets: Tuple[float, ...]):
+        self.registry = registry
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)   # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        if self.registry.enabled:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> "_Timer":
+        return _Timer(self)
+
+
+
+class _Timer:
+
+    def __init__(self, histogram: Histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.histogram.observe(perf_counter() - self.start)
+
+
+
+class MetricsRegistry:
+    """
+    Low-overhead counters and fixed-bucket histograms rendered in the OpenMetrics text format. Recording is
+    disabled entirely by setting enabled to False (environment variable GPIO_METRICS=off)
+    """
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.__lock = Lock()
+        self.__families: Dict[str, Tuple[str, str, Dict[Labels, object]]] = {}
+        self.__callbacks: List[Tuple[str, str, str, Callable[[], List[Tuple[Dict[str, str], float]]]]] = []
+
+    def __metric(self, name: str, metric_type: str, help_text: str, labels: Dict[str, str], factory: Callable[[], object]):
+        key = tuple(sorted(labels.items()))
+        with self.__lock:
+            family = self.__families.setdefault(name, (metric_type, help_text, {}))
+            if key not in family[2]:
+                family[2][key] = factory()
+            return family[2][key]
+
+    def counter(self, name: str, help_text: str, **labels) -> Counter:
+        return self.__metric(name, "counter", help_text, labels, lambda: Counter(self))
+
+    def histogram(self, name: str, help_text: str, buckets: Tuple[float, ...] = LATENCY_BUCKETS, **labels) -> Histogram:
+        return self.__metric(name, "histogram", help_text, labels, lambda: Histogram(self, buckets))
+
+    def register_callback(self, name: str, metric_type: str, help_text: str, collect: Callable[[], List[Tuple[Dict[str, str], float]]]):
+        """
+        Registers values which are maintained elsewhere (e.g. queue depths or existing counters). collect is called
+        on rendering and returns (labels, value) pairs
+        """
+        with self.__lock:
+            self.__callbacks.append((name, metric_type, help_text, collect))
+
+    def render(self) -> str:
+        lines = []
+        with self.__lock:
+            families = [(name, metric_type, help_text, dict(metrics)) for name, (metric_type, help_text, metrics) in self.__families.items()]
+            callbacks = list(self.__callbacks)
+        for name, metric_type, help_text, metrics in families:
+            lines.append("# TYPE " + name + " " + metric_type)
+            lines.append("# HELP " + name + " " + help_text)
+            for labels, metric in metrics.items():
+                if metric_type == "counter":
+                    lines.append(name + "_total" + _format_labels(labels) + " " + _format_value(metric.value))
+                else:
+                    cumulative = 0
+                    for bound, count in zip(list(metric.buckets) + ["+Inf"], list(metric.counts)):
+                        cumulative += count
+                        lines.append(name + "_bucket" + _format_labels(labels, ("le", str(bound))) + " " + str(cumulative))
+                    lines.append(name + "_count" + _format_labels(labels) + " " + str(metric.count))
+                    lines.append(name + "_sum" + _format_labels(labels) + " " + _format_value(metric.sum))
+        for name, metric_type, help_text, collect in callbacks:
+            lines.append("# TYPE " + name + " " + metric_type)
+            lines.append("# HELP " + name + " " + help_text)
+            for labels, value in collect():
+                lines.append(name + ("_total" if metric_type == "counter" else "") + _format_labels(tuple(sorted(labels.items()))) + " " + _format_value(value))
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry(os.environ.get("GPIO_METRICS", "on").lower() not in ["off", "false", "0"])
+
+
+def timed(histogram: Histogram):
+    """
+    Decorator recording the duration of each call. Keeps the signature of the decorated function
+    """
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                histogram.observe(perf_counter() - start)
+        return wrapper
+    return decorator
@@ -0,0 +1,78 @@
+import heapq
+import logging
+from itertools import count
+from threading import Thread, Condition
+from time import monotonic
+from typing import Callable, List, Tuple
+
+
+
+class Job:
+
+    def __init__(self, due: float, fn: Callable[[], None]):
+        self.due = due
+        self.fn = fn
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+
+class Scheduler:
+    """
+    Executes timed jobs of all outputs (deferred writes, pulses, blinking, software PWM) on a single thread
+    using a heap ordered by due time (monotonic clock). Jobs have to be short; they run one after the other
+    """
+
+    def __init__(self):
+        self.__heap: List[Tuple[float, int, Job]] = []
+        self.__seq = count()
+        self.__condition = Condition()
+        self.__thread = None
+        self.executed = 0
+        self.lateness_max_sec = 0.0
+
+    def call_at(self, due: float, fn: Callable[[], None]) -> Job:
+        job = Job(due, fn)
+        with self.__condition:
+            if self.__thread is None:
+                self.__thread = Thread(target=self.__loop, name="scheduler", daemon=True)
+                self.__thread.start()
+            heapq.heappush(self.__heap, (due, next(self.__seq), job))
+            if self.__heap[0][2] is job:
+                self.__condition.notify()
+        return job
+
+    def call_later(self, delay_sec: float, fn: Callable[[], None]) -> Job:
+        return self.call_at(monotonic() + delay_sec, fn)
+
+    @property
+    def pending(self) -> int:
+        return len(self.__heap)
+
+    def __next_job(self) -> Job:
+        with self.__condition:
+            while True:
+                while self.__heap and self.__heap[0][2].cancelled:
+                    heapq.heappop(self.__heap)
+                if not self.__heap:
+                    self.__condition.wait()
+                    continue
+                wait_sec = self.__heap[0][0] - monotonic()
+                if wait_sec <= 0:
+                    return heapq.heappop(self.__heap)[2]
+                self.__condition.wait(wait_sec)
+
+    def __loop(self):
+        while True:
+            job = self.__next_job()
+            self.lateness_max_sec = max(self.lateness_max_sec, monotonic() - job.due)
+            try:
+                job.fn()
+            except Exception as e:
+                logging.error("Error in scheduled job: " + str(e))
+            self.executed += 1
+
+
+scheduler = Scheduler()
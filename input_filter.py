@@ -0,0 +1,66 @@
+from typing import Dict, List, Optional
+
+
+
+class InputFilter:
+    """
+    Filters the raw samples of an input pin before they become its published state. A sample is a burst of
+    reads (majority_samples reads in a row) whose majority is the candidate level. The candidate is accepted if
+    it has been stable for min_stable_ms (rejects glitches) and the last accepted change is at least debounce_ms
+    ago (suppresses the bouncing of a contact after it switched). If a candidate is not accepted yet, due tells
+    when the pin has to be sampled again, as no further edge may arrive once the contact settled.
+    With the defaults every raw change is passed through
+    """
+
+    def __init__(self, debounce_ms: int = 0, majority_samples: int = 1, min_stable_ms: int = 0):
+        if majority_samples < 1:
+            raise ValueError("majority_samples has to be at least 1")
+        if debounce_ms < 0 or min_stable_ms < 0:
+            raise ValueError("debounce_ms and min_stable_ms must not be negative")
+        self.debounce_sec = debounce_ms / 1000
+        self.majority_samples = majority_samples
+        self.min_stable_sec = min_stable_ms / 1000
+        self.state: Optional[bool] = None
+        self.due: Optional[float] = None   # monotonic time at which the pending candidate can be accepted
+        self.raw_edges = 0
+        self.filtered_edges = 0
+        self.__raw: Optional[bool] = None
+        self.__candidate: Optional[bool] = None
+        self.__candidate_since = 0.0
+        self.__last_change = float("-inf")
+
+    def update(self, levels: List[bool], now: float) -> Optional[bool]:
+        """
+        Feeds a burst of raw reads taken at now (monotonic). Returns the new filtered state if it changed, otherwise None
+        """
+        for level in levels:
+            if self.__raw is not None and level != self.__raw:
+                self.raw_edges += 1
+            self.__raw = level
+        high = sum(1 for level in levels if level)
+        if high * 2 == len(levels):
+            candidate = self.state if self.state is not None else levels[-1]   # a tie keeps the current state
+        else:
+            candidate = high * 2 > len(levels)
+        if candidate != self.__candidate:
+            self.__candidate = candidate
+            self.__candidate_since = now
+
+        if self.state is None:
+            self.state = candidate
+            return candidate
+        if candidate == self.state:
+            self.due = None
+            return None
+        accept_at = max(self.__candidate_since + self.min_stable_sec, self.__last_change + self.debounce_sec)
+        if now < accept_at:
+            self.due = accept_at
+            return None
+        self.due = None
+        self.state = candidate
+        self.__last_change = now
+        self.filtered_edges += 1
+        return candidate
+
+    def counts(self) -> Dict[str, int]:
+        return {"raw": self.raw_edges, "filtered": self.filtered_edges}
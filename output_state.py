@@ -0,0 +1,54 @@
+import os
+import json
+import logging
+from threading import Lock
+from typing import Dict, Optional
+from gpio_manager import GpioEvent
+from gpio_scheduler import Scheduler, Job, scheduler as default_scheduler
+
+
+
+class OutputStateStore:
+    """
+    Keeps the last state of each output in a small json file, so the outputs can be restored after a restart
+    instead of being switched off. Changes are written batched (at most once per write_delay_sec) and atomically
+    (temporary file and rename)
+    """
+
+    def __init__(self, filename: str, write_delay_sec: float = 5, scheduler: Optional[Scheduler] = None):
+        self.filename = filename
+        self.write_delay_sec = write_delay_sec
+        self.scheduler = scheduler if scheduler is not None else default_scheduler
+        self.__lock = Lock()
+        self.__job: Optional[Job] = None
+        self.__states: Dict[str, bool] = {}
+        try:
+            with open(filename) as file:
+                self.__states = {name: on is True for name, on in json.load(file).items()}
+            logging.info("restoring output states from " + filename)
+        except FileNotFoundError:
+            pass
+        except (ValueError, AttributeError) as e:
+            logging.warning("ignoring invalid output state file " + filename + ": " + str(e))
+
+    def get(self, name: str) -> bool:
+        return self.__states.get(name, False)
+
+    def on_event(self, event: GpioEvent):
+        if event.kind == "out":
+            with self.__lock:
+                self.__states[event.name] = event.on
+                if self.__job is None:
+                    self.__job = self.scheduler.call_later(self.write_delay_sec, self.flush)
+
+    def flush(self):
+        with self.__lock:
+            self.__job = None
+            data = json.dumps(self.__states)
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, "w") as file:
+            file.write(data)
+        os.replace(temp_filename, self.filename)
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,197 @@
+import os
+import json
+import logging
+from array import array
+from bisect import bisect_right
+from threading import Lock
+from time import monotonic
+from typing import Dict, Optional
+from gpio_backend import GpioBackend, default_backend, EDGES, PULLS
+from gpio_scheduler import Scheduler, Job, scheduler as default_scheduler
+
+
+
+class PulseCountStore:
+    """
+    Keeps the cumulative count of each pulse counter in a small json file, so counts survive restarts.
+    The counts are written periodically (at most every write_interval_sec, only if changed) and atomically
+    """
+
+    def __init__(self, filename: str, write_interval_sec: float = 60, scheduler: Optional[Scheduler] = None):
+        self.filename = filename
+        self.write_interval_sec = write_interval_sec
+        self.scheduler = scheduler if scheduler is not None else default_scheduler
+        self.__lock = Lock()
+        self.__counters: Dict[str, "PulseCounter"] = {}
+        self.__counts: Dict[str, int] = {}
+        self.__written: Dict[str, int] = {}
+        self.__job: Optional[Job] = None
+        try:
+            with open(filename) as file:
+                self.__counts = {name: int(count) for name, count in json.load(file).items()}
+            self.__written = dict(self.__counts)
+        except FileNotFoundError:
+            pass
+        except (ValueError, AttributeError) as e:
+            logging.warning("ignoring invalid pulse count file " + filename + ": " + str(e))
+
+    def get(self, name: str) -> int:
+        return self.__counts.get(name, 0)
+
+    def add(self, counter: "PulseCounter"):
+        with self.__lock:
+            self.__counters[counter.name] = counter
+            if self.__job is None:
+                self.__job = self.scheduler.call_later(self.write_interval_sec, self.__periodic_flush)
+
+    def remove(self, counter: "PulseCounter"):
+        with self.__lock:
+            if self.__counters.get(counter.name) is counter:
+                del self.__counters[counter.name]
+                self.__counts[counter.name] = counter.count
+        self.flush()
+
+    def __periodic_flush(self):
+        try:
+            self.flush()
+        except Exception as e:
+            logging.error("Error writing pulse count file " + self.filename + ": " + str(e))
+        with self.__lock:
+            self.__job = self.scheduler.call_later(self.write_interval_sec, self.__periodic_flush)
+
+    def flush(self):
+        with self.__lock:
+            for name, counter in self.__counters.items():
+                self.__counts[name] = counter.count
+            if self.__counts == self.__written:
+                return
+            self.__written = dict(self.__counts)
+            data = json.dumps(self.__counts)
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, "w") as file:
+            file.write(data)
+        os.replace(temp_filename, self.filename)
+
+    def close(self):
+        with self.__lock:
+            if self.__job is not None:
+                self.__job.cancel()
+                self.__job = None
+        self.flush()
+
+
+
+class PulseCounter:
+    """
+    Counts the pulses of an input (flow meters, S0 outputs of energy meters, anemometers). The edge callback only
+    stores the time of the pulse into a preallocated ring of timestamps and advances an index, so there is no
+    per-edge bookkeeping beyond that and no change event. Rates and the frequency are computed when they are read
+    by bisecting the ring, which has to hold the pulses of the longest window (one minute) for exact rates
+    """
+
+    def __init__(self, gpio_number: int, name: str, description: str, edge: str = "rising", bouncetime_ms: int = 0, capacity: int = 65536,
+                 backend: Optional[GpioBackend] = None, store: Optional[PulseCountStore] = None, setup: bool = True, pull: str = "off"):
+        """
+        Args:
+            edge: counted edge ('rising', 'falling' or 'both')
+            bouncetime_ms: debounce time of the edge detection. Limits the countable frequency to 1000/bouncetime_ms
+            capacity: size of the timestamp ring (rounded up to a power of two)
+            store: restores and saves the cumulative count
+        """
+        if edge.lower() not in EDGES:
+            raise ValueError("unsupported edge '" + edge + "'. Supported: " + ", ".join(EDGES))
+        if pull.lower() not in PULLS:
+            raise ValueError("unsupported pull '" + pull + "'. Supported: " + ", ".join(PULLS))
+        self.name = name
+        self.description = description
+        self.gpio_number = gpio_number
+        self.edge = edge.lower()
+        self.bouncetime_ms = bouncetime_ms
+        self.pull = pull.lower()
+        self.backend = backend if backend is not None else default_backend()
+        self.store = store
+        self.capacity = 1 << max(capacity - 1, 1).bit_length()
+        self.__mask = self.capacity - 1
+        self.__times = array('d', bytes(8 * self.capacity))
+        self.__index = 0
+        self.__recorded = 0
+        self.__closed = False
+        self.initial_count = store.get(name) if store is not None else 0
+        if setup:
+            self.backend.setup_input(self.gpio_number, self.pull)
+        self.backend.add_edge_detect(self.gpio_number, self.edge, self.__on_edge, self.bouncetime_ms)
+        if store is not None:
+            store.add(self)
+        logging.info("GPIO COUNTER " + name + " registered on " + str(self.gpio_number) + " (count=" + str(self.initial_count) + ")")
+
+    def __on_edge(self, channel):
+        # runs on the interrupt thread for each pulse. Single writer, the readers tolerate a pulse in flight
+        index = self.__index
+        self.__times[index] = monotonic()
+        self.__index = (index + 1) & self.__mask
+        self.__recorded += 1
+
+    @property
+    def count(self) -> int:
+        """
+        cumulative number of pulses including the ones counted before the last restart
+        """
+        return self.initial_count + self.__recorded
+
+    def pulses_per_sec(self, window_sec: float = 1) -> float:
+        """
+        Returns the pulse rate of the last window_sec. If the ring holds less than the window, the rate
+        of the buffered pulses is returned
+        """
+        now = monotonic()
+        index, recorded = self.__index, self.__recorded
+        buffered = min(recorded, self.capacity)
+        if buffered == 0:
+            return 0.0
+        cutoff = now - window_sec
+        times = self.__times
+        if recorded < self.capacity:
+            in_window = index - bisect_right(times, cutoff, 0, index)
+        else:
+            oldest = times[index]
+            if oldest > cutoff:
+                # the window exceeds the ring
+                newest = times[(index - 1) & self.__mask]
+                return (buffered - 1) / (newest - oldest) if newest > oldest else 0.0
+            in_window = (index - bisect_right(times, cutoff, 0, index)) + (self.capacity - bisect_right(times, cutoff, index, self.capacity))
+        return in_window / window_sec
+
+    def pulses_per_min(self) -> float:
+        return self.pulses_per_sec(60) * 60
+
+    def frequency_hz(self) -> float:
+        """
+        Returns the instantaneous frequency derived from the last interval between two pulses. It decays
+        towards 0 once no further pulse arrives within that interval
+        """
+        index, recorded = self.__index, self.__recorded
+        if recorded < 2:
+            return 0.0
+        last = self.__times[(index - 1) & self.__mask]
+        interval = last - self.__times[(index - 2) & self.__mask]
+        interval = max(interval, monotonic() - last)
+        return 1 / interval if interval > 0 else 0.0
+
+    def state(self) -> Dict[str, float]:
+        return {'name': self.name,
+                'count': self.count,
+                'pulses_per_sec': round(self.pulses_per_sec(), 3),
+                'pulses_per_min': round(self.pulses_per_min(), 3),
+                'frequency_hz': round(self.frequency_hz(), 3)}
+
+    def close(self):
+        """
+        Stops counting, saves the count and frees the pin
+        """
+        if self.__closed:
+            return
+        self.__closed = True
+        self.backend.release(self.gpio_number)
+        if self.store is not None:
+            self.store.remove(self)
+        logging.info("GPIO COUNTER " + self.name + " on " + str(self.gpio_number) + " released (count=" + str(self.count) + ")")
@@ -0,0 +1,332 @@
+import logging
+from abc import ABC, abstractmethod
+from threading import RLock
+from time import monotonic
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from gpio_metrics import registry as metrics
+from gpio_manager import OutGpio, EventBus, GpioEvent
+from gpio_scheduler import Scheduler, Job, scheduler as default_scheduler
+from state_buffer import StateBuffer
+
+
+RULE_TYPES = ["follow", "invert", "latch", "timeout_off", "and", "or", "average"]
+
+
+
+class Rule(ABC):
+    """
+    Switches an output depending on the state of one or more operand pins. An operand is the name of an input
+    or output; a leading '!' negates it (e.g. '!night'). evaluate() is called for each change of an operand
+    """
+
+    def __init__(self, name: str, output: str, operands: List[str]):
+        self.name = name
+        self.output = output
+        self.operands = operands
+        self.pins = [operand.lstrip("!") for operand in operands]
+        self.engine: Optional["RuleEngine"] = None
+
+    def value(self, operand: str) -> bool:
+        on = self.engine.state(operand.lstrip("!"))
+        return not on if operand.startswith("!") else on
+
+    def start(self, engine: "RuleEngine"):
+        self.engine = engine
+
+    def stop(self):
+        pass
+
+    @abstractmethod
+    def evaluate(self, event: Optional[GpioEvent]):
+        """
+        Called with the change of an operand, or None to evaluate the current states (e.g. after a reload)
+        """
+        pass
+
+
+
+class FollowRule(Rule):
+    """
+    The output follows an operand (invert: the negated operand)
+    """
+
+    def __init__(self, name: str, output: str, operand: str, invert: bool = False):
+        super().__init__(name, output, [operand])
+        self.invert = invert
+
+    def evaluate(self, event: Optional[GpioEvent]):
+        self.engine.switch(self, self.value(self.operands[0]) != self.invert)
+
+
+
+class LogicRule(Rule):
+    """
+    The output is on if all (and) or any (or) of the operands are on
+    """
+
+    def __init__(self, name: str, output: str, operands: List[str], all_required: bool):
+        super().__init__(name, output, operands)
+        self.all_required = all_required
+
+    def evaluate(self, event: Optional[GpioEvent]):
+        values = [self.value(operand) for operand in self.operands]
+        self.engine.switch(self, all(values) if self.all_required else any(values))
+
+
+
+class LatchRule(Rule):
+    """
+    Each on transition of the operand toggles the output (e.g. a push button switching a light). An optional
+    reset operand switches the output off
+    """
+
+    def __init__(self, name: str, output: str, operand: str, reset: Optional[str] = None):
+        super().__init__(name, output, [operand] + ([reset] if reset else []))
+        self.reset = reset
+
+    def evaluate(self, event: Optional[GpioEvent]):
+        if event is None:
+            return
+        if self.reset and event.name == self.reset.lstrip("!"):
+            if self.value(self.reset):
+                self.engine.switch(self, False)
+        elif self.value(self.operands[0]):
+            self.engine.switch(self, not self.engine.output_state(self))
+
+
+
+class TimeoutOffRule(Rule):
+    """
+    The output is switched on with the operand and switched off timeout_sec after the operand went off
+    (e.g. a light triggered by a motion sensor). A new on transition within the timeout restarts it
+    """
+
+    def __init__(self, name: str, output: str, operand: str, timeout_sec: float):
+        super().__init__(name, output, [operand])
+        self.timeout_sec = timeout_sec
+        self.__job: Optional[Job] = None
+
+    def stop(self):
+        self.__cancel()
+
+    def __cancel(self):
+        if self.__job is not None:
+            self.__job.cancel()
+            self.__job = None
+
+    def evaluate(self, event: Optional[GpioEvent]):
+        self.__cancel()
+        if self.value(self.operands[0]):
+            self.engine.switch(self, True)
+        elif event is not None:
+            self.__job = self.engine.scheduler.call_later(self.timeout_sec, lambda: self.engine.run(self, lambda: self.engine.switch(self, False)))
+
+
+
+class AverageRule(Rule):
+    """
+    The output is on if the operand was on for more than the half of the last window_sec (smooths a flapping
+    sensor, e.g. a rain or level switch). The window is re-evaluated periodically, as it shifts without edges
+    """
+
+    def __init__(self, name: str, output: str, operand: str, window_sec: float):
+        super().__init__(name, output, [operand])
+        self.window_sec = window_sec
+        self.__buffer: Optional[StateBuffer] = None
+        self.__job: Optional[Job] = None
+        self.__stopped = False
+
+    def start(self, engine: "RuleEngine"):
+        super().start(engine)
+        self.__buffer = StateBuffer(self.window_sec, self.value(self.operands[0]))
+        self.__schedule()
+
+    def stop(self):
+        self.__stopped = True
+        if self.__job is not None:
+            self.__job.cancel()
+
+    def __schedule(self):
+        if not self.__stopped:
+            self.__job = self.engine.scheduler.call_later(min(self.window_sec / 10, 1), lambda: self.engine.run(self, self.__recheck))
+
+    def __recheck(self):
+        self.evaluate(None)
+        self.__schedule()
+
+    def evaluate(self, event: Optional[GpioEvent]):
+        now = monotonic()
+        self.__buffer.update(self.value(self.operands[0]), now)
+        self.engine.switch(self, self.__buffer.average(now))
+
+
+
+def parse_rule(data: Dict[str, Any]) -> Rule:
+    """
+    Creates a rule of a rule entry of a config file, e.g. {"type": "timeout_off", "input": "motion", "output": "light", "timeout_sec": 60}
+    """
+    rule_type = str(data.get('type', "")).lower()
+    if rule_type not in RULE_TYPES:
+        raise ValueError("unsupported rule type '" + rule_type + "'. Supported: " + ", ".join(RULE_TYPES))
+    if 'output' not in data:
+        raise ValueError("rule " + str(data.get('name', rule_type)) + " has no output")
+    output = str(data['output'])
+    name = str(data.get('name', rule_type + ":" + output))
+    if rule_type in ["and", "or"]:
+        inputs = [str(operand) for operand in data.get('inputs', [])]
+        if len(inputs) == 0:
+            raise ValueError("rule " + name + " has no inputs")
+        return LogicRule(name, output, inputs, rule_type == "and")
+    if 'input' not in data:
+        raise ValueError("rule " + name + " has no input")
+    operand = str(data['input'])
+    if rule_type == "follow":
+        return FollowRule(name, output, operand)
+    elif rule_type == "invert":
+        return FollowRule(name, output, operand, invert=True)
+    elif rule_type == "latch":
+        return LatchRule(name, output, operand, data.get('reset'))
+    elif rule_type == "timeout_off":
+        return TimeoutOffRule(name, output, operand, float(data['timeout_sec']))
+    else:
+        return AverageRule(name, output, operand, float(data['window_sec']))
+
+
+
+class RuleEngine:
+    """
+    Links inputs to outputs in process. The rules are compiled to an index from pin name to the rules which use
+    the pin; an inline bus observer evaluates only the rules of the changed pin on the publishing thread (e.g. the
+    interrupt thread of an edge), so an output follows an input without a dispatch thread or network round trip
+    """
+
+    def __init__(self, bus: EventBus, pins: Callable[[], Dict[str, Any]], outs: Dict[str, OutGpio], scheduler: Optional[Scheduler] = None):
+        """
+        Args:
+            pins: returns the current pins by name (inputs and outputs), which provide the initial operand states
+            outs: switchable outputs by name. Looked up on each switch, so the dict may be updated by a reload
+        """
+        self.pins = pins
+        self.outs = outs
+        self.scheduler = scheduler if scheduler is not None else default_scheduler
+        self.rules: List[Rule] = []
+        self.fired = 0
+        self.__lock = RLock()
+        self.__index: Dict[str, List[Rule]] = {}
+        self.__states: Dict[str, bool] = {}
+        self.__switches: List[Tuple[Rule, bool]] = []
+        self.__reaction_histogram = metrics.histogram("gpio_rule_reaction_seconds", "delay between a pin change and the resulting output switch of a rule")
+        bus.add_observer(self.__on_event)
+
+    def apply(self, rules: List[Rule]):
+        """
+        Replaces the rules. The new rules are evaluated once against the current states
+        """
+        pins = self.pins()
+        for rule in rules:
+            if rule.output not in self.outs:
+                raise ValueError("output " + rule.output + " of rule " + rule.name + " is not an output")
+            for pin in rule.pins:
+                if pin not in pins:
+                    raise ValueError("unknown pin " + pin + " of rule " + rule.name)
+                if pin == rule.output:
+                    raise ValueError("rule " + rule.name + " uses its own output " + pin)
+        self.__check_cycles(rules)
+        index: Dict[str, List[Rule]] = {}
+        for rule in rules:
+            for pin in set(rule.pins):
+                index.setdefault(pin, []).append(rule)
+        with self.__lock:
+            for rule in self.rules:
+                rule.stop()
+            self.__states = {name: pin.on is True for name, pin in pins.items()}
+            self.rules = list(rules)
+            self.__index = index
+            for rule in self.rules:
+                rule.start(self)
+        for rule in rules:
+            self.run(rule, lambda: rule.evaluate(None))
+        if len(rules) > 0:
+            logging.info(str(len(rules)) + " rule(s) active: " + ", ".join(rule.name for rule in rules))
+
+    @staticmethod
+    def __check_cycles(rules: List[Rule]):
+        """
+        Rejects rules which feed each other in a loop (e.g. a follows b and b inverts a), as switching one output
+        would re-trigger itself synchronously
+        """
+        graph: Dict[str, List[Rule]] = {}    # pin -> rules which switch an output depending on it
+        for rule in rules:
+            for pin in set(rule.pins):
+                graph.setdefault(pin, []).append(rule)
+        visited, path = set(), []
+
+        def visit(pin: str):
+            if pin in path:
+                cycle = path[path.index(pin):] + [pin]
+                raise ValueError("rules form a loop: " + " -> ".join(cycle))
+            if pin in visited:
+                return
+            path.append(pin)
+            for rule in graph.get(pin, []):
+                visit(rule.output)
+            path.pop()
+            visited.add(pin)
+
+        for pin in list(graph.keys()):
+            visit(pin)
+
+    def state(self, name: str) -> bool:
+        return self.__states.get(name, False)
+
+    def output_state(self, rule: Rule) -> bool:
+        out = self.outs.get(rule.output)
+        return out is not None and out.on is True
+
+    def switch(self, rule: Rule, on: bool):
+        """
+        Called by the rules during evaluation. The outputs are switched after the evaluation, outside of the
+        engine lock, as switching publishes a change which may be handled by other rules
+        """
+        self.__switches.append((rule, on))
+
+    def __evaluate(self, rule: Rule, fn: Callable[[], None]):
+        try:
+            fn()
+        except Exception as e:
+            logging.error("Error in rule " + rule.name + ": " + str(e))
+
+    def __take_switches(self) -> List[Tuple[Rule, bool]]:
+        switches = self.__switches
+        self.__switches = []
+        return switches
+
+    def __switch(self, switches: List[Tuple[Rule, bool]]):
+        for rule, on in switches:
+            out = self.outs.get(rule.output)
+            if out is None or out.on == on:
+                continue
+            logging.debug("rule " + rule.name + " switches " + rule.output + " " + ("on" if on else "off"))
+            self.fired += 1
+            out.switch(on)
+
+    def run(self, rule: Rule, fn: Callable[[], None]):
+        """
+        Runs a (timer) evaluation of a rule
+        """
+        with self.__lock:
+            self.__evaluate(rule, fn)
+            switches = self.__take_switches()
+        self.__switch(switches)
+
+    def __on_event(self, event: GpioEvent):
+        rules = self.__index.get(event.name)
+        if rules is None:
+            return
+        with self.__lock:
+            self.__states[event.name] = event.on
+            for rule in rules:
+                self.__evaluate(rule, lambda: rule.evaluate(event))
+            switches = self.__take_switches()
+        self.__switch(switches)
+        self.__reaction_histogram.observe(monotonic() - event.monotonic)
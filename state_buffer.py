@@ -1,44 +1,156 @@
-from datetime import datetime, timedelta
+from bisect import insort, bisect_left
+from collections import deque
+from time import monotonic
+from typing import Optional, Tuple, Dict, Any, List
 
 
 
 class StateBuffer:
+    """
+    Sliding time window of on/off transitions. Times are taken from the monotonic clock, so wall-clock jumps
+    (NTP) do not skew the window. The on and off durations of the buffered segments are accounted incrementally
+    and only the head of the buffer is evicted, which makes update() and average() amortized O(1)
+    """
 
-    def __init__(self, size_sec: int):
-        self.changes = list()
+    def __init__(self, size_sec: int, initial_state: bool = True):
         self.size_sec = size_sec
-        self.update(True)
-
-    def update(self, new_state:bool):
-        self.changes.append((datetime.now(), new_state))
-        self.__compact()
-
-    def __current_state(self) -> bool:
-        return  self.changes[0][1]
-
-    def __compact(self):
-        new_changes = []
-        if len(self.changes) > 1:
-            for i in range(0, len(self.changes)-1):
-                age = (datetime.now() - self.changes[i][0]).total_seconds()
-                if age < self.size_sec:
-                    new_changes.append(self.changes[i])
-            new_changes.append(self.changes[-1])
-            self.changes = new_changes
-
-    def average(self) -> bool:
-        if len(self.changes) == 1:
-            return self.__current_state()
+        self.changes = deque()   # (monotonic time, new state) of each transition, oldest first
+        self.__on_sec = 0.0      # summed up duration of the closed on segments within changes
+        self.__off_sec = 0.0     # summed up duration of the closed off segments within changes
+        self.changes.append((monotonic(), initial_state))
+
+    def update(self, new_state: bool, now: Optional[float] = None):
+        now = monotonic() if now is None else now
+        last_time, last_state = self.changes[-1]
+        if new_state == last_state:
+            return
+        self.__account(last_state, now - last_time)
+        self.changes.append((now, new_state))
+        self.__evict(now)
+
+    def __account(self, state: bool, elapsed_sec: float):
+        if state:
+            self.__on_sec += elapsed_sec
+        else:
+            self.__off_sec += elapsed_sec
+
+    def __evict(self, now: float):
+        window_start = now - self.size_sec
+        # drop segments which ended before the window starts. The newest transition is always kept as it carries the current state
+        while len(self.changes) > 1 and self.changes[1][0] <= window_start:
+            time, state = self.changes.popleft()
+            self.__account(state, -(self.changes[0][0] - time))
+
+    def on_off_sec(self, now: Optional[float] = None) -> Tuple[float, float]:
+        """
+        Returns the on and off duration within the window including the currently open segment
+        """
+        now = monotonic() if now is None else now
+        self.__evict(now)
+        window_start = now - self.size_sec
+        on_sec, off_sec = self.__on_sec, self.__off_sec
+        head_time, head_state = self.changes[0]
+        if len(self.changes) > 1 and head_time < window_start:
+            # the head segment started before the window
+            if head_state:
+                on_sec -= window_start - head_time
+            else:
+                off_sec -= window_start - head_time
+        last_time, last_state = self.changes[-1]
+        open_sec = now - max(last_time, window_start)
+        if last_state:
+            on_sec += open_sec
         else:
-            on_sec = 0
-            off_sec = 0
-            for i in reversed(range(0, len(self.changes))):
-                if i > 0:
-                    elapsed = (self.changes[i][0] - self.changes[i-1][0]).total_seconds()
-                    previous_state = self.changes[i-1][1]
-                    if previous_state:
-                        on_sec += elapsed
-                    else:
-                        off_sec += elapsed
-            return True if on_sec > off_sec else False
+            off_sec += open_sec
+        return max(on_sec, 0.0), max(off_sec, 0.0)
+
+    def average(self, now: Optional[float] = None) -> bool:
+        on_sec, off_sec = self.on_off_sec(now)
+        return on_sec > off_sec
+
+
+
+class StateStatistics(StateBuffer):
+    """
+    StateBuffer which additionally tracks edges and pulse widths (durations of completed on segments) of the window.
+    Pulse widths are kept sorted, so percentiles are answered without rescanning the history
+    """
+
+    def __init__(self, size_sec: int, initial_state: bool = True):
+        self.__edges = deque()    # monotonic time of each edge within the window
+        self.__pulses = deque()   # (end time, width) of each completed on segment, oldest first
+        self.__sorted_widths = []
+        super().__init__(size_sec, initial_state)
+
+    def update(self, new_state: bool, now: Optional[float] = None):
+        now = monotonic() if now is None else now
+        last_time, last_state = self.changes[-1]
+        if new_state == last_state:
+            return
+        super().update(new_state, now)
+        self.__edges.append(now)
+        if last_state:
+            width = now - last_time
+            self.__pulses.append((now, width))
+            insort(self.__sorted_widths, width)
+        self.__evict_stats(now)
+
+    def __evict_stats(self, now: float):
+        window_start = now - self.size_sec
+        while self.__edges and self.__edges[0] < window_start:
+            self.__edges.popleft()
+        while self.__pulses and self.__pulses[0][0] < window_start:
+            _, width = self.__pulses.popleft()
+            del self.__sorted_widths[bisect_left(self.__sorted_widths, width)]
+
+    def __percentile(self, p: float) -> Optional[float]:
+        if not self.__sorted_widths:
+            return None
+        return round(self.__sorted_widths[min(len(self.__sorted_widths) - 1, int(p * len(self.__sorted_widths)))], 4)
+
+    def statistics(self, now: Optional[float] = None) -> Dict[str, Any]:
+        now = monotonic() if now is None else now
+        self.__evict_stats(now)
+        on_sec, off_sec = self.on_off_sec(now)
+        covered_sec = on_sec + off_sec
+        return {
+            'window_sec': self.size_sec,
+            'duty_cycle': round(on_sec / covered_sec, 4) if covered_sec > 0 else 0.0,
+            'on_sec': round(on_sec, 3),
+            'off_sec': round(off_sec, 3),
+            'edges': len(self.__edges),
+            'edge_rate_per_sec': round(len(self.__edges) / self.size_sec, 4),
+            'pulses': len(self.__sorted_widths),
+            'pulse_min_sec': self.__percentile(0),
+            'pulse_max_sec': self.__percentile(1),
+            'pulse_p50_sec': self.__percentile(0.5),
+            'pulse_p95_sec': self.__percentile(0.95)
+        }
+
+
+
+class MultiWindowStatistics:
+    """
+    Maintains StateStatistics for several window sizes at once (e.g. 10 s, 1 min, 15 min)
+    """
+
+    def __init__(self, windows_sec: List[int] = (10, 60, 900), initial_state: bool = False):
+        self.windows = {self.label(size_sec): StateStatistics(size_sec, initial_state) for size_sec in windows_sec}
+
+    @staticmethod
+    def label(size_sec: int) -> str:
+        if size_sec % 3600 == 0:
+            return str(size_sec // 3600) + "h"
+        elif size_sec % 60 == 0:
+            return str(size_sec // 60) + "m"
+        return str(size_sec) + "s"
+
+    def update(self, new_state: bool, now: Optional[float] = None):
+        now = monotonic() if now is None else now
+        for window in self.windows.values():
+            window.update(new_state, now)
+
+    def statistics(self, now: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+        now = monotonic() if now is None else now
+        return {label: window.statistics(now) for label, window in self.windows.items()}
 